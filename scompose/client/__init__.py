@@ -98,6 +98,23 @@ def get_parser():
 
     build = subparsers.add_parser("build", help="Build or rebuild containers")
 
+    build.add_argument(
+        "--jobs",
+        "-j",
+        dest="jobs",
+        type=int,
+        default=1,
+        help="build or pull up to this many images at once, logging each to .scompose/logs",
+    )
+
+    build.add_argument(
+        "--no-cache",
+        dest="no_cache",
+        help="build images from recipes again, without the build cache",
+        default=False,
+        action="store_true",
+    )
+
     # Check
 
     check = subparsers.add_parser(
@@ -122,7 +139,12 @@ def get_parser():
 
     restart = subparsers.add_parser("restart", help="stop and start containers.")
 
-    for sub in [create, up, restart]:
+    # Diff shows what up would recreate, so it takes the same options
+    diff = subparsers.add_parser(
+        "diff", help="show instances that up would create or recreate"
+    )
+
+    for sub in [create, up, restart, diff]:
         sub.add_argument(
             "--read_only",
             dest="read_only",
@@ -139,6 +161,49 @@ def get_parser():
             action="store_true",
         )
 
+    for sub in [create, up]:
+        sub.add_argument(
+            "--no-recreate",
+            dest="no_recreate",
+            help="leave running instances alone, even if their config changed",
+            default=False,
+            action="store_true",
+        )
+
+        sub.add_argument(
+            "--verify",
+            dest="verify",
+            help="check images against their recorded sha256 before starting instances",
+            default=False,
+            action="store_true",
+        )
+
+    for sub in [up, restart]:
+        sub.add_argument(
+            "--rolling",
+            dest="rolling",
+            help="replace replicas a batch at a time, each batch ready before the next",
+            default=False,
+            action="store_true",
+        )
+
+        sub.add_argument(
+            "--max-unavailable",
+            dest="max_unavailable",
+            type=int,
+            default=1,
+            help="with --rolling, replicas of an instance that can be down at once",
+        )
+
+        sub.add_argument(
+            "--max-surge",
+            dest="max_surge",
+            type=int,
+            default=0,
+            help="with --rolling, extra replicas of an instance to start first",
+        )
+
+    for sub in [create, up, restart]:
         sub.add_argument(
             "--bridge",
             default="10.22.0.0/16",
@@ -147,6 +212,14 @@ def get_parser():
             help="the address of the bridge to derive others from.",
         )
 
+        sub.add_argument(
+            "--parallel",
+            dest="parallel",
+            type=int,
+            default=1,
+            help="start up to this many instances at once, each as soon as its dependencies are up",
+        )
+
     # Down or stop
 
     down = subparsers.add_parser("down", help="stop instances")
@@ -162,6 +235,14 @@ def get_parser():
             default=None,
         )
 
+        command.add_argument(
+            "--parallel",
+            dest="parallel",
+            type=int,
+            default=1,
+            help="stop up to this many instances at once, each after instances that depend on it",
+        )
+
     execute = subparsers.add_parser("exec", help="execute a command to an instance")
 
     run = subparsers.add_parser("run", help="run an instance runscript")
@@ -188,10 +269,120 @@ def get_parser():
         action="store_true",
     )
 
-    subparsers.add_parser("ps", help="list instances")
+    # History
+
+    history = subparsers.add_parser(
+        "history", help="show how long builds and starts took (p50/p95)"
+    )
+
+    history.add_argument(
+        "--clear",
+        dest="clear",
+        help="forget the history.",
+        default=False,
+        action="store_true",
+    )
+
+    # Images
+
+    images = subparsers.add_parser(
+        "images", help="list the images of instances (size, created, arch, id)"
+    )
+
+    images.add_argument(
+        "--labels",
+        dest="labels",
+        help="also show the labels of each image",
+        default=False,
+        action="store_true",
+    )
+
+    # Promote
+
+    promote = subparsers.add_parser(
+        "promote", help="build SIF images from sandboxes built with --sandbox"
+    )
+
+    # Prune
+
+    prune = subparsers.add_parser(
+        "prune", help="remove least recently used images and caches down to a size"
+    )
+
+    prune.add_argument(
+        "--max-size",
+        dest="max_size",
+        default=os.environ.get("SCOMPOSE_PRUNE_MAX_SIZE", "0"),
+        help="the size to keep at most, e.g., 10G (defaults to $SCOMPOSE_PRUNE_MAX_SIZE or 0)",
+    )
+
+    prune.add_argument(
+        "--dry-run",
+        dest="dry_run",
+        help="show what would be removed and the space it frees",
+        default=False,
+        action="store_true",
+    )
+
+    # Verify
+
+    verify = subparsers.add_parser(
+        "verify", help="check images against the sha256 recorded when built or pulled"
+    )
+
+    verify.add_argument(
+        "--jobs",
+        "-j",
+        dest="jobs",
+        type=int,
+        default=None,
+        help="hash up to this many images at once (defaults to the number of cpus)",
+    )
+
+    verify.add_argument(
+        "--update",
+        dest="update",
+        help="record the current sha256 of images instead of checking them",
+        default=False,
+        action="store_true",
+    )
+
+    ps = subparsers.add_parser("ps", help="list instances")
+
+    ps.add_argument(
+        "--watch",
+        "-w",
+        dest="watch",
+        help="keep listing instances, redrawing when they change",
+        default=False,
+        action="store_true",
+    )
+
+    # Sandboxes are built, started from and listed in place of images
+    for sub in [build, create, diff, images, up, restart, verify]:
+        sub.add_argument(
+            "--sandbox",
+            dest="sandbox",
+            help="build images from recipes as a sandbox (folder), and start from it",
+            default=False,
+            action="store_true",
+        )
 
     # Add list of names
-    for sub in [build, create, down, logs, up, restart, stop]:
+    for sub in [
+        build,
+        create,
+        diff,
+        down,
+        history,
+        images,
+        logs,
+        promote,
+        up,
+        restart,
+        stop,
+        verify,
+    ]:
         sub.add_argument(
             "names", nargs="*", help="the names of the instances to target"
         )
@@ -253,12 +444,22 @@ def start():
         from scompose.client.create import main
     elif args.command == "config":
         from scompose.client.config import main
+    elif args.command == "diff":
+        from scompose.client.diff import main
     elif args.command in ["down", "stop"]:
         from scompose.client.down import main
     elif args.command == "exec":
         from scompose.client.exec import main
+    elif args.command == "history":
+        from scompose.client.history import main
+    elif args.command == "images":
+        from scompose.client.images import main
     elif args.command == "logs":
         from scompose.client.logs import main
+    elif args.command == "promote":
+        from scompose.client.promote import main
+    elif args.command == "prune":
+        from scompose.client.prune import main
     elif args.command == "ps":
         from scompose.client.ps import main
     elif args.command == "restart":
@@ -269,6 +470,8 @@ def start():
         from scompose.client.shell import main
     elif args.command == "up":
         from scompose.client.up import main
+    elif args.command == "verify":
+        from scompose.client.verify import main
 
     # Pass on to the correct parser
     return_code = 0
@@ -21,8 +21,11 @@ def main(args, parser, extra):
     """
     # Initialize the project
     project = Project(
-        filename=args.file, name=args.project_name, env_file=args.env_file
+        filename=args.file,
+        name=args.project_name,
+        env_file=args.env_file,
+        sandbox=args.sandbox,
     )
 
     # Builds any containers into folders
-    project.build(args.names)
+    project.build(args.names, jobs=args.jobs, cache=not args.no_cache)
@@ -10,8 +10,8 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import yaml
 
-from scompose.config import merge_config
-from scompose.config.schema import validate_config
+from scompose.config import compile_config
+from scompose.config.schema import get_validator
 from scompose.logger import bot
 
 
@@ -23,16 +23,29 @@ def main(args, parser, extra):
     ==========
         --preview flag to show combined configs.
     """
-
-    # validate compose files
+    # We don't require jsonschema, so alert the user
+    try:
+        get_validator()
+    except ImportError as e:
+        msg = "pip install jsonschema"
+        bot.exit(
+            "jsonschema is required for checking and validation: %s\n %s" % (e, msg)
+        )
+
+    # validate compose files, and the config they merge to, reading each once
+    config, errors = compile_config(args.file)
     for f in args.file:
-        valid = validate_config(f)
-        if valid and not args.preview:
+        found = [x for x in errors if x.filename == f]
+        for error in found:
+            bot.error(str(error))
+        if not found and not args.preview:
             bot.info("%s is valid." % f)
-        elif not valid:
-            bot.exit("%s is not valid." % f)
+
+    if errors:
+        bot.exit(
+            "%s is not valid." % ", ".join(sorted(set(x.filename for x in errors)))
+        )
 
     if args.preview:
         # preview
-        config = merge_config(args.file)
         print(yaml.dump(config, sort_keys=False))
@@ -20,7 +20,10 @@ def main(args, parser, extra):
     """
     # Initialize the project
     project = Project(
-        filename=args.file, name=args.project_name, env_file=args.env_file
+        filename=args.file,
+        name=args.project_name,
+        env_file=args.env_file,
+        sandbox=args.sandbox,
     )
 
     # Create instances, and if none specified, create all
@@ -29,4 +32,7 @@ def main(args, parser, extra):
         writable_tmpfs=not args.read_only,
         bridge=args.bridge,
         no_resolv=args.no_resolv,
+        parallel=args.parallel,
+        recreate=not args.no_recreate,
+        verify=args.verify,
     )
@@ -20,4 +20,4 @@ def main(args, parser, extra):
     )
 
     # Create instances, and if none specified, create all
-    project.down(args.names, args.timeout)
+    project.down(args.names, args.timeout, parallel=args.parallel)
@@ -0,0 +1,24 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+"""
+
+from scompose.project import Project
+
+
+def main(args, parser, extra):
+    """build SIF images from the sandboxes of one or more instances"""
+    # Initialize the project, with the sandboxes as images
+    project = Project(
+        filename=args.file,
+        name=args.project_name,
+        env_file=args.env_file,
+        sandbox=True,
+    )
+    project.promote(args.names)
@@ -0,0 +1,28 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+"""
+
+from scompose.logger import bot
+from scompose.project import Project
+from scompose.utils import parse_size
+
+
+def main(args, parser, extra):
+    """remove least recently used images and caches down to a size"""
+    try:
+        max_size = parse_size(args.max_size)
+    except ValueError as error:
+        bot.exit(str(error))
+
+    # Initialize the project
+    project = Project(
+        filename=args.file, name=args.project_name, env_file=args.env_file
+    )
+    project.prune(max_size=max_size, dry_run=args.dry_run)
@@ -13,11 +13,11 @@ from scompose.project import Project
 
 
 def main(args, parser, extra):
-    """bring one or more instances down"""
+    """list running instances, optionally watching for changes"""
     # Initialize the project
     project = Project(
         filename=args.file, name=args.project_name, env_file=args.env_file
     )
 
     # Create instances, and if none specified, create all
-    project.ps()
+    project.ps(watch=args.watch)
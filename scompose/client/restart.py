@@ -20,11 +20,25 @@ def main(args, parser, extra):
     """
     # Initialize the project
     project = Project(
-        filename=args.file, name=args.project_name, env_file=args.env_file
+        filename=args.file,
+        name=args.project_name,
+        env_file=args.env_file,
+        sandbox=args.sandbox,
     )
 
-    # Create instances, and if none specified, create all
-    project.down(args.names)
+    # A rolling restart replaces running instances a batch at a time
+    if args.rolling:
+        return project.roll(
+            args.names,
+            max_unavailable=args.max_unavailable,
+            max_surge=args.max_surge,
+            writable_tmpfs=not args.read_only,
+            bridge=args.bridge,
+            no_resolv=args.no_resolv,
+        )
+
+    # Stop instances (all if none specified) as many at once as we start them
+    project.down(args.names, parallel=args.parallel)
 
     # Create instances, and if none specified, create all
     project.up(
@@ -32,4 +46,5 @@ def main(args, parser, extra):
         writable_tmpfs=not args.read_only,
         bridge=args.bridge,
         no_resolv=args.no_resolv,
+        parallel=args.parallel,
     )
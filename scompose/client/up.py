@@ -19,7 +19,10 @@ def main(args, parser, extra):
     """
     # Initialize the project
     project = Project(
-        filename=args.file, name=args.project_name, env_file=args.env_file
+        filename=args.file,
+        name=args.project_name,
+        env_file=args.env_file,
+        sandbox=args.sandbox,
     )
 
     # Create instances, and if none specified, create all
@@ -28,4 +31,10 @@ def main(args, parser, extra):
         writable_tmpfs=not args.read_only,
         bridge=args.bridge,
         no_resolv=args.no_resolv,
+        parallel=args.parallel,
+        recreate=not args.no_recreate,
+        verify=args.verify,
+        rolling=args.rolling,
+        max_unavailable=args.max_unavailable,
+        max_surge=args.max_surge,
     )
@@ -0,0 +1,29 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+
+"""
+
+from scompose.logger import bot
+from scompose.project import Project
+
+
+def main(args, parser, extra):
+    """check images against the sha256 recorded when they were built or pulled"""
+    # Initialize the project
+    project = Project(
+        filename=args.file,
+        name=args.project_name,
+        env_file=args.env_file,
+        sandbox=args.sandbox,
+    )
+    failed = project.verify(args.names, jobs=args.jobs, update=args.update)
+    if failed:
+        bot.exit(
+            "%s image(s) failed verification: %s" % (len(failed), " ".join(failed))
+        )
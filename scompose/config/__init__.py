@@ -8,30 +8,243 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 """
 
+import hashlib
+import json
 import os
 
 from scompose.logger import bot
-from scompose.utils import read_yaml
+from scompose.utils import read_json, read_yaml_nodes, write_json
+from scompose.version import __version__
 
+from .schema import get_validator
 
-def merge_config(file_list):
+
+class ConfigError:
+    """
+    A problem with a config file, and where it is.
+    """
+
+    def __init__(self, filename, line, path, message):
+        self.filename = filename
+        self.line = line
+        self.path = path
+        self.message = message
+
+    def __str__(self):
+        location = self.filename
+        if self.line is not None:
+            location = "%s:%s" % (location, self.line)
+        if self.path:
+            return "%s: %s: %s" % (location, ".".join(self.path), self.message)
+        return "%s: %s" % (location, self.message)
+
+    def __repr__(self):
+        return "(config-error:%s)" % self
+
+
+def merge_config(file_list, cache_file=None, validate=False):
     """
     Given one or more config files, merge into one
+
+    Parameters
+    ==========
+    file_list: the config files, later ones override earlier ones
+    cache_file: if given, keep the merged config there, and use it while
+                the files are the same (see load_compiled)
+    validate: if True, exit with every error if the config is not valid
+              (see compile_config). A config from the cache was valid.
+    """
+    if cache_file is not None:
+        config = load_compiled(cache_file, file_list)
+        if config is not None:
+            return config
+
+    config, errors = compile_config(file_list, validate)
+    for error in errors:
+        bot.error(str(error))
+    if errors:
+        bot.exit("%s is not valid." % ", ".join(file_list))
+
+    if cache_file is not None:
+        save_compiled(cache_file, file_list, config)
+    return config
+
+
+def compile_config(file_list, validate=True):
+    """
+    Read config files (each parsed once), merge them, and validate each
+    file and the merged config with the compiled schema. Returns the merged
+    config and a list of ConfigError, each with the file and line it's about.
+
+    Each file only has to be right in what it has, since it can override
+    another. The merged config must have what's required.
+
+    Parameters
+    ==========
+    file_list: the config files, later ones override earlier ones
+    validate: if False, only read and merge them. Without jsonschema, we
+              can't validate, and don't.
     """
-    yaml_files = []
+    sources = []
     for f in file_list:
         try:
             # ensure file exists
             if not os.path.exists(f):
                 bot.exit("%s does not exist." % f)
 
-            # read yaml file
-            yaml_files.append(read_yaml(f, quiet=True))
+            # read yaml file, with the line of each value
+            config, nodes = read_yaml_nodes(f)
+            sources.append((f, config, nodes))
         except Exception:  # ParserError
             bot.exit("Cannot parse %s, invalid yaml." % f)
 
+    if validate:
+        try:
+            get_validator()
+        except ImportError:
+            bot.debug("jsonschema is not installed, not validating the config.")
+            validate = False
+
+    # With one file, the merged config is the file
+    errors = []
+    if validate and len(sources) > 1:
+        for f, config, nodes in sources:
+            errors += get_errors(config, [(f, nodes)], partial=True)
+
     # merge/override yaml properties where applicable
-    return _deep_merge(yaml_files)
+    config = _deep_merge([x[1] for x in sources])
+    if validate:
+        seen = set(str(x) for x in errors)
+        for error in get_errors(config, [(x[0], x[2]) for x in sources]):
+            if str(error) not in seen:
+                errors.append(error)
+    return config, errors
+
+
+def get_errors(config, sources, partial=False):
+    """
+    Validate a config, and return every error found (as a ConfigError)
+    in the order of the files and lines they are about.
+
+    Parameters
+    ==========
+    config: the config (one file, or merged) to validate
+    sources: a list of (filename, nodes) the config was read from
+    partial: if True, don't require anything (see get_validator)
+    """
+    errors = []
+    for error in get_validator(partial).iter_errors(config):
+        path = [str(x) for x in error.absolute_path]
+        filename, line = get_location(list(error.absolute_path), sources)
+        errors.append(ConfigError(filename, line, path, error.message))
+
+    order = {x[0]: idx for idx, x in enumerate(sources)}
+    return sorted(errors, key=lambda x: (order[x.filename], x.line or 0))
+
+
+def get_location(path, sources):
+    """
+    Find the file and line of a path in a config (e.g., ["instances", "app",
+    "ports"]): the last file that has it, or has the most of it.
+    """
+    found = (-1, sources[-1][0], None)
+    for filename, nodes in sources:
+        for node in nodes:
+            depth = 0
+            mark = node.start_mark
+            for part in path:
+                child = None
+                if node.id == "mapping":
+                    for key, value in node.value:
+                        if key.value == str(part):
+                            child, mark = value, key.start_mark
+                elif node.id == "sequence" and isinstance(part, int):
+                    if part < len(node.value):
+                        child = node.value[part]
+                        mark = child.start_mark
+                if child is None:
+                    break
+                node = child
+                depth += 1
+            if depth >= found[0]:
+                found = (depth, filename, mark.line + 1)
+    return found[1], found[2]
+
+
+def get_file_record(filename, digest=True):
+    """
+    Get what a compiled config is valid for, for one file: the path, size,
+    modification time and (if digest) sha256 of the content.
+    """
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    record = [path, stat.st_size, stat.st_mtime_ns, None]
+    if digest:
+        with open(path, "rb") as filey:
+            record[3] = hashlib.sha256(filey.read()).hexdigest()
+    return record
+
+
+def load_compiled(cache_file, file_list):
+    """
+    Load a config compiled (parsed and merged) by an earlier command, if it
+    was compiled from the same files. A file with the same size and
+    modification time is the same, and a file that was only touched (e.g.,
+    by a checkout) is found to be the same by its sha256. Returns None if
+    the config needs to be compiled again. The file is json, so reading one
+    that someone else put in the project folder never runs code.
+
+    Parameters
+    ==========
+    cache_file: the compiled config (see save_compiled)
+    file_list: the config files it should be compiled from
+    """
+    try:
+        compiled = read_json(cache_file)
+        if not isinstance(compiled["config"], dict):
+            return
+        if compiled["version"] != __version__ or len(compiled["files"]) != len(
+            file_list
+        ):
+            return
+        touched = False
+        for filename, old in zip(file_list, compiled["files"]):
+            record = get_file_record(filename, digest=False)
+            if record[:3] == old[:3]:
+                continue
+            if record[0] != old[0]:
+                return
+            if get_file_record(filename)[3] != old[3]:
+                return
+            touched = True
+    except Exception:
+        return
+
+    # Don't read touched files again on the next command
+    if touched:
+        save_compiled(cache_file, file_list, compiled["config"])
+    return compiled["config"]
+
+
+def save_compiled(cache_file, file_list, config):
+    """
+    Save a compiled config (see load_compiled). Not being able to (e.g., in
+    a read only project folder) only means we parse the files again.
+    """
+    try:
+        # Yaml can have what json can't (e.g., keys that aren't strings)
+        if json.loads(json.dumps(config)) != config:
+            bot.debug("Not saving compiled config %s, it isn't json" % cache_file)
+            return
+        compiled = {
+            "version": __version__,
+            "files": [get_file_record(x) for x in file_list],
+            "config": config,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        write_json(compiled, cache_file, print_pretty=False)
+    except Exception as error:
+        bot.debug("Cannot save compiled config %s: %s" % (cache_file, error))
 
 
 def _deep_merge(yaml_files):
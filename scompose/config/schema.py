@@ -8,30 +8,52 @@ with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 """
 
-import sys
+from scompose.utils import read_yaml
 
-from jsonschema.exceptions import ValidationError
+# Validators compiled from the schema (see get_validator)
+_validators = {}
 
-from scompose.utils import read_yaml
 
-# We don't require jsonschema, so catch import error and alert user
-try:
-    from jsonschema import validate
-except ImportError as e:
-    msg = "pip install jsonschema"
-    sys.exit("jsonschema is required for checking and validation: %s\n %s" % (e, msg))
+def get_validator(partial=False):
+    """
+    Get a validator for the compose schema, compiled the first time. We
+    don't require jsonschema, so this raises an ImportError without it.
+
+    Parameters
+    ==========
+    partial: if True, nothing is required, for a file that overrides another
+             (it only has to be right in what it has).
+    """
+    if partial not in _validators:
+        from jsonschema import Draft7Validator
+
+        schema = compose_schema
+        if partial:
+            schema = get_partial_schema(compose_schema)
+        _validators[partial] = Draft7Validator(schema)
+    return _validators[partial]
+
+
+def get_partial_schema(schema):
+    """
+    Get a copy of a schema without anything required.
+    """
+    if isinstance(schema, dict):
+        return {
+            key: get_partial_schema(value)
+            for key, value in schema.items()
+            if key != "required"
+        }
+    if isinstance(schema, list):
+        return [get_partial_schema(x) for x in schema]
+    return schema
 
 
 def validate_config(filepath):
     """
     Validate a singularity-compose.yaml file.
     """
-    try:
-        cfg = read_yaml(filepath, quiet=True)
-        validate(cfg, compose_schema)
-        return True
-    except ValidationError:
-        return False
+    return get_validator().is_valid(read_yaml(filepath, quiet=True))
 
 
 ## Singularity Compose Schema
@@ -48,6 +70,7 @@ instance_build = {
         "recipe": {"type": "string"},
         "context": {"type": "string"},
         "options": string_list,
+        "sandbox": {"type": "boolean"},
     },
 }
 
@@ -56,6 +79,7 @@ instance_network = {
     "properties": {
         "allocate_ip": {"type": "boolean"},
         "enable": {"type": "boolean"},
+        "type": {"type": "string"},
     },
 }
 
@@ -99,17 +123,50 @@ instance_deploy = {
     },
 }
 
+instance_healthcheck = {
+    "type": "object",
+    "properties": {
+        "tcp": {"type": ["string", "number"]},
+        "http": {"type": "string"},
+        "port": {"type": "number"},
+        "exec": {"type": ["string", "array"]},
+        "file": {"type": "string"},
+        "interval": {"type": "number", "minimum": 0},
+        "timeout": {"type": "number", "minimum": 0},
+        "retries": {"type": "number", "minimum": 1},
+        "start_period": {"type": "number", "minimum": 0},
+    },
+}
+
+instance_depends_on = {
+    "oneOf": [
+        string_list,
+        {
+            "type": "object",
+            "additionalProperties": {
+                "type": ["object", "null"],
+                "properties": {
+                    "condition": {"enum": ["service_started", "service_healthy"]},
+                    "replicas": {"type": "number", "minimum": 1},
+                },
+            },
+        },
+    ]
+}
+
 # A single instance
 instance = {
     "type": "object",
     "properties": {
+        "name": {"type": "string"},
         "image": {"type": "string"},
         "build": instance_build,
         "network": instance_network,
         "ports": string_list,
         "volumes": string_list,
         "volumes_from": string_list,
-        "depends_on": string_list,
+        "depends_on": instance_depends_on,
+        "healthcheck": instance_healthcheck,
         "start": instance_start,
         "exec": instance_exec,
         "run": {"oneOf": [instance_run, {"type": "array"}]},
@@ -12,9 +12,12 @@ from __future__ import absolute_import
 import sys
 import time
 
+from scompose.utils import format_size
+
 STREAM = sys.stderr
 
-BAR_TEMPLATE = "%s[%s%s] %i/%i MB - %s\r"
+BAR_TEMPLATE = "%s[%s%s] %i/%i MB - %s"
+BYTES_TEMPLATE = "%s[%s%s] %s/%s %s/s %s"
 BAR_FILLED_CHAR = "-"
 BAR_EMPTY_CHAR = " "
 
@@ -26,6 +29,14 @@ ETA_SMA_WINDOW = 9
 
 
 class ProgressBar:
+    """
+    A progress bar with an ETA from the rate over the last few seconds (a
+    simple moving average), so a slow start or a stall doesn't stick.
+
+    With unit="B" progress is in bytes, shown with the throughput, and the
+    expected size can be unknown (just bytes and throughput are shown).
+    """
+
     def __enter__(self):
         return self
 
@@ -42,6 +53,7 @@ class ProgressBar:
         filled_char=BAR_FILLED_CHAR,
         expected_size=None,
         every=1,
+        unit=None,
     ):
         self.label = label
         self.width = width
@@ -56,8 +68,10 @@ class ProgressBar:
         self.filled_char = filled_char
         self.expected_size = expected_size
         self.every = every
+        self.unit = unit
         self.start = time.time()
-        self.ittimes = []
+        self.samples = [(self.start, 0)]
+        self.rate = 0
         self.eta = 0
         self.etadelta = time.time()
         self.etadisp = self.format_time(self.eta)
@@ -65,57 +79,91 @@ class ProgressBar:
         if self.expected_size:
             self.show(0)
 
-    def show(self, progress, count=None):
+    def update(self, progress, count=None):
+        """
+        Record progress (and optionally the expected size) without showing
+        it, updating the rate and ETA every ETA_INTERVAL.
+        """
         if count is not None:
             self.expected_size = count
-        if self.expected_size is None:
+        if self.expected_size is None and self.unit is None:
             raise Exception("expected_size not initialized")
         self.last_progress = progress
-        if (time.time() - self.etadelta) > ETA_INTERVAL:
-            self.etadelta = time.time()
-            self.ittimes = self.ittimes[-ETA_SMA_WINDOW:] + [
-                -(self.start - time.time()) / (progress + 1)
-            ]
-            self.eta = (
-                sum(self.ittimes)
-                / float(len(self.ittimes))
-                * (self.expected_size - progress)
-            )
+        now = time.time()
+        if (now - self.etadelta) > ETA_INTERVAL:
+            self.etadelta = now
+            self.samples = self.samples[-ETA_SMA_WINDOW:] + [(now, progress)]
+            first, last = self.samples[0], self.samples[-1]
+            self.rate = max(last[1] - first[1], 0) / (last[0] - first[0])
+            remaining = (self.expected_size or 0) - progress
+            self.eta = remaining / self.rate if self.rate and remaining > 0 else 0
             self.etadisp = self.format_time(self.eta)
-        x = int(self.width * progress / self.expected_size)
+
+    def show(self, progress, count=None):
+        self.update(progress, count)
         if not self.hide:
             if (progress % self.every) == 0 or (  # True every "every" updates
                 progress == self.expected_size
             ):  # And when we're done
-                STREAM.write(
-                    BAR_TEMPLATE
-                    % (
-                        self.label,
-                        self.filled_char * x,
-                        self.empty_char * (self.width - x),
-                        progress,
-                        self.expected_size,
-                        self.etadisp,
-                    )
-                )
+                STREAM.write("%s\r" % self.format())
                 STREAM.flush()
 
+    def format(self, display=None, full=False):
+        """
+        Format the bar for the last progress, with the ETA (or another time
+        to display, e.g., the elapsed time when done).
+        """
+        progress = self.last_progress
+        display = display or self.etadisp
+        x = self.width if full else 0
+        if self.expected_size and not full:
+            x = min(int(self.width * progress / self.expected_size), self.width)
+
+        if self.unit is None:
+            return BAR_TEMPLATE % (
+                self.label,
+                self.filled_char * x,
+                self.empty_char * (self.width - x),
+                progress,
+                self.expected_size,
+                display,
+            )
+
+        if not self.expected_size:
+            return "%s%s %s/s" % (
+                self.label,
+                format_size(progress),
+                format_size(self.rate),
+            )
+        return BYTES_TEMPLATE % (
+            self.label,
+            self.filled_char * x,
+            self.empty_char * (self.width - x),
+            format_size(progress),
+            format_size(self.expected_size),
+            format_size(self.rate),
+            display,
+        )
+
+    def get_record(self):
+        """
+        Get the progress as a dict, e.g., to print for another program.
+        """
+        return {
+            "label": self.label,
+            "progress": self.last_progress,
+            "expected": self.expected_size,
+            "rate": round(self.rate, 1),
+            "eta": round(self.eta, 1) if self.expected_size else None,
+            "elapsed": round(time.time() - self.start, 1),
+        }
+
     def done(self):
         self.elapsed = time.time() - self.start
         elapsed_disp = self.format_time(self.elapsed)
         if not self.hide:
             # Print completed bar with elapsed time
-            STREAM.write(
-                BAR_TEMPLATE
-                % (
-                    self.label,
-                    self.filled_char * self.width,
-                    self.empty_char * 0,
-                    self.last_progress,
-                    self.expected_size,
-                    elapsed_disp,
-                )
-            )
+            STREAM.write("%s\r" % self.format(display=elapsed_disp, full=True))
             STREAM.write("\n")
             STREAM.flush()
 
@@ -0,0 +1,208 @@
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import sys
+import threading
+import time
+
+from .message import bot
+from .progress import ProgressBar
+
+STREAM = sys.stderr
+
+# How often to redraw running rows (seconds) in a terminal
+REDRAW_INTERVAL = 1
+
+# How often to print progress of a task when not in a terminal (seconds)
+REPORT_INTERVAL = 5
+
+# States that mean a row is finished
+FINISHED = ["done", "cached", "failed", "skipped"]
+
+
+def format_duration(seconds):
+    """format a duration as 1m02s or 4.2s"""
+    if seconds >= 60:
+        return "%dm%02ds" % divmod(int(seconds), 60)
+    return "%.1fs" % seconds
+
+
+class StatusBoard:
+    """
+    A compact, live status line per named task (e.g., an image being built).
+
+    In a terminal the lines are redrawn in place, so each task keeps one line
+    showing its state and how long it has been running. Otherwise, a line is
+    printed whenever a task changes state, which is friendlier to log files.
+
+    Parameters
+    ==========
+    names: the ordered names of the tasks to show
+    hide: if True, never redraw in place (defaults to not a terminal)
+    """
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
+
+    def __init__(self, names, hide=None):
+        self.names = list(names)
+        self.width = max([len(x) for x in self.names] + [4])
+        self.rows = {name: {"state": "waiting", "start": None} for name in self.names}
+        self.lock = threading.Lock()
+        self.hide = hide
+        if hide is None:
+            try:
+                self.hide = not STREAM.isatty()
+            except AttributeError:
+                self.hide = True
+        self.drawn = False
+        self._stop = threading.Event()
+        self._ticker = None
+
+    def start(self):
+        """
+        Start redrawing running rows every second (terminal only).
+        """
+        if self.hide:
+            return
+        self.draw()
+        self._ticker = threading.Thread(target=self._tick, daemon=True)
+        self._ticker.start()
+
+    def _tick(self):
+        while not self._stop.wait(REDRAW_INTERVAL):
+            self.draw()
+
+    def stop(self):
+        self._stop.set()
+        if self._ticker is not None:
+            self._ticker.join()
+            self._ticker = None
+        self.draw()
+
+    def update(self, name, state, detail=None):
+        """
+        Set the state of a task, e.g., building, done or failed.
+
+        Parameters
+        ==========
+        name: the name of the task
+        state: a short word for the state
+        detail: an optional detail to show (e.g., a log file)
+        """
+        with self.lock:
+            row = self.rows[name]
+            if row["state"] == state and row.get("detail") == detail:
+                return
+            now = time.time()
+            if row["start"] is None and state not in ["waiting", "skipped"]:
+                row["start"] = now
+            if state in FINISHED and row["start"] is not None:
+                row["duration"] = now - row["start"]
+            row["state"] = state
+            row["detail"] = detail
+
+        if self.hide:
+            if state in FINISHED and row.get("bar") is not None:
+                self.report(name)
+            bot.info(self.format(name))
+        else:
+            self.draw()
+
+    def progress(self, name, progress, expected=None):
+        """
+        Set how far a running task is (e.g., bytes pulled), shown as a bar
+        with the throughput and ETA. When not in a terminal, a json line is
+        printed every REPORT_INTERVAL instead, for other programs to follow.
+
+        Parameters
+        ==========
+        name: the name of the task
+        progress: the bytes done so far
+        expected: the bytes expected in total, if known
+        """
+        with self.lock:
+            row = self.rows[name]
+            if row.get("bar") is None:
+                row["bar"] = ProgressBar(width=16, hide=True, unit="B")
+                row["reported"] = time.time()
+            row["bar"].update(progress, expected)
+            report = self.hide and time.time() - row["reported"] >= REPORT_INTERVAL
+
+        if report:
+            self.report(name)
+
+    def report(self, name):
+        """
+        Print the progress of a task as a line of json.
+        """
+        row = self.rows[name]
+        row["reported"] = time.time()
+        record = row["bar"].get_record()
+        record.update({"name": name, "state": row["state"]})
+        del record["label"]
+        bot.info("progress %s" % json.dumps(record, sort_keys=True))
+
+    def duration(self, name):
+        """
+        Return the duration of a task so far (or in total, if finished).
+        """
+        row = self.rows[name]
+        if "duration" in row:
+            return row["duration"]
+        if row["start"] is None:
+            return 0
+        return time.time() - row["start"]
+
+    def format(self, name):
+        row = self.rows[name]
+        line = "%s  %-9s %8s" % (
+            name.ljust(self.width),
+            row["state"],
+            format_duration(self.duration(name)) if row["start"] else "",
+        )
+        if row.get("detail"):
+            line = "%s  %s" % (line, row["detail"])
+        elif row.get("bar") and row["state"] not in FINISHED:
+            line = "%s  %s" % (line, row["bar"].format())
+        return line
+
+    def draw(self):
+        """
+        Redraw all rows in place.
+        """
+        if self.hide:
+            return
+        with self.lock:
+            lines = []
+            if self.drawn:
+                lines.append("\033[%dA" % len(self.names))
+            for name in self.names:
+                lines.append("\r\033[K%s\n" % self.format(name))
+            STREAM.write("".join(lines))
+            STREAM.flush()
+            self.drawn = True
+
+    def summary(self, title="SUMMARY"):
+        """
+        Print durations and states once all tasks are finished.
+        """
+        bot.custom(prefix=title, message="", color="CYAN")
+        for name in self.names:
+            row = self.rows[name]
+            color = "RED" if row["state"] == "failed" else "PURPLE"
+            bot.custom(
+                prefix=name.ljust(self.width),
+                message=self.format(name)[self.width + 2 :],
+                color=color,
+            )
+        return [x for x in self.names if self.rows[x]["state"] == "failed"]
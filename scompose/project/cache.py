@@ -0,0 +1,373 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import threading
+import time
+
+from scompose.logger import bot
+
+from .jsonfile import JsonFile
+
+# Folders and files in a build context that are never part of the key
+CONTEXT_IGNORE = [".git", ".scompose", "__pycache__"]
+
+# Bytes to read at once when hashing a file (hashlib releases the GIL for
+# large updates, so files hashed from several threads are hashed at once)
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# The ioctl to clone a file (a reflink) on filesystems that support it
+FICLONE = 0x40049409
+
+
+def get_cache_dir():
+    """
+    Get the build cache folder, shared by all projects of the user:
+    SCOMPOSE_CACHE if set, otherwise scompose under XDG_CACHE_HOME or ~/.cache
+    """
+    cache_dir = os.environ.get("SCOMPOSE_CACHE")
+    if not cache_dir:
+        cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache"
+        )
+        cache_dir = os.path.join(cache_home, "scompose")
+    return cache_dir
+
+
+def hash_file(path):
+    """
+    Get the sha256 of a file, read in chunks.
+    """
+    digest = hashlib.sha256()
+    buffer = memoryview(bytearray(CHUNK_SIZE))
+    with open(path, "rb", buffering=0) as filey:
+        for size in iter(lambda: filey.readinto(buffer), 0):
+            digest.update(buffer[:size])
+    return digest.hexdigest()
+
+
+def reflink(src, dest):
+    """
+    Clone a file without copying its data (btrfs, xfs...), returning True
+    if the filesystem supports it.
+    """
+    try:
+        with open(src, "rb") as source, open(dest, "wb") as target:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dest):
+            os.remove(dest)
+        return False
+
+
+def link_file(src, dest):
+    """
+    Put a file in place at dest without copying it if we can: a hard link,
+    or a reflink if a hard link isn't allowed, and a copy otherwise. We
+    link to a temporary name next to dest and move it into place, so dest
+    is never half written.
+    """
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        return
+
+    tmpfile = "%s.%s.%s.tmp" % (dest, os.getpid(), threading.get_ident())
+    try:
+        os.link(src, tmpfile)
+    except OSError:
+        if not reflink(src, tmpfile):
+            shutil.copy2(src, tmpfile)
+    os.replace(tmpfile, dest)
+
+    # Moving a link onto the same file does nothing, and leaves it behind
+    if os.path.exists(tmpfile):
+        os.remove(tmpfile)
+
+
+def touch(path):
+    """
+    Record that a file was used, as its access time (see prune). We set it
+    ourselves, since filesystems are often mounted not to, and leave the
+    modification time as it is, since it identifies an image.
+    """
+    try:
+        os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+    except OSError:
+        pass
+
+
+def read_recipe(recipe):
+    """
+    Read the parts of a Singularity recipe that a build depends on: the
+    header (Bootstrap, From...), the sources of %files sections, and if it
+    has a %setup section (which can use anything on the host).
+
+    Parameters
+    ==========
+    recipe: the path to the recipe
+    """
+    header = {}
+    sources = []
+    setup = False
+    section = None
+
+    with open(recipe, "r") as filey:
+        for line in filey:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            if line.startswith("%"):
+                parts = line.split()
+                section = parts[0][1:].lower()
+                setup = setup or section == "setup"
+
+                # Files from another stage (%files from build) aren't on the host
+                if section == "files" and len(parts) > 1:
+                    section = None
+                continue
+
+            if section is None and ":" in line:
+                key, value = line.split(":", 1)
+                header[key.strip().lower()] = value.strip()
+            elif section == "files":
+                try:
+                    sources.append(shlex.split(line)[0])
+                except ValueError:
+                    sources.append(line.split()[0])
+
+    return {"header": header, "sources": sources, "setup": setup}
+
+
+def get_identity(path):
+    """
+    Get what tells a file apart from others and from earlier versions of
+    itself: its size, modification time, inode and device. Inodes are only
+    unique on one device, so files on two mounts can share one.
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_dev]
+
+
+class FileHashes(JsonFile):
+    """
+    Hashes of files, looked up by path. A file is only read again when its
+    size, modification time or inode (and device) changed, so a large build
+    context (or image) isn't read on every up. A hard link of a file we have
+    (e.g., an image linked from the build cache) is found by its inode.
+
+    Each record is the size, modification time, inode and device of the
+    file, and its sha256.
+
+    Parameters
+    ==========
+    filename: the json file to load from and save to
+    """
+
+    pretty = False
+
+    def load(self):
+        super().load()
+        self.inodes = {tuple(x[:4]): x[4] for x in self.data.values() if len(x) == 5}
+
+    def __str__(self):
+        return "(file-hashes:%s files)" % len(self.data)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def get(self, path):
+        """
+        Get the sha256 of a file, from the index if the file is unchanged.
+        """
+        path = os.path.abspath(path)
+        identity = get_identity(path)
+        record = self.data.get(path)
+        if record and len(record) == 5 and record[:4] == identity:
+            return record[4]
+
+        digest = self.inodes.get(tuple(identity))
+        if digest is None:
+            digest = hash_file(path)
+        self.set(path, digest)
+        return digest
+
+    def get_many(self, paths, jobs=None):
+        """
+        Get the sha256 of several files, reading those that changed at the
+        same time. Returns a lookup of path to sha256.
+
+        Parameters
+        ==========
+        paths: the paths of the files
+        jobs: the number of files to read at once (defaults to the cpus)
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        paths = sorted(set(paths), key=lambda x: -os.path.getsize(x))
+        jobs = jobs or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=max(min(jobs, len(paths)), 1)) as executor:
+            return dict(zip(paths, executor.map(self.get, paths)))
+
+    def set(self, path, digest):
+        """
+        Record the sha256 of a file we know already (e.g., a pulled image).
+        """
+        path = os.path.abspath(path)
+        identity = get_identity(path)
+        with self.lock:
+            if self.data.get(path) != identity + [digest]:
+                self.data[path] = identity + [digest]
+                self.changed = True
+            self.inodes[tuple(identity)] = digest
+
+    def save(self):
+        """
+        Write the index if anything changed, without files that are gone.
+        The index only saves reading files again, so if it can't be written
+        we carry on.
+        """
+        with self.lock:
+            if self.changed:
+                for path in [x for x in self.data if not os.path.exists(x)]:
+                    del self.data[path]
+        try:
+            super().save()
+        except OSError as error:
+            bot.warning("Cannot write %s: %s" % (self.filename, error))
+            self.changed = False
+
+
+class BuildCache:
+    """
+    Images built from recipes, stored by a key: the hash of the recipe, the
+    files it copies in from the build context, the build options and the
+    base image. An image with the same key is the same build, so it can be
+    reused by any project (or checkout) instead of being built again.
+
+    Images are linked into place when the cache is on the same filesystem,
+    and copied otherwise (see link_file).
+
+    Parameters
+    ==========
+    root: the cache folder (defaults to get_cache_dir())
+    """
+
+    def __init__(self, root=None):
+        self.root = root or get_cache_dir()
+        self.hashes = FileHashes(os.path.join(self.root, "files.json"))
+
+    def __str__(self):
+        return "(build-cache:%s)" % self.root
+
+    def __repr__(self):
+        return self.__str__()
+
+    def get_key(self, context, recipe, options=None):
+        """
+        Get the key of a build.
+
+        Parameters
+        ==========
+        context: the build context folder
+        recipe: the recipe, relative to the context
+        options: the build options (see Instance.get_build_options)
+        """
+        context = os.path.abspath(context)
+        recipe = os.path.join(context, recipe)
+        parsed = read_recipe(recipe)
+        header = parsed["header"]
+
+        # A local base image is a file, so it is hashed like one
+        base = [header.get("bootstrap"), header.get("from")]
+        if base[0] == "localimage" and base[1]:
+            path = os.path.join(context, base[1])
+            if os.path.exists(path):
+                base.append(self.hashes.get(path))
+
+        files = {}
+        for path in self.get_context_files(context, parsed):
+            files[os.path.relpath(path, context)] = self.hashes.get(path)
+
+        content = json.dumps(
+            {
+                "recipe": self.hashes.get(recipe),
+                "options": [str(x) for x in options or []],
+                "base": base,
+                "files": files,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get_context_files(self, context, parsed):
+        """
+        Get the files of a build context that a build depends on: the
+        sources of %files, or everything (but images) if the recipe has
+        a %setup section.
+        """
+        if parsed["setup"]:
+            paths = [context]
+        else:
+            paths = []
+            for source in parsed["sources"]:
+                source = os.path.join(context, os.path.expanduser(source))
+                paths += sorted(glob.glob(source)) or [source]
+
+        files = []
+        for path in paths:
+            if os.path.isfile(path):
+                files.append(path)
+                continue
+            for root, dirnames, filenames in os.walk(path):
+                dirnames[:] = sorted(x for x in dirnames if x not in CONTEXT_IGNORE)
+                for filename in sorted(filenames):
+                    if parsed["setup"] and filename.endswith(".sif"):
+                        continue
+                    files.append(os.path.join(root, filename))
+        return files
+
+    def get_image(self, key):
+        """
+        Get the cached image for a key, or None if there isn't one.
+        """
+        path = os.path.join(self.root, "images", "%s.sif" % key)
+        if os.path.exists(path):
+            return path
+
+    def add(self, key, image):
+        """
+        Add a built image to the cache, returning its path there.
+        """
+        path = os.path.join(self.root, "images", "%s.sif" % key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        link_file(image, path)
+        return path
+
+    def restore(self, key, image):
+        """
+        Put the cached image for a key in place (e.g., <context>/<name>.sif),
+        returning True if there was one.
+        """
+        cached = self.get_image(key)
+        if cached is None:
+            return False
+        link_file(cached, image)
+        touch(cached)
+        return True
+
+    def save(self):
+        self.hashes.save()
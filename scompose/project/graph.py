@@ -0,0 +1,322 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from collections import deque
+
+
+class DependencyGraph:
+    """
+    A graph of instances and the instances they depend on (depends_on).
+
+    Each node is an instance (a section of the config) with one or more
+    replicas as members. Dependencies are kept between instances rather than
+    replicas, so a graph with thousands of replicas has as many edges as the
+    config has depends_on entries, and ordering is linear in the number of
+    replicas.
+
+    Nodes keep the order they were added in, and everything derived from the
+    graph (ordering, cycles) is stable with respect to it.
+    """
+
+    def __init__(self):
+        self.members = {}
+        self.member_sets = {}
+        self.positions = {}
+        self.edges = {}
+        self.conditions = {}
+
+    def __str__(self):
+        return "(graph:%s instances, %s replicas)" % (len(self), len(self.replicas()))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def __iter__(self):
+        return iter(self.members)
+
+    def __len__(self):
+        return len(self.members)
+
+    def add(self, name, members=None, depends_on=None):
+        """
+        Add an instance to the graph, or add members and dependencies to it.
+
+        Parameters
+        ==========
+        name: the name of the instance (the node)
+        members: replica names that belong to the instance
+        depends_on: names of instances that this instance depends on, or a
+                    lookup of names to conditions (see get_depends_on)
+        """
+        # Members are a list (for order) and a set (to look them up)
+        self.positions.setdefault(name, len(self.positions))
+        self.members.setdefault(name, [])
+        member_set = self.member_sets.setdefault(name, set())
+        self.edges.setdefault(name, [])
+        for member in members or []:
+            if member not in member_set:
+                member_set.add(member)
+                self.members[name].append(member)
+        for dep in depends_on or []:
+            if dep not in self.edges[name]:
+                self.edges[name].append(dep)
+            if isinstance(depends_on, dict):
+                self.conditions[(name, dep)] = depends_on[dep]
+
+    def get_condition(self, name, dep):
+        """
+        Get the condition (service_started or service_healthy) and number of
+        replicas (None for all) for an instance to depend on another.
+        """
+        condition = self.conditions.get((name, dep)) or {}
+        return (
+            condition.get("condition") or "service_started",
+            condition.get("replicas"),
+        )
+
+    def get_healthy(self):
+        """
+        Get the instances that another instance needs to be healthy.
+        """
+        return [
+            dep
+            for name in self.members
+            for dep in self.get_edges(name)
+            if self.get_condition(name, dep)[0] == "service_healthy"
+        ]
+
+    def replicas(self):
+        """
+        Return all replica names, in the order they were added.
+        """
+        return [x for name in self.members for x in self.members[name]]
+
+    def get_edges(self, name):
+        """
+        Return the dependencies of an instance that are in the graph.
+        """
+        return [x for x in self.edges[name] if x in self.members]
+
+    def get_dependents(self):
+        """
+        Return a lookup of each instance to the instances that depend on it.
+        """
+        dependents = {name: [] for name in self.members}
+        for name in self.members:
+            for dep in self.get_edges(name):
+                dependents[dep].append(name)
+        return dependents
+
+    def reverse(self):
+        """
+        Return a graph with the same members and every dependency reversed,
+        e.g., to stop instances after the instances that depend on them.
+        """
+        graph = DependencyGraph()
+        for name in self.members:
+            graph.add(name, self.members[name])
+        for name, dependents in self.get_dependents().items():
+            graph.add(name, depends_on=dependents)
+        return graph
+
+    # Ordering
+
+    def sort(self):
+        """
+        Return instance names so that each comes after its dependencies.
+
+        This is Kahn's algorithm: we take instances without unmet dependencies
+        in the order they were added, so an already ordered config is left as
+        is. Instances in (or behind) a cycle are added at the end.
+        """
+        indegree = {name: len(self.get_edges(name)) for name in self.members}
+        dependents = self.get_dependents()
+        ready = deque(name for name in self.members if indegree[name] == 0)
+        order = []
+
+        while ready:
+            name = ready.popleft()
+            order.append(name)
+            for dependent in dependents[name]:
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    ready.append(dependent)
+
+        placed = set(order)
+        return order + [name for name in self.members if name not in placed]
+
+    def order(self):
+        """
+        Return replica names so that each comes after its dependencies.
+        """
+        return [x for name in self.sort() for x in self.members[name]]
+
+    # Scheduling
+
+    def get_critical_paths(self, durations):
+        """
+        Get the length of the longest chain of work from each instance, that
+        is its own duration plus the longest chain of the instances that
+        depend on it. Starting the longest chains first keeps them from
+        being what everything else waits for at the end.
+
+        Parameters
+        ==========
+        durations: a lookup of instance name to an (estimated) duration
+        """
+        dependents = self.get_dependents()
+        lengths = {}
+        for name in reversed(self.sort()):
+            following = [lengths[x] for x in dependents[name] if x in lengths]
+            lengths[name] = durations.get(name, 0) + max(following or [0])
+        return lengths
+
+    def get_priority(self, durations):
+        """
+        Get the priority of each task from schedule: the critical path of
+        its instance (see get_critical_paths).
+        """
+        lengths = self.get_critical_paths(durations)
+        priority = {}
+        for name in self.members:
+            for member in self.members[name]:
+                priority[member] = lengths[name]
+                priority["%s:healthy" % member] = lengths[name]
+        return priority
+
+    def schedule(self):
+        """
+        Return the tasks, groups and required counts to run the replicas with
+        Scheduler.run(tasks, func, groups=groups, required=required).
+
+        Each replica is a task that depends on groups: the replicas of an
+        instance, and how many of them need to be done. If an instance needs
+        another to be healthy, each replica of that one gets a second task,
+        <replica>:healthy, to wait for its health check. Group names have a
+        colon (instance names can't) so they don't clash with replicas.
+        """
+        tasks = {}
+        groups = {}
+        required = {}
+        healthy = self.get_healthy()
+
+        for name in self.members:
+            deps = []
+            for dep in self.get_edges(name):
+                condition, replicas = self.get_condition(name, dep)
+                suffix = "healthy" if condition == "service_healthy" else "started"
+                group = "%s:%s" % (dep, suffix)
+                if replicas:
+                    group = "%s:%s" % (group, replicas)
+                    required[group] = replicas
+                if suffix == "healthy":
+                    groups[group] = ["%s:healthy" % x for x in self.members[dep]]
+                else:
+                    groups[group] = self.members[dep]
+                deps.append(group)
+
+            for member in self.members[name]:
+                tasks[member] = deps
+                if name in healthy:
+                    groups["%s:start" % member] = [member]
+                    tasks["%s:healthy" % member] = ["%s:start" % member]
+        return tasks, groups, required
+
+    # Cycles
+
+    def find_cycles(self):
+        """
+        Find dependency cycles, returning one path per cycle, e.g.,
+        [["first", "second", "first"]]. An instance that depends on itself
+        is a cycle of one.
+
+        We find strongly connected components (Tarjan's algorithm, without
+        recursion so large graphs are fine) and then the shortest cycle
+        through the first instance of each.
+        """
+        index = {}
+        lowlink = {}
+        on_stack = set()
+        stack = []
+        components = []
+        counter = 0
+
+        for root in self.members:
+            if root in index:
+                continue
+
+            work = [(root, iter(self.get_edges(root)))]
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+
+            while work:
+                name, edges = work[-1]
+                advanced = False
+                for dep in edges:
+                    if dep not in index:
+                        index[dep] = lowlink[dep] = counter
+                        counter += 1
+                        stack.append(dep)
+                        on_stack.add(dep)
+                        work.append((dep, iter(self.get_edges(dep))))
+                        advanced = True
+                        break
+                    elif dep in on_stack:
+                        lowlink[name] = min(lowlink[name], index[dep])
+                if advanced:
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[name])
+
+                if lowlink[name] == index[name]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == name:
+                            break
+                    components.append(component)
+
+        cycles = []
+        for component in components:
+            if len(component) == 1 and component[0] not in self.get_edges(component[0]):
+                continue
+            start = min(component, key=self.positions.get)
+            cycles.append(self._shortest_cycle(start, set(component)))
+        return sorted(cycles, key=lambda x: self.positions[x[0]])
+
+    def _shortest_cycle(self, start, component):
+        """
+        Find the shortest path from an instance back to itself.
+        """
+        previous = {}
+        queue = deque([start])
+        while queue:
+            name = queue.popleft()
+            for dep in self.get_edges(name):
+                if dep not in component:
+                    continue
+                if dep == start:
+                    path = [name]
+                    while path[-1] != start:
+                        path.append(previous[path[-1]])
+                    return [start] + list(reversed(path[:-1])) + [start]
+                if dep not in previous:
+                    previous[dep] = name
+                    queue.append(dep)
@@ -0,0 +1,256 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import os
+import shlex
+import socket
+import subprocess
+import time
+
+from scompose.logger import bot
+
+# Conditions for depends_on, as in docker-compose
+CONDITIONS = ["service_started", "service_healthy"]
+
+# The kinds of probes, only one can be defined for a healthcheck
+PROBES = ["tcp", "http", "exec", "file"]
+
+
+def get_depends_on(params):
+    """
+    Get the depends_on of an instance as an ordered lookup of the names it
+    depends on to a condition, and the number of replicas that need to meet
+    it (None for all). depends_on can be a list of names, or a lookup:
+
+    depends_on:
+      db:
+        condition: service_healthy
+        replicas: 1
+
+    Parameters
+    ==========
+    params: the config section of the instance
+    """
+    depends_on = params.get("depends_on") or []
+    if isinstance(depends_on, list):
+        return {
+            name: {"condition": "service_started", "replicas": None}
+            for name in depends_on
+        }
+
+    lookup = {}
+    for name, options in depends_on.items():
+        options = options or {}
+        condition = options.get("condition", "service_started")
+        if condition not in CONDITIONS:
+            bot.exit(
+                "%s is not a depends_on condition, choose from %s"
+                % (condition, ", ".join(CONDITIONS))
+            )
+        lookup[name] = {"condition": condition, "replicas": options.get("replicas")}
+    return lookup
+
+
+class HealthCheck:
+    """
+    Check if an instance is ready, e.g., before instances that depend on it
+    are started (depends_on with condition service_healthy).
+
+    A tcp, http or file probe runs from the host, in process, so a check is
+    a connect or a request rather than a new process in the container. An
+    exec probe runs a command in the instance, and is healthy if it returns 0.
+
+    healthcheck:
+      tcp: 5432                  # a port, or host:port
+      http: /health              # a path (with port) or a full url
+      port: 8080                 # the port for an http path (default 80)
+      exec: pg_isready           # a command to run in the instance
+      file: ./data/ready         # a file on the host, relative to the project
+      interval: 1                # seconds between probes
+      timeout: 2                 # seconds to wait for one probe
+      retries: 30                # probes before the instance is unhealthy
+      start_period: 0            # seconds to wait before the first probe
+
+    Parameters
+    ==========
+    params: the healthcheck section of the instance
+    host: the address of the instance, for tcp and http probes
+    working_dir: the project working directory, for file probes
+    """
+
+    def __init__(self, params, host="127.0.0.1", working_dir=None):
+        probes = [x for x in PROBES if x in params]
+        if len(probes) != 1:
+            bot.exit("A healthcheck needs one of %s." % ", ".join(PROBES))
+        self.kind = probes[0]
+        self.value = params[self.kind]
+        self.host = host
+        self.port = params.get("port", 80)
+        self.working_dir = working_dir or os.getcwd()
+        self.interval = float(params.get("interval", 1))
+        self.timeout = float(params.get("timeout", 2))
+        self.retries = max(int(params.get("retries", 30)), 1)
+        self.start_period = float(params.get("start_period", 0))
+
+    def __str__(self):
+        return "(healthcheck:%s %s)" % (self.kind, self.value)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def get_address(self):
+        """
+        Get the host and port for a tcp probe.
+        """
+        value = str(self.value)
+        if ":" in value:
+            host, port = value.rsplit(":", 1)
+            return host, int(port)
+        return self.host, int(value)
+
+    def get_url(self):
+        """
+        Get the url for an http probe.
+        """
+        if "://" in self.value:
+            return self.value
+        return "http://%s:%s/%s" % (self.host, self.port, self.value.lstrip("/"))
+
+    def get_exec_command(self, instance):
+        """
+        Get the command for an exec probe in an instance.
+        """
+        command = self.value
+        if not isinstance(command, list):
+            command = shlex.split(command)
+        return instance.client._init_command("exec") + [instance.uri] + command
+
+    def get_path(self):
+        return os.path.join(self.working_dir, os.path.expanduser(self.value))
+
+    # Probes
+
+    def probe(self, instance=None):
+        """
+        Probe once, returning True if healthy.
+
+        Parameters
+        ==========
+        instance: the instance to probe (needed for exec probes)
+        """
+        if self.kind == "file":
+            return os.path.exists(self.get_path())
+
+        if self.kind == "tcp":
+            try:
+                with socket.create_connection(self.get_address(), self.timeout):
+                    return True
+            except OSError:
+                return False
+
+        if self.kind == "http":
+            return self._probe_http()
+
+        command = self.get_exec_command(instance)
+        if instance.sudo:
+            command = ["sudo"] + command
+        try:
+            return (
+                subprocess.run(
+                    command,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    timeout=self.timeout,
+                ).returncode
+                == 0
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return False
+
+    def _probe_http(self):
+        """
+        An http probe is healthy for a response under 400.
+        """
+        import urllib.error
+        import urllib.request
+
+        try:
+            with urllib.request.urlopen(
+                self.get_url(), timeout=self.timeout
+            ) as response:
+                return response.status < 400
+        except (urllib.error.URLError, OSError, ValueError):
+            return False
+
+    def wait(self, instance=None):
+        """
+        Probe until healthy (True), or the retries run out (False).
+        """
+        time.sleep(self.start_period)
+        for attempt in range(self.retries):
+            if attempt:
+                time.sleep(self.interval)
+            if self.probe(instance):
+                return True
+        return False
+
+    # Async
+
+    async def async_probe(self, runtime, instance=None):
+        """
+        Probe once on an event loop, returning True if healthy.
+
+        Parameters
+        ==========
+        runtime: the AsyncRuntime to run exec probes with
+        instance: the instance to probe (needed for exec probes)
+        """
+        import asyncio
+
+        if self.kind == "file":
+            return os.path.exists(self.get_path())
+
+        if self.kind == "tcp":
+            try:
+                _, writer = await asyncio.wait_for(
+                    asyncio.open_connection(*self.get_address()), self.timeout
+                )
+            except (OSError, asyncio.TimeoutError):
+                return False
+            writer.close()
+            return True
+
+        if self.kind == "http":
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._probe_http)
+
+        try:
+            result = await runtime.run_command(
+                self.get_exec_command(instance),
+                sudo=instance.sudo,
+                timeout=self.timeout,
+            )
+        except asyncio.TimeoutError:
+            return False
+        return result["return_code"] == 0
+
+    async def async_wait(self, runtime, instance=None):
+        """
+        Probe on an event loop until healthy (True) or the retries run out.
+        """
+        import asyncio
+
+        await asyncio.sleep(self.start_period)
+        for attempt in range(self.retries):
+            if attempt:
+                await asyncio.sleep(self.interval)
+            if await self.async_probe(runtime, instance):
+                return True
+        return False
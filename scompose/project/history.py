@@ -0,0 +1,129 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from .jsonfile import JsonFile
+
+# The events we record durations for
+EVENTS = ["build", "pull", "promote", "start", "ready"]
+
+# How many durations we keep for each instance and event
+MAX_SAMPLES = 50
+
+
+def get_percentile(values, percent):
+    """
+    Get a percentile of a list of numbers, interpolating between the two
+    closest values (as numpy does by default).
+
+    Parameters
+    ==========
+    values: the numbers
+    percent: the percentile, from 0 to 100
+    """
+    if not values:
+        return
+    values = sorted(values)
+    position = (len(values) - 1) * percent / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class History(JsonFile):
+    """
+    Durations of builds, pulls, starts and readiness of each instance, kept
+    in a small json file (.scompose/history.json) so we can schedule the
+    longest work first next time, and see when things get slower.
+
+    The file is a lookup of instance name to event to a list of durations
+    (seconds), newest last. Only the last MAX_SAMPLES are kept. The bytes
+    transferred by pulls are kept the same way (pull-bytes), so we can show
+    an ETA for the next pull.
+
+    Parameters
+    ==========
+    filename: the json file to load from and save to
+    """
+
+    def __str__(self):
+        return "(history:%s instances)" % len(self.data)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def clear(self, names=None):
+        """
+        Forget the history of some (or all) instances.
+        """
+        with self.lock:
+            for name in names or list(self.data):
+                self.data.pop(name, None)
+            self.changed = True
+
+    def record(self, name, event, seconds):
+        """
+        Record how long an event took for an instance.
+
+        Parameters
+        ==========
+        name: the instance name
+        event: one of build, pull, promote, start or ready
+        seconds: the duration
+        """
+        with self.lock:
+            samples = self.data.setdefault(name, {}).setdefault(event, [])
+            samples.append(round(seconds, 3))
+            del samples[:-MAX_SAMPLES]
+            self.changed = True
+
+    def get(self, name, event):
+        return list(self.data.get(name, {}).get(event, []))
+
+    def estimate(self, name, events, default=0):
+        """
+        Estimate how long events will take for an instance: the sum of the
+        median duration of each, or default for an event never recorded.
+
+        Parameters
+        ==========
+        name: the instance name
+        events: a list of events, e.g., ["start", "ready"]
+        default: the duration to assume for an event without history
+        """
+        total = 0
+        for event in events:
+            samples = self.get(name, event)
+            total += get_percentile(samples, 50) if samples else default
+        return total
+
+    def summary(self, names=None):
+        """
+        Return a row for each instance and event: the instance, event, number
+        of runs, p50, p95 and last durations.
+        """
+        rows = []
+        for name in sorted(self.data):
+            if names and name not in names:
+                continue
+            for event in EVENTS:
+                samples = self.get(name, event)
+                if not samples:
+                    continue
+                rows.append(
+                    [
+                        name,
+                        event,
+                        len(samples),
+                        get_percentile(samples, 50),
+                        get_percentile(samples, 95),
+                        samples[-1],
+                    ]
+                )
+        return rows
@@ -12,37 +12,53 @@ import os
 import platform
 import re
 import shlex
-
-from spython.main import get_client
+import subprocess
 
 from scompose.logger import bot
-from scompose.utils import get_userhome
+from scompose.utils import get_client, get_userhome
 
+from .health import HealthCheck
+from .sif import get_image_id
+from .state import InstanceState
 
-class Instance:
+
+class InstanceTemplate:
     """
-    A section of a singularity-compose.yml, typically includes an image
-    name, volumes, build directory, and any ports or environment variables
-    relevant to the instance.
+    The parsed config of an instance (a section of the singularity-compose.yml),
+    shared by all of its replicas. It's parsed once however many replicas
+    there are, and isn't changed after that: what a replica changes (e.g.,
+    volumes it adds) it keeps to itself (see Instance).
 
     Parameters
     ==========
     name: should correspond to the section name for the instance.
     working_dir: should be the projects working directory, where a folder
                  named according to "name" is created for the image binary.
-    params: all of the parameters defined in the configuration.
+    params: all of the parameters defined in the configuration. They are
+            read, never changed, so they can be shared with the config.
+    state: an InstanceState snapshot shared with the project, if provided.
+    sandbox: if True, build a sandbox (directory) from the recipe instead
+             of a SIF image, and start from it (see build.sandbox).
+    client: the spython client to share, if provided.
     """
 
-    def __init__(self, name, replica_number, working_dir, sudo=False, params=None):
+    def __init__(
+        self,
+        name,
+        working_dir,
+        sudo=False,
+        params=None,
+        state=None,
+        sandbox=False,
+        client=None,
+    ):
         if not params:
             params = {}
 
         self.image = None
         self.recipe = None
-        self.instance = None
         self.sudo = sudo
         self.set_name(name, params)
-        self.replica_number = replica_number
 
         # Start includes networking args and command
         self.set_start(params)
@@ -52,22 +68,30 @@ class Instance:
         self.set_run(params)
 
         self.set_context(params)
+        self.set_sandbox(params, sandbox)
         self.set_volumes(params)
         self.set_network(params)
         self.set_ports(params)
         self.params = params
-        self.client = get_client()
+        self._client = client
+        self.state = state or InstanceState(client)
         self.working_dir = working_dir
 
-        # If the instance exists, instantiate it
-        self.get()
-
     def __str__(self):
-        return "(instance:%s)" % self.get_replica_name()
+        return "(instance-template:%s)" % self.name
 
     def __repr__(self):
         return self.__str__()
 
+    @property
+    def client(self):
+        """
+        The spython client, created on first use (see utils.get_client).
+        """
+        if self._client is None:
+            self._client = get_client()
+        return self._client
+
     def set_name(self, name, params):
         """set the instance name. First priority goes to name  parameter, then
         to name in file
@@ -79,23 +103,6 @@ class Instance:
         """
         self.name = params.get("name", name)
 
-    def get_replica_name(self):
-        return f"{self.name}{self.replica_number}"
-
-    @property
-    def uri(self):
-        return "instance://%s" % self.get_replica_name()
-
-    @property
-    def run_background(self):
-        """
-        Determine if the process should be run in the background.
-        """
-        run = self.params.get("run", {}) or {}
-        if isinstance(run, list):
-            return False
-        return run.get("background") or False
-
     def set_context(self, params):
         """set and validate parameters from the singularity-compose.yml,
         including build (context and recipe). We don't pull or create
@@ -133,38 +140,42 @@ class Instance:
         else:
             bot.exit("build or image must be defined for %s" % self.name)
 
+    def set_sandbox(self, params, sandbox=False):
+        """
+        Build a sandbox instead of a SIF image, if asked for on the command
+        line or with build.sandbox. Only images built from a recipe can be,
+        since the point is to skip compressing the image on every change.
+        """
+        build = params.get("build") or {}
+        self.sandbox = self.recipe is not None and bool(sandbox or build.get("sandbox"))
+
     # Volumes and Ports
 
     def set_volumes(self, params):
         """
         Set volumes from the recipe
         """
-        self.volumes = params.get("volumes", [])
+        self.volumes = tuple(params.get("volumes", []))
         self._volumes_from = params.get("volumes_from", [])
 
-    def set_volumes_from(self, instances):
+    def set_volumes_from(self, volumes):
         """
-        Volumes from is called after all instances are read in, and
-        then volumes can be mapped (and shared) with both containers.
-        with Docker, this is done with isolation, but for Singularity
-        we will try sharing a bind on the host.
+        Volumes from is called after the instance is read in, and then
+        volumes can be mapped (and shared) with other containers. With Docker,
+        this is done with isolation, but for Singularity we will try sharing
+        a bind on the host.
 
         Parameters
         ==========
-        instances: a list of other instances to get volumes from
+        volumes: the volumes shared from other instances (see Project.get_volumes_from)
         """
-        for name in self._volumes_from:
-            if name not in instances:
-                bot.exit("%s not in config is specified to get volumes from." % name)
-            for volume in instances[name].volumes:
-                if volume not in self.volumes:
-                    self.volumes.append(volume)
+        self.volumes += tuple(x for x in volumes if x not in self.volumes)
 
     def set_network(self, params):
         """
         Set network from the recipe to be used
         """
-        self.network = params.get("network", {})
+        self.network = dict(params.get("network") or {})
 
         # if not specified, set the default value for the property
         for key in ["enable", "allocate_ip"]:
@@ -216,6 +227,110 @@ class Instance:
         """
         return ["--%s" % opt if len(opt) > 1 else "-%s" % opt for opt in group]
 
+
+class Instance:
+    """
+    A replica of a section of a singularity-compose.yml, typically includes
+    an image name, volumes, build directory, and any ports or environment
+    variables relevant to the instance.
+
+    Replicas share the parsed section (an InstanceTemplate), and only keep
+    what is their own: the replica number, the address, the running instance
+    and volumes they add. So a thousand replicas cost little more than one.
+    Anything else (e.g., name, image, volumes) is read from the template.
+
+    Parameters
+    ==========
+    name: should correspond to the section name for the instance.
+    replica_number: the number of the replica, starting at 1.
+    working_dir: should be the projects working directory, where a folder
+                 named according to "name" is created for the image binary.
+    params: all of the parameters defined in the configuration.
+    state: an InstanceState snapshot shared with the project, if provided.
+    sandbox: if True, build a sandbox (directory) from the recipe instead
+             of a SIF image, and start from it (see build.sandbox).
+    template: the InstanceTemplate to share. If not provided, one is parsed
+              from the parameters above.
+    """
+
+    __slots__ = (
+        "template",
+        "replica_number",
+        "ip_address",
+        "prefix_output",
+        "_instance",
+        "_looked_up",
+        "_volumes",
+    )
+
+    def __init__(
+        self,
+        name,
+        replica_number,
+        working_dir,
+        sudo=False,
+        params=None,
+        state=None,
+        sandbox=False,
+        template=None,
+    ):
+        self.template = template or InstanceTemplate(
+            name, working_dir, sudo=sudo, params=params, state=state, sandbox=sandbox
+        )
+        self.replica_number = replica_number
+        self.ip_address = None
+        self.prefix_output = False
+        self._instance = None
+        self._looked_up = False
+        self._volumes = None
+
+    def __getattr__(self, name):
+        # Anything that isn't the replica's own comes from the template
+        if name == "template":
+            raise AttributeError(name)
+        return getattr(self.template, name)
+
+    def __str__(self):
+        return "(instance:%s)" % self.get_replica_name()
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def volumes(self):
+        if self._volumes is None:
+            return self.template.volumes
+        return self._volumes
+
+    def add_volumes(self, volumes):
+        """
+        Add volumes (e.g., resolv.conf and hosts) to this replica only.
+
+        Parameters
+        ==========
+        volumes: the volumes to add, if the replica doesn't have them
+        """
+        added = tuple(x for x in volumes if x not in self.volumes)
+        if added:
+            self._volumes = self.volumes + added
+
+    def get_replica_name(self):
+        return f"{self.name}{self.replica_number}"
+
+    @property
+    def uri(self):
+        return "instance://%s" % self.get_replica_name()
+
+    @property
+    def run_background(self):
+        """
+        Determine if the process should be run in the background.
+        """
+        run = self.params.get("run", {}) or {}
+        if isinstance(run, list):
+            return False
+        return run.get("background") or False
+
     def _get_network_commands(self, ip_address=None):
         """
         Take a list of ports, return the list of --network-args to
@@ -301,13 +416,38 @@ class Instance:
                     bot.error("".join(response["message"]))
                     bot.exit("Return code %s, exiting." % response["return_code"])
 
+    def get_healthcheck(self):
+        """
+        Get the HealthCheck of the instance, or None if it doesn't have one.
+        tcp and http probes go to the address the instance was given, if it
+        has one we can reach (with sudo), otherwise to localhost.
+        """
+        params = self.params.get("healthcheck")
+        if not params:
+            return
+
+        host = "127.0.0.1"
+        if (
+            self.ip_address
+            and self.sudo
+            and self.network["enable"]
+            and self.network["allocate_ip"]
+        ):
+            host = self.ip_address
+        return HealthCheck(params, host=host, working_dir=self.working_dir)
+
     # Image
 
-    def get_image(self):
+    def get_image(self, sandbox=None):
         """
         Get the associated instance image name, to be built if it doesn't
         exit. It can either be defined at the config from self.image, or
         ultimately generated via a pull from a uri.
+
+        Parameters
+        ==========
+        sandbox: get the path of the sandbox (True) or SIF image (False)
+                 instead of the one for how the instance is built.
         """
         # If the user gave a direct image
         if self.image is not None:
@@ -321,78 +461,158 @@ class Instance:
             bot.info("Creating image context folder for %s" % self.name)
             os.mkdir(context)
 
-        # The sif binary should have a predictible name
+        # The sif binary (or sandbox folder) should have a predictible name
+        if self.sandbox if sandbox is None else sandbox:
+            return os.path.join(context, "%s.sandbox" % self.name)
         return os.path.join(context, "%s.sif" % self.name)
 
     # Build
 
-    def build(self, working_dir):
+    def build(self, working_dir, log_file=None, output=None, update=True):
         """
         Build an image if called for based on having a recipe and context.
         Otherwise, pull a container uri to the instance workspace.
+
+        The build runs from the context folder without changing the working
+        directory of scompose, so several builds can run at once.
+
+        Parameters
+        ==========
+        working_dir: the working directory of the project
+        log_file: if defined, write the output of the build (or pull) to this
+                  file instead of the terminal.
+        output: the path to build the image to (defaults to get_image)
+        update: if False, build a sandbox that exists again from scratch
+                instead of running the recipe over it (see get_build_command)
+
+        Returns the image path, or None if it could not be built.
         """
-        sif_binary = self.get_image()
+        sif_binary = output or self.get_image()
 
         # If the final image already exists, don't continue
-        if os.path.exists(sif_binary):
+        if os.path.exists(sif_binary) and not self.sandbox:
+            return sif_binary
+
+        command, cwd, sudo = self.get_build_command(sif_binary, update)
+        if log_file is None:
+            if self.image is not None:
+                bot.info("Pulling %s" % self.image)
+            else:
+                bot.info("Building %s" % self.name)
+
+        return_code = self._run_build_command(
+            command, cwd=cwd, sudo=sudo, log_file=log_file
+        )
+        if return_code != 0 and log_file is None:
+            if self.image is not None:
+                bot.warning("Issue pulling %s" % self.image)
+            else:
+                build = "sudo singularity build %s %s" % (
+                    os.path.basename(self.get_image()),
+                    self.recipe,
+                )
+                bot.warning("Issue building container, try: %s" % build)
+
+        # A sandbox we failed to update is still there
+        if return_code != 0 and self.sandbox:
             return
+        if os.path.exists(sif_binary):
+            return sif_binary
 
-        # Case 1: Given an image
-        if self.image is not None:
-            if not os.path.exists(self.image):
-                # Can we pull it?
-                if re.search("(docker|library|shub|http?s)[://]", self.image):
-                    bot.info("Pulling %s" % self.image)
-                    self.client.pull(self.image, name=sif_binary)
+    def get_build_command(self, sif_binary, update=True):
+        """
+        Get the command to pull (given an image) or build (given a recipe)
+        the image for the instance. Returns the command, the folder to run it
+        from, and if it needs sudo.
 
-                else:
-                    bot.exit(
-                        "%s is an invalid unique resource identifier." % self.image
-                    )
+        A sandbox that exists already is updated: the recipe runs over it
+        without bootstrapping again, so changes to %files or %post are quick.
+
+        Parameters
+        ==========
+        sif_binary: the path of the image (or sandbox) to create
+        update: if False, build a sandbox that exists again from scratch
+        """
+        # Case 1: Given an image, can we pull it?
+        if self.image is not None:
+            if not re.search("(docker|library|shub|http?s)[://]", self.image):
+                bot.exit("%s is an invalid unique resource identifier." % self.image)
+            command = self.client._init_command("pull")
+            return command + ["--name", sif_binary, self.image], None, False
 
         # Case 2: Given a recipe
-        elif self.recipe is not None:
-            # Change directory to the context if it exists
+        if self.recipe is not None:
             context = os.path.abspath(self.context)
-            os.chdir(context)
 
             # The recipe is expected to exist in the context folder
-            if not os.path.exists(self.recipe):
+            if not os.path.exists(os.path.join(context, self.recipe)):
                 bot.exit("%s not found for build" % self.recipe)
 
             # This will likely require sudo, unless --remote or --fakeroot in options
-            try:
-                options = self.get_build_options()
+            options = self.get_build_options()
 
-                # If remote or fakeroot included, don't need sudo
-                sudo = not ("--fakeroot" in options or "--remote" in options)
+            # If remote or fakeroot included, don't need sudo
+            sudo = not ("--fakeroot" in options or "--remote" in options)
 
-                bot.info("Building %s" % self.name)
+            if self.sandbox:
+                options = options + ["--sandbox"]
+                if os.path.exists(sif_binary):
+                    options.append("--update" if update else "--force")
 
-                _, stream = self.client.build(
-                    image=sif_binary,
-                    recipe=self.recipe,
-                    options=options,
-                    sudo=sudo,
-                    stream=True,
-                )
-
-                for line in stream:
-                    print(line)
+            command = self.client._init_command("build")
+            return command + options + [sif_binary, self.recipe], context, sudo
 
-            except Exception:
-                build = "sudo singularity build %s %s" % (
-                    os.path.basename(sif_binary),
-                    self.recipe,
-                )
+        bot.exit("neither image and build defined for %s" % self.name)
 
-                bot.warning("Issue building container, try: %s" % build)
+    def promote(self, output, log_file=None):
+        """
+        Build a SIF image from the sandbox of the instance, e.g., to run in
+        production once it works. Returns the image path, or None if it
+        could not be built.
 
-            # Change back to provided working directory
-            os.chdir(working_dir)
+        Parameters
+        ==========
+        output: the path of the SIF image to build
+        log_file: if defined, write the output of the build to this file
+        """
+        sandbox = self.get_image(sandbox=True)
+        if not os.path.isdir(sandbox):
+            bot.exit("%s not found, please build with --sandbox first." % sandbox)
+
+        # A sandbox built as root has files only root can read
+        options = ["--fakeroot"] if "--fakeroot" in self.get_build_options() else []
+        command = self.client._init_command("build") + options + [output, sandbox]
+        if log_file is None:
+            bot.info("Promoting %s" % sandbox)
+        return_code = self._run_build_command(
+            command, sudo=not options, log_file=log_file
+        )
+        if return_code == 0 and os.path.exists(output):
+            return output
+
+    def _run_build_command(self, command, cwd=None, sudo=False, log_file=None):
+        """
+        Run a build or pull command, and return the return code.
 
-        else:
-            bot.exit("neither image and build defined for %s" % self.name)
+        Output goes to the terminal (so progress is shown as usual) unless
+        a log file is provided.
+        """
+        if sudo:
+            command = ["sudo"] + command
+        bot.debug(" ".join(command))
+
+        try:
+            if log_file is None:
+                return subprocess.call(command, cwd=cwd)
+            with open(log_file, "a") as log:
+                log.write("%s\n" % " ".join(command))
+                log.flush()
+                return subprocess.call(
+                    command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT
+                )
+        except OSError as error:
+            bot.error("Cannot run %s: %s" % (command[0], error))
+            return 1
 
     def get_build_options(self):
         """
@@ -421,30 +641,57 @@ class Instance:
         return options
 
     # State
+    @property
+    def instance(self):
+        """
+        The running (spython) instance, if it exists. We only look it up
+        the first time it is needed.
+        """
+        if not self._looked_up:
+            self._looked_up = True
+            self.get()
+        return self._instance
+
+    @instance.setter
+    def instance(self, instance):
+        self._looked_up = True
+        self._instance = instance
+
     def exists(self):
         """
         Return boolean if an instance exists. We do this by way of listing
         instances, and so the calling user is important.
         """
-        instances = [x.name for x in self.client.instances(quiet=True, sudo=self.sudo)]
-        return self.get_replica_name() in instances
+        return self.state.exists(self.get_replica_name(), sudo=self.sudo)
 
     def get(self):
         """If an instance exists, add to self.instance"""
-        for instance in self.client.instances(quiet=True, sudo=self.sudo):
-            if instance.name == self.get_replica_name():
-                self.instance = instance
-                break
+        instance = self.state.get_instance(self.get_replica_name(), sudo=self.sudo)
+        if instance is not None:
+            self.instance = instance
 
-    def stop(self, timeout=None):
+    def stop(self, timeout=None, force=False):
         """
         Delete the instance, if it exists. Singularity doesn't have delete
         or remove commands, everything is a stop.
+
+        Parameters
+        ==========
+        timeout: kill the instance if it hasn't stopped after this many seconds
+        force: kill the instance right away instead of asking it to stop
         """
         if self.instance:
-            bot.info("Stopping %s" % self)
-            self.instance.stop(sudo=self.sudo, timeout=timeout)
+            if force:
+                bot.info("Killing %s" % self)
+                command = self.client._init_command(["instance", "stop", "--force"])
+                self.client._run_command(
+                    command + [self.get_replica_name()], sudo=self.sudo, quiet=True
+                )
+            else:
+                bot.info("Stopping %s" % self)
+                self.instance.stop(sudo=self.sudo, timeout=timeout)
             self.instance = None
+            self.state.invalidate(self.sudo)
 
     # Networking
 
@@ -524,38 +771,63 @@ class Instance:
         hostname = platform.node()
         return os.path.join(home, ".singularity", "instances", "logs", hostname, user)
 
-    def logs(self, tail=0):
+    def get_log_files(self):
         """
-        Show logs for an instance
+        Get the output (OUT) and error (ERR) log files of the instance.
         """
-
         log_folder = self._get_log_folder()
-
-        for ext in ["OUT", "ERR"]:
-            logfile = os.path.join(
-                log_folder, "%s.%s" % (self.get_replica_name(), ext.lower())
+        return [
+            (
+                ext,
+                os.path.join(
+                    log_folder, "%s.%s" % (self.get_replica_name(), ext.lower())
+                ),
             )
+            for ext in ["OUT", "ERR"]
+        ]
 
+    def logs(self, tail=0):
+        """
+        Show logs for an instance
+        """
+
+        for ext, logfile in self.get_log_files():
             # Use Try/catch to account for not existing.
             try:
                 result = self.client._run_command(
                     ["cat", logfile], quiet=True, sudo=self.sudo
                 )
-                if result:
-                    # If the user only wants to see certain number
-                    if tail > 0:
-                        result = "\n".join(result.split("\n")[-tail:])
-                    bot.custom(
-                        prefix=self.get_replica_name(), message=ext, color="CYAN"
-                    )
-                    print(result)
-                    bot.newline()
+                self._print_log(ext, result, tail)
 
             except Exception:
                 pass
 
+    def _print_log(self, ext, result, tail=0):
+        """
+        Print the content of a log (OUT or ERR), if there is any.
+        """
+        if result:
+            # If the user only wants to see certain number
+            if tail > 0:
+                result = "\n".join(result.split("\n")[-tail:])
+            bot.custom(prefix=self.get_replica_name(), message=ext, color="CYAN")
+            print(result)
+            bot.newline()
+
     # Create and Delete
 
+    def _print_output(self, line):
+        """
+        Print a line of output from the instance. When instances are started
+        in parallel, prefix it with the instance name so it can be told apart.
+        """
+        if self.prefix_output:
+            bot.custom(
+                prefix=self.get_replica_name(), message=line.rstrip("\n"), color="CYAN"
+            )
+        else:
+            print(line)
+
     def up(self, working_dir, ip_address=None, writable_tmpfs=False):
         """
         Up is the same as create, but like Docker, we build / pull instances
@@ -568,45 +840,34 @@ class Instance:
             self.build(working_dir)
         self.create(writable_tmpfs=writable_tmpfs, ip_address=ip_address)
 
-    def create(self, ip_address=None, sudo=False, writable_tmpfs=False):
+    def create(
+        self,
+        ip_address=None,
+        sudo=False,
+        writable_tmpfs=False,
+        working_dir=None,
+        verify=None,
+    ):
         """
         Create an instance, if it doesn't exist.
-        """
-        image = self.get_image()
 
-        # Case 1: No build context or image defined
-        if image is None:
-            bot.exit(
-                "Please define an image or build context for instance %s" % self.name
-            )
-
-        # Case 2: Image not built.
-        if not os.path.exists(image):
-            bot.exit("Image %s not found, please run build first." % image)
+        Parameters
+        ==========
+        verify: a function called with the instance before it is started,
+                that returns False if its image can't be trusted.
+        """
+        image = self.get_start_image()
+        self.ip_address = ip_address
 
         # Finally, create the instance
         if not self.exists():
+            if verify is not None and not verify(self):
+                bot.exit(
+                    "Not starting %s, its image failed verification."
+                    % self.get_replica_name()
+                )
             bot.info("Creating %s" % self.get_replica_name())
-
-            # Command options
-            options = []
-
-            # Volumes
-            options += self._get_bind_commands()
-
-            # Network configuration + Ports
-            if self.network["enable"]:
-                options += self._get_network_commands(ip_address)
-
-            # Start options
-            options += self.start_opts
-
-            # Hostname
-            options += ["--hostname", self.get_replica_name()]
-
-            # Writable Temporary Directory
-            if writable_tmpfs:
-                options += ["--writable-tmpfs"]
+            options = self.get_start_options(ip_address, writable_tmpfs)
 
             # Show the command to the user
             commands = "%s %s %s %s" % (
@@ -624,6 +885,7 @@ class Instance:
                 image=image,
                 args=self.args,
             )
+            self.state.invalidate(self.sudo)
 
             # If the user has exec defined, exec to it
             if self.exec_args:
@@ -642,7 +904,7 @@ class Instance:
                     stream=True,
                     options=self.exec_opts,
                 ):
-                    print(line)
+                    self._print_output(line)
 
             # If the user has run defined, finish with the run
             if "run" in self.params:
@@ -667,4 +929,230 @@ class Instance:
                     )
                     or []
                 ):
-                    print(line.strip("\n"))
+                    self._print_output(line.strip("\n"))
+
+    def get_start_image(self):
+        """
+        Get the image to start the instance from, exiting if it isn't built.
+        """
+        image = self.get_image()
+
+        # Case 1: No build context or image defined
+        if image is None:
+            bot.exit(
+                "Please define an image or build context for instance %s" % self.name
+            )
+
+        # Case 2: Image not built.
+        if not os.path.exists(image):
+            bot.exit("Image %s not found, please run build first." % image)
+        return image
+
+    def get_start_options(self, ip_address=None, writable_tmpfs=False):
+        """
+        Get the options for singularity instance start: volumes, network
+        and ports, start options, the hostname and a writable tmpfs.
+
+        Parameters
+        ==========
+        ip_address: the ip address to ask for, if the network allocates one
+        writable_tmpfs: if the instance should be given writable to tmp
+        """
+        # Volumes
+        options = self._get_bind_commands()
+
+        # Network configuration + Ports
+        if self.network["enable"]:
+            options += self._get_network_commands(ip_address)
+
+        # Start options
+        options += self.start_opts
+
+        # Hostname
+        options += ["--hostname", self.get_replica_name()]
+
+        # Writable Temporary Directory
+        if writable_tmpfs:
+            options += ["--writable-tmpfs"]
+        return options
+
+    def get_spec(self, binds=None, writable_tmpfs=False):
+        """
+        Get the resolved launch spec of the instance: everything it is started
+        with, as a dictionary that can be hashed and compared to tell if the
+        instance needs to be recreated.
+
+        The ip address is left out, since addresses are handed out again on
+        each up. The image is identified by the id and modified time in its
+        SIF header (see get_image_id), so a rebuilt (or pulled) image is a
+        change, but the same image linked or copied into place is not.
+
+        Parameters
+        ==========
+        binds: extra volumes the project binds (resolv.conf and hosts)
+        writable_tmpfs: if the instance is given writable to tmp
+        """
+        image = self.get_image()
+        image_id = get_image_id(image) if image else None
+
+        volumes = list(self.volumes)
+        volumes += [x for x in binds or [] if x not in volumes]
+        return {
+            "image": image,
+            "image_id": image_id,
+            "volumes": volumes,
+            "network": (self._get_network_commands() if self.network["enable"] else []),
+            "start": self.start_opts,
+            "args": self.args,
+            "exec": [self.exec_opts, self.exec_args],
+            "run": [self.run_opts, self.run_args, self.run_background]
+            if "run" in self.params
+            else None,
+            "hostname": self.get_replica_name(),
+            "writable_tmpfs": writable_tmpfs,
+        }
+
+    # Async
+
+    async def async_build(self, runtime, log_file=None, timeout=None, output=None):
+        """
+        Build or pull the image (see build) with an AsyncRuntime, to output
+        if given.
+
+        Returns the image path, or None if it could not be built.
+        """
+        sif_binary = output or self.get_image()
+        if os.path.exists(sif_binary) and not self.sandbox:
+            return sif_binary
+
+        command, cwd, sudo = self.get_build_command(sif_binary)
+        if log_file is None:
+            bot.info("%s %s" % ("Pulling" if self.image else "Building", self.name))
+        result = await runtime.build(
+            command,
+            cwd=cwd,
+            sudo=sudo,
+            timeout=timeout,
+            log_file=log_file,
+            on_output=None if log_file else self._print_output,
+        )
+        if result["return_code"] != 0 and log_file is None:
+            bot.warning("Issue building %s" % self.name)
+
+        if result["return_code"] != 0 and self.sandbox:
+            return
+        if os.path.exists(sif_binary):
+            return sif_binary
+
+    async def async_up(self, runtime, ip_address=None, writable_tmpfs=False, **kwargs):
+        """
+        Build (or pull) the image if needed, and create the instance.
+        """
+        if not os.path.exists(self.get_image() or ""):
+            await self.async_build(runtime)
+        await self.async_create(
+            runtime, ip_address=ip_address, writable_tmpfs=writable_tmpfs, **kwargs
+        )
+
+    async def async_create(
+        self,
+        runtime,
+        ip_address=None,
+        writable_tmpfs=False,
+        timeout=None,
+        verify=None,
+        **kwargs,
+    ):
+        """
+        Create the instance (see create) with an AsyncRuntime, then run exec
+        and run if they are defined. Output of each is streamed as it comes.
+
+        Parameters
+        ==========
+        runtime: the AsyncRuntime to run commands with
+        ip_address: the ip address to ask for
+        writable_tmpfs: if the instance should be given writable to tmp
+        timeout: seconds to wait for each command (start, exec, run)
+        verify: a function called with the instance before it is started
+                (in an executor), that returns False to not start it
+        """
+        import asyncio
+
+        image = self.get_start_image()
+        self.ip_address = ip_address
+        if self.exists():
+            return
+
+        if verify is not None:
+            loop = asyncio.get_running_loop()
+            if not await loop.run_in_executor(None, verify, self):
+                bot.exit(
+                    "Not starting %s, its image failed verification."
+                    % self.get_replica_name()
+                )
+
+        bot.info("Creating %s" % self.get_replica_name())
+        try:
+            await runtime.start(
+                self.get_replica_name(),
+                image,
+                options=self.get_start_options(ip_address, writable_tmpfs),
+                args=self.args,
+                sudo=self.sudo,
+                timeout=timeout,
+                on_output=self._print_output,
+            )
+        finally:
+            self.state.invalidate(self.sudo)
+            self._looked_up = False
+
+        if self.exec_args:
+            await runtime.execute(
+                self.uri,
+                self.exec_args,
+                options=self.exec_opts,
+                sudo=self.sudo,
+                timeout=timeout,
+                on_output=self._print_output,
+            )
+
+        if "run" in self.params:
+            await runtime.run(
+                self.uri,
+                args=self.run_args or "",
+                options=self.run_opts,
+                sudo=self.sudo,
+                background=self.run_background,
+                timeout=timeout,
+                on_output=self._print_output,
+            )
+
+    async def async_stop(self, runtime, timeout=None, force=False):
+        """
+        Stop the instance (see stop) with an AsyncRuntime, if it exists.
+        """
+        if self.instance:
+            bot.info("%s %s" % ("Killing" if force else "Stopping", self))
+            await runtime.stop(
+                self.get_replica_name(), sudo=self.sudo, timeout=timeout, force=force
+            )
+            self.instance = None
+            self.state.invalidate(self.sudo)
+
+    async def async_logs(self, runtime, tail=0):
+        """
+        Show logs for an instance (see logs), read with an AsyncRuntime.
+        """
+        for ext, content in await self.async_read_logs(runtime):
+            self._print_log(ext, content, tail)
+
+    async def async_read_logs(self, runtime):
+        """
+        Read the logs of an instance, returning a list of (OUT or ERR, content)
+        """
+        logs = []
+        for ext, logfile in self.get_log_files():
+            result = await runtime.run_command(["cat", logfile], sudo=self.sudo)
+            if result["return_code"] == 0:
+                logs.append((ext, result["message"]))
+        return logs
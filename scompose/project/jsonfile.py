@@ -0,0 +1,100 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import os
+import threading
+
+from scompose.logger import bot
+from scompose.utils import read_json, write_json
+
+
+class JsonFile:
+    """
+    A lookup kept in a json file (e.g., history or launch specs), loaded
+    when created and written back by save if anything changed. Changes are
+    made under the lock, so threads can share it.
+
+    Parameters
+    ==========
+    filename: the json file to load from and save to
+    """
+
+    # Write the file indented, for people to read
+    pretty = True
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.changed = False
+        self.load()
+
+    def load(self):
+        """
+        Load the data, starting over if it can't be read.
+        """
+        self.data = {}
+        if not os.path.exists(self.filename):
+            return
+        try:
+            data = read_json(self.filename)
+        except (OSError, ValueError) as error:
+            bot.warning("Cannot read %s, starting over: %s" % (self.filename, error))
+            return
+        if isinstance(data, dict):
+            self.data = data
+
+    def save(self):
+        """
+        Write the data if anything changed (see utils.write_json).
+        """
+        with self.lock:
+            if not self.changed:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+            write_json(self.data, self.filename, print_pretty=self.pretty)
+            self.changed = False
+
+
+class JsonLookup(JsonFile):
+    """
+    A lookup of names to values (e.g., the build cache key or the digest
+    of the image of each instance) kept in a json file, used like a dict.
+
+    Parameters
+    ==========
+    filename: the json file to load from and save to
+    """
+
+    def __str__(self):
+        return "(lookup:%s)" % os.path.basename(self.filename)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __contains__(self, name):
+        return name in self.data
+
+    def __getitem__(self, name):
+        return self.data[name]
+
+    def __setitem__(self, name, value):
+        with self.lock:
+            if name not in self.data or self.data[name] != value:
+                self.data[name] = value
+                self.changed = True
+
+    def get(self, name, default=None):
+        return self.data.get(name, default)
+
+    def pop(self, name, default=None):
+        with self.lock:
+            if name in self.data:
+                self.changed = True
+            return self.data.pop(name, default)
@@ -0,0 +1,60 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+from collections.abc import Mapping
+
+
+class LazyInstances(Mapping):
+    """
+    An ordered lookup of replica names to instances, where an instance is
+    only created the first time it is accessed.
+
+    Listing names, checking membership and counting don't create anything,
+    so a command that targets one instance only pays for that instance.
+
+    Parameters
+    ==========
+    names: the ordered replica names
+    factory: a function that takes a replica name and returns an Instance
+    """
+
+    def __init__(self, names=None, factory=None):
+        self._names = list(dict.fromkeys(names or []))
+        self._known = set(self._names)
+        self._factory = factory
+        self._instances = {}
+
+    def __str__(self):
+        return "(instances:%s/%s loaded)" % (len(self._instances), len(self))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __getitem__(self, name):
+        if name not in self._known:
+            raise KeyError(name)
+        if name not in self._instances:
+            self._instances[name] = self._factory(name)
+        return self._instances[name]
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._known
+
+    def loaded(self):
+        """
+        Return the instances that have been created so far, in order.
+        """
+        return [self._instances[x] for x in self._names if x in self._instances]
@@ -0,0 +1,381 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import fcntl
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from ipaddress import IPv4Address, IPv4Network
+
+from scompose.logger import bot
+from scompose.utils import write_json
+
+from .cache import get_cache_dir
+
+
+def get_lease_dir():
+    """
+    Get the folder of address leases: SCOMPOSE_LEASES if set (e.g., a folder
+    shared by everyone on a node), otherwise under the cache folder. The
+    default is only shared by the projects of one user, while instances
+    started with sudo share one bridge for everyone on the node.
+    """
+    return os.environ.get("SCOMPOSE_LEASES") or os.path.join(get_cache_dir(), "leases")
+
+
+def get_exists(path):
+    """
+    Determine if a path exists. Only a path that is known to be missing is
+    not, unlike os.path.exists, which is False if we can't look (e.g., we
+    can't read a folder it's in).
+    """
+    try:
+        os.stat(path)
+    except FileNotFoundError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+# A byte of a bitmap with an address that isn't taken
+FREE_BYTE = re.compile(b"[^\\xff]")
+
+
+class Bitmap:
+    """
+    A bit for each address of a subnet, set when it's taken. Finding the
+    lowest clear bit starts from the lowest byte that can have one, so
+    handing out addresses one after the other doesn't scan the bitmap again.
+    """
+
+    def __init__(self, size):
+        self.bits = bytearray((size + 7) // 8)
+        self.start = 0
+
+        # Bits past the end (in the last byte) are never clear
+        for offset in range(size, len(self.bits) * 8):
+            self.set(offset)
+
+    def __contains__(self, offset):
+        return bool(self.bits[offset >> 3] >> (offset & 7) & 1)
+
+    def set(self, offset):
+        self.bits[offset >> 3] |= 1 << (offset & 7)
+
+    def clear(self, offset):
+        self.bits[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+        self.start = min(self.start, offset >> 3)
+
+    def find(self):
+        """
+        Get the lowest clear bit, or None if they are all set.
+        """
+        match = FREE_BYTE.search(self.bits, self.start)
+        if match is None:
+            self.start = len(self.bits)
+            return
+        self.start = match.start()
+        byte = ~self.bits[self.start] & 0xFF
+        return self.start * 8 + (byte & -byte).bit_length() - 1
+
+
+class Subnet:
+    """
+    The address leases of one bridge subnet, with a bitmap of the addresses
+    in use (bit n is the network address plus n). The network address, the
+    gateway (the first host) and the broadcast address are never handed out.
+
+    A lease belongs to a key (a replica of a project), and a key keeps its
+    address while it holds the lease. A released lease is remembered, and
+    the key gets the same address back if it's still free, so replicas keep
+    their address across restarts. Addresses of released leases are only
+    given to other keys when there are no others left.
+
+    Parameters
+    ==========
+    network: the subnet, e.g., 10.22.0.0/16
+    leases: a lookup of keys to the addresses they hold
+    released: a lookup of keys to the addresses they last held
+    """
+
+    def __init__(self, network, leases=None, released=None):
+        self.network = IPv4Network(network)
+        self.size = self.network.num_addresses
+
+        # Addresses in use (leased or running), and those and released (taken)
+        self.used = Bitmap(self.size)
+        self.taken = Bitmap(self.size)
+        for offset in {0, 1, self.size - 1}:
+            self.used.set(offset)
+            self.taken.set(offset)
+
+        # Keys to offsets, and back
+        self.leases = {}
+        self.owners = {}
+        self.released = {}
+        self.releasers = {}
+        for key, address in (leases or {}).items():
+            self.claim(key, address)
+        for key, address in (released or {}).items():
+            offset = self.get_offset(address)
+            if offset is not None and key not in self.leases:
+                if offset not in self.taken:
+                    self.remember(key, offset)
+
+    def __str__(self):
+        return "(subnet:%s:%s leases)" % (self.network, len(self.leases))
+
+    def __repr__(self):
+        return self.__str__()
+
+    def get_offset(self, address):
+        """
+        Get the bit of an address, or None if it's not a host of the subnet.
+        """
+        try:
+            offset = int(IPv4Address(address)) - int(self.network.network_address)
+        except ValueError:
+            return
+        if 2 <= offset < self.size - 1:
+            return offset
+
+    def get_address(self, offset):
+        return str(self.network.network_address + offset)
+
+    def get(self, key):
+        """
+        Get the address leased to a key, or None.
+        """
+        if key in self.leases:
+            return self.get_address(self.leases[key])
+
+    def claim(self, key, address):
+        """
+        Lease an address to a key (e.g., the address a running instance
+        already has), taking it from any key that held it before.
+        Returns False if the address isn't a host of the subnet.
+        """
+        offset = self.get_offset(address)
+        if offset is None:
+            return False
+        self.lease(key, offset)
+        return True
+
+    def lease(self, key, offset):
+        self.release(key)
+        if key in self.released:
+            self.forget(self.released[key])
+        other = self.owners.pop(offset, None)
+        if other is not None:
+            del self.leases[other]
+        self.forget(offset)
+        self.leases[key] = offset
+        self.owners[offset] = key
+        self.used.set(offset)
+        self.taken.set(offset)
+
+    def reserve(self, address):
+        """
+        Mark an address as used without a lease (e.g., an instance started
+        by another tool), until the subnet is read again.
+        """
+        offset = self.get_offset(address)
+        if offset is not None:
+            self.used.set(offset)
+            self.taken.set(offset)
+
+    def allocate(self, key):
+        """
+        Get the address of a key: the one it holds, the one it last held if
+        still free, or the lowest free address. Returns None if the subnet
+        has no free addresses left.
+        """
+        if key in self.leases:
+            return self.get_address(self.leases[key])
+
+        offset = self.released.get(key)
+        if offset is None or offset in self.used:
+            offset = self.taken.find()
+            if offset is None:
+                offset = self.used.find()
+            if offset is None:
+                return
+        self.lease(key, offset)
+        return self.get_address(offset)
+
+    def release(self, key):
+        """
+        Release the lease of a key, remembering its address (see allocate).
+        """
+        offset = self.leases.pop(key, None)
+        if offset is None:
+            return False
+        del self.owners[offset]
+        self.used.clear(offset)
+        self.forget(offset)
+        self.remember(key, offset)
+        return True
+
+    def drop(self, key):
+        """
+        Forget a key, its lease and the address it last held (e.g., for a
+        project that no longer exists).
+        """
+        self.release(key)
+        offset = self.released.pop(key, None)
+        if offset is not None:
+            del self.releasers[offset]
+            if offset not in self.used:
+                self.taken.clear(offset)
+
+    def remember(self, key, offset):
+        self.released[key] = offset
+        self.releasers[offset] = key
+        self.taken.set(offset)
+
+    def forget(self, offset):
+        """
+        Forget the released lease of an address, once it's taken again.
+        """
+        key = self.releasers.pop(offset, None)
+        if key is not None:
+            del self.released[key]
+            if offset not in self.used:
+                self.taken.clear(offset)
+
+    def to_dict(self):
+        return {
+            "network": str(self.network),
+            "leases": {k: self.get_address(v) for k, v in self.leases.items()},
+            "released": {k: self.get_address(v) for k, v in self.released.items()},
+        }
+
+
+class LeaseStore:
+    """
+    Leases of instance addresses, shared by all projects (and commands run
+    at once) on a node, with a file for each bridge subnet. The file is
+    read and written under a lock, against threads and other processes
+    (flock), so two commands never hand out the same address.
+
+    Parameters
+    ==========
+    root: the lease folder (defaults to get_lease_dir())
+    """
+
+    def __init__(self, root=None):
+        self.root = root or get_lease_dir()
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return "(lease-store:%s)" % self.root
+
+    def __repr__(self):
+        return self.__str__()
+
+    def get_path(self, network):
+        network = IPv4Network(network)
+        return os.path.join(
+            self.root, "%s-%s.json" % (network.network_address, network.prefixlen)
+        )
+
+    def get_networks(self):
+        """
+        Get the subnets that have leases.
+        """
+        if not os.path.exists(self.root):
+            return []
+        networks = []
+        for filename in sorted(os.listdir(self.root)):
+            if filename.endswith(".json"):
+                network = filename[: -len(".json")].replace("-", "/")
+                try:
+                    networks.append(str(IPv4Network(network)))
+                except ValueError:
+                    continue
+        return networks
+
+    def read(self, network):
+        """
+        Read the leases of a subnet, without a lock (e.g., to show them).
+        """
+        path = self.get_path(network)
+        try:
+            with open(path, "r") as filey:
+                content = json.load(filey)
+        except FileNotFoundError:
+            content = {}
+        except (OSError, ValueError) as error:
+            bot.warning("Ignoring leases in %s: %s" % (path, error))
+            content = {}
+        return Subnet(
+            network, content.get("leases") or {}, content.get("released") or {}
+        )
+
+    def write(self, subnet):
+        write_json(subnet.to_dict(), self.get_path(subnet.network))
+
+    def reconcile(self, subnet, running):
+        """
+        Drop the leases (and released leases) of replicas that aren't
+        running, of projects whose folder no longer exists. Without this,
+        the addresses of instances that were killed (or never stopped)
+        before their project was deleted would be held forever. A folder
+        we can't look at (e.g., in the home of another user) is kept.
+
+        Parameters
+        ==========
+        subnet: the leases of a subnet (a Subnet)
+        running: the names of instances running on the node
+        """
+        for key in set(subnet.leases) | set(subnet.released):
+            working_dir, _, name = key.rpartition(":")
+            if name not in running and not get_exists(working_dir):
+                subnet.drop(key)
+
+    @contextmanager
+    def open(self, network, running=None):
+        """
+        Hold the lock of a subnet, and yield its leases (a Subnet), which
+        are written back when the block finishes without an error.
+
+        Parameters
+        ==========
+        network: the subnet, e.g., 10.22.0.0/16
+        running: the names of instances running on the node, to drop stale
+                 leases (see reconcile). If None, leases are kept as they are.
+        """
+        path = self.get_path(network)
+        os.makedirs(self.root, exist_ok=True)
+        with self.lock, open("%s.lock" % path[: -len(".json")], "a") as filey:
+            fcntl.flock(filey.fileno(), fcntl.LOCK_EX)
+            try:
+                subnet = self.read(network)
+                if running is not None:
+                    self.reconcile(subnet, running)
+                yield subnet
+                self.write(subnet)
+            finally:
+                fcntl.flock(filey.fileno(), fcntl.LOCK_UN)
+
+    def release(self, keys):
+        """
+        Release the leases of keys, in any subnet.
+        """
+        keys = set(keys)
+        for network in self.get_networks():
+            if not keys & set(self.read(network).leases):
+                continue
+            with self.open(network) as subnet:
+                for key in keys:
+                    subnet.release(key)
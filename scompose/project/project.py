@@ -12,17 +12,42 @@ import json
 import os
 import re
 import subprocess
-from copy import deepcopy
-from ipaddress import IPv4Network
+import time
 
-from spython.main import get_client
-
-from scompose.logger import bot
+from scompose.logger import StatusBoard, bot
+from scompose.logger.status import format_duration
 from scompose.templates import get_template
-from scompose.utils import read_file, write_file
+from scompose.utils import (
+    format_size,
+    format_uptime,
+    get_client,
+    mkdir_p,
+    read_file,
+    write_file,
+)
 
 from ..config import merge_config
-from .instance import Instance
+from .cache import BuildCache, link_file, touch
+from .graph import DependencyGraph
+from .health import get_depends_on
+from .history import History
+from .instance import Instance, InstanceTemplate
+from .jsonfile import JsonLookup
+from .lazy import LazyInstances
+from .leases import LeaseStore
+from .prune import PruneSet, find_files, remove_refs
+from .scheduler import Scheduler
+from .sif import SIFError, SIFImage
+from .spec import Specs, get_changed_fields
+from .state import (
+    InstanceState,
+    get_instance_folders,
+    get_instance_owner,
+    get_process_start,
+)
+from .store import ImageStore
+from .transfer import PullMonitor
+from .watch import InstanceWatcher
 
 
 class Project:
@@ -31,16 +56,25 @@ class Project:
     """
 
     config = None
-    instances = {}
 
-    def __init__(self, filename=None, name=None, env_file=None):
+    def __init__(self, filename=None, name=None, env_file=None, sandbox=False):
         self.set_filename(filename)
         self.set_name(name)
+        self.sandbox = sandbox
+        self._client = None
+        self.state = InstanceState()
+        self._running = None
+        self._history = None
+        self._specs = None
+        self._cache = None
+        self._store = None
+        self._leases = None
+        self._builds = None
+        self._digests = None
+        self._build_keys = {}
         self.load()
         self.parse()
         self.env_file = env_file
-        self.client = get_client()
-        self.running = self.get_already_running()
 
     # Names
 
@@ -50,6 +84,15 @@ class Project:
     def __repr__(self):
         return self.__str__()
 
+    @property
+    def client(self):
+        """
+        The spython client, created on first use (see utils.get_client).
+        """
+        if self._client is None:
+            self._client = get_client()
+        return self._client
+
     def get_instance_names(self):
         """
         Return a list of names.
@@ -95,27 +138,345 @@ class Project:
         self.name = (name or self.working_dir).lower()
 
     # Listing
-    def ps(self):
+    def get_ps_table(self):
         """
-        Ps will print a table of instances, including pids and names.
+        Get rows (name, pid, ip, image, uptime) for running instances.
         """
         instance_names = self.get_instance_names()
         table = []
-        for instance in self.client.instances(quiet=True, sudo=self.sudo):
-            if instance.name in instance_names:
-                image = os.path.basename(instance._image)
-                ip_address = getattr(instance, "ip_address", None)
+        now = time.time()
+        for instance in self.state.list(sudo=self.sudo):
+            if instance["instance"] in instance_names:
+                image = os.path.basename(instance.get("img") or "")
+                ip_address = instance.get("ip") or ""
+                started = get_process_start(instance["pid"])
+                uptime = format_uptime(now - started) if started else ""
                 table.append(
-                    [instance.name.rjust(13), str(instance.pid), ip_address, image]
+                    [
+                        instance["instance"].rjust(13),
+                        str(instance["pid"]),
+                        ip_address,
+                        image,
+                        uptime,
+                    ]
                 )
+        return table
 
+    def ps(self, watch=False):
+        """
+        Ps will print a table of instances, including pids and names.
+
+        Parameters
+        ==========
+        watch: if True, keep the table on the screen and redraw it whenever
+               an instance appears, disappears or changes.
+        """
+        if not watch:
+            return self._print_ps(self.get_ps_table())
+
+        folders = get_instance_folders(*get_instance_owner(self.sudo))
+        watcher = InstanceWatcher(folders, native=self.state.native)
+        last = None
+        changed = True
+        try:
+            while True:
+                self.state.invalidate(self.sudo)
+                table = self.get_ps_table()
+
+                # Uptime is always different, so compare the other columns
+                # and only refresh it when we time out waiting for changes
+                rows = [row[:-1] for row in table]
+                if rows != last or not changed:
+                    if bot.outputStream.isatty():
+                        bot.outputStream.write("\033[H\033[J")
+                    self._print_ps(table)
+                    last = rows
+                changed = watcher.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+
+    def _print_ps(self, table):
+        """
+        Print a table of instances from get_ps_table.
+        """
         bot.custom(
             prefix="INSTANCES ",
-            message="NAME         PID     IP              IMAGE",
+            message="NAME         PID     IP              IMAGE      UPTIME",
             color="CYAN",
         )
         bot.table(table)
 
+    def images(self, names=None, labels=False):
+        """
+        Print the image of each instance, read from its SIF header without
+        running singularity: the size, when it was built, the architecture
+        and the image id (see SIFImage).
+
+        Parameters
+        ==========
+        names: the names of instances to show (defaults to all)
+        labels: also print the labels of each image
+        """
+        rows = []
+        found = {}
+        for instance in self.iter_instances(names or self.get_instance_names()):
+            if instance.name in found:
+                continue
+            image = instance.get_image()
+            found[instance.name] = None
+            row = [instance.name.rjust(13)]
+            if not os.path.exists(image):
+                rows.append(row + ["", "", "", "", "missing"])
+                continue
+            if os.path.isdir(image):
+                rows.append(row + ["", "", "", "sandbox", image])
+                continue
+            size = format_size(os.path.getsize(image)).rjust(7)
+            try:
+                with SIFImage(image) as sif:
+                    created = time.strftime(
+                        "%Y-%m-%d %H:%M", time.localtime(sif.created)
+                    )
+                    rows.append(
+                        row + [size, created, sif.arch.ljust(7), sif.id[:8], image]
+                    )
+                    found[instance.name] = sif.get_labels()
+            except SIFError:
+                rows.append(row + [size, "", "", "", image])
+
+        bot.custom(
+            prefix="IMAGES ",
+            message="INSTANCE        SIZE  CREATED           ARCH     ID        PATH",
+            color="CYAN",
+        )
+        bot.table(rows)
+        if labels:
+            for name, found_labels in found.items():
+                for key, value in sorted((found_labels or {}).items()):
+                    bot.custom(prefix=name, message="%s: %s" % (key, value))
+        return found
+
+    def verify(self, names=None, jobs=None, update=False):
+        """
+        Check the image of each instance against the sha256 recorded when it
+        was built or pulled (e.g., after copying a project to another node).
+        Images are hashed at the same time, and an image that hasn't changed
+        since it was last hashed (same path, inode, size and modification
+        time) isn't read again (see FileHashes). Returns the names of images
+        that are missing or changed.
+
+        Parameters
+        ==========
+        names: the names of instances to verify (defaults to all)
+        jobs: the number of images to hash at once (defaults to the cpus)
+        update: record the current sha256 of each image instead
+        """
+        images = {}
+        for instance in self.iter_instances(names or self.get_instance_names()):
+            images.setdefault(instance.name, instance.get_image())
+
+        found = [x for x in images.values() if os.path.isfile(x)]
+        try:
+            digests = self.cache.hashes.get_many(found, jobs)
+        finally:
+            self.cache.save()
+
+        rows = []
+        failed = []
+        for name, image in images.items():
+            digest = digests.get(image)
+            expected = self.digests.get(name)
+            if os.path.isdir(image):
+                state = "sandbox"
+            elif digest is None:
+                state = "missing"
+            elif update:
+                self.digests[name] = digest
+                state = "recorded"
+            elif expected is None:
+                state = "unknown"
+            else:
+                state = "ok" if digest == expected else "changed"
+            if state in ["missing", "changed"]:
+                failed.append(name)
+            rows.append([name.rjust(13), state.ljust(8), (digest or "")[:12], image])
+
+        if update:
+            self.save_state()
+        bot.custom(
+            prefix="VERIFY ",
+            message="INSTANCE     STATE     SHA256        PATH",
+            color="CYAN",
+        )
+        bot.table(rows)
+        return failed
+
+    def verify_image(self, instance):
+        """
+        Check the image of an instance before it's started (see verify).
+        Returns False if it changed, and True if it matches, if no sha256
+        was recorded for it, or if it's a sandbox (which we don't hash).
+        """
+        image = instance.get_image()
+        if instance.sandbox:
+            return True
+        expected = self.digests.get(instance.name)
+        if expected is None:
+            bot.warning("No sha256 recorded for %s, not verified." % image)
+            return True
+        digest = self.cache.hashes.get(image)
+        if digest != expected:
+            bot.error("%s has sha256 %s, expected %s" % (image, digest, expected))
+            return False
+        return True
+
+    def show_history(self, names=None, clear=False):
+        """
+        Print how long builds, pulls, starts and readiness took for each
+        instance, as the median (p50), 95th percentile (p95) and last run.
+
+        Parameters
+        ==========
+        names: the names of instances to show (defaults to all)
+        clear: forget the history instead
+        """
+        if clear:
+            self.history.clear(names)
+            return self.history.save()
+
+        rows = []
+        for name, event, runs, p50, p95, last in self.history.summary(names):
+            rows.append(
+                [
+                    name.rjust(13),
+                    event.ljust(7),
+                    str(runs).rjust(4),
+                    format_duration(p50).rjust(7),
+                    format_duration(p95).rjust(7),
+                    format_duration(last).rjust(7),
+                ]
+            )
+        bot.custom(
+            prefix="HISTORY ",
+            message="INSTANCE       EVENT   RUNS      P50      P95     LAST",
+            color="CYAN",
+        )
+        bot.table(rows)
+
+    def prune(self, max_size=0, dry_run=False):
+        """
+        Remove files that scompose created, least recently used first, until
+        what's left is at most max_size bytes (see get_prune_set). Images
+        of running instances, of this project or any other, are never
+        removed. Returns the entries removed (or that would be).
+
+        Parameters
+        ==========
+        max_size: the bytes to keep at most (0 removes everything unused)
+        dry_run: only show what would be removed, and the space it frees
+        """
+        prune = self.get_prune_set()
+        total = prune.get_size()
+        selected = prune.select(max_size)
+        if not selected:
+            bot.info(
+                "Nothing to remove, %s is within %s."
+                % (format_size(total), format_size(max_size))
+            )
+            return selected
+
+        now = time.time()
+        rows = []
+        for entry in selected:
+            path = entry.paths[0]
+            if len(entry.paths) > 1:
+                path = "%s (+%s more)" % (path, len(entry.paths) - 1)
+            rows.append(
+                [
+                    entry.kind.ljust(11),
+                    format_size(entry.size).rjust(7),
+                    format_uptime(now - entry.used).rjust(11),
+                    path,
+                ]
+            )
+        bot.custom(
+            prefix="PRUNE ",
+            message="KIND           SIZE   LAST USED  PATH",
+            color="CYAN",
+        )
+        bot.table(rows)
+
+        freed = sum(x.size for x in selected)
+        if dry_run:
+            bot.info(
+                "Would free %s of %s, leaving %s."
+                % (format_size(freed), format_size(total), format_size(total - freed))
+            )
+            return selected
+
+        digests = []
+        for entry in selected:
+            if not entry.remove():
+                freed -= entry.size
+            for path in entry.paths:
+                if path.startswith(os.path.join(self.store.root, "blobs")):
+                    digests.append(os.path.basename(path)[:-4])
+        remove_refs(self.store.root, digests)
+        bot.info(
+            "Freed %s of %s, leaving %s."
+            % (format_size(freed), format_size(total), format_size(total - freed))
+        )
+        return selected
+
+    def get_prune_set(self):
+        """
+        Get the files that prune can remove: instance images built or pulled
+        for this project, the build cache and image store they are linked
+        from, build logs, temporary files of builds that didn't finish, and
+        the generated hosts and resolv.conf. Images given as files are the
+        user's, and are left alone.
+        """
+        prune = PruneSet()
+        running = [x for x in self.get_instance_names() if x in self.running]
+
+        for name in self.get_instance_names():
+            instance = self.instances[name]
+            image = instance.get_image()
+            if image == instance.image or instance.sandbox:
+                continue
+            if instance.recipe is None and "://" not in (instance.image or ""):
+                continue
+            prune.add("image", image, "running" if name in running else None)
+            prune.add_tmp("tmp", "%s.*.tmp" % image)
+
+        for name in ["etc.hosts", "resolv.conf"]:
+            path = os.path.join(self.working_dir, name)
+            prune.add("config", path, "running" if running else None)
+
+        for path in find_files(
+            os.path.join(self.working_dir, ".scompose", "logs", "*.log")
+        ):
+            prune.add("log", path)
+
+        images = os.path.join(self.cache.root, "images")
+        for path in find_files(os.path.join(images, "*.sif")):
+            prune.add("cache", path)
+        prune.add_tmp("tmp", os.path.join(images, "*.tmp"))
+
+        blobs = os.path.join(self.store.root, "blobs", "sha256")
+        for path in find_files(os.path.join(blobs, "*.sif")):
+            prune.add("store", path)
+        prune.add_tmp("tmp", os.path.join(blobs, "*.tmp"))
+        prune.add_tmp("tmp", os.path.join(self.store.root, "tmp", "*.sif"))
+
+        # Running instances of any project keep their images
+        for record in self.running.values():
+            if record.get("img"):
+                prune.protect(record["img"], "running")
+        return prune
+
     def iter_instances(self, names):
         """
         Yield instances one at a time.
@@ -151,6 +512,106 @@ class Project:
         return instance
 
     # Loading Functions
+    @property
+    def running(self):
+        """
+        Already running instances, looked up the first time they are needed.
+        """
+        if self._running is None:
+            self._running = self.get_already_running()
+        return self._running
+
+    @property
+    def history(self):
+        """
+        Durations of builds, starts and readiness, loaded on first use.
+        """
+        if self._history is None:
+            self._history = History(self.get_state_path("history.json"))
+        return self._history
+
+    @property
+    def specs(self):
+        """
+        The launch specs that running instances were started with, loaded on
+        first use.
+        """
+        if self._specs is None:
+            self._specs = Specs(self.get_state_path("specs.json"))
+        return self._specs
+
+    @property
+    def cache(self):
+        """
+        The build cache, shared by all projects (see BuildCache).
+        """
+        if self._cache is None:
+            self._cache = BuildCache()
+        return self._cache
+
+    @property
+    def store(self):
+        """
+        The store of pulled images, shared by all projects (see ImageStore).
+        """
+        if self._store is None:
+            self._store = ImageStore()
+        return self._store
+
+    @property
+    def leases(self):
+        """
+        The leases of instance addresses, shared by all projects (see LeaseStore).
+        """
+        if self._leases is None:
+            self._leases = LeaseStore()
+        return self._leases
+
+    @property
+    def builds(self):
+        """
+        A lookup of instance names to the build cache key of their image.
+        """
+        if self._builds is None:
+            self._builds = JsonLookup(self.get_state_path("builds.json"))
+        return self._builds
+
+    @property
+    def digests(self):
+        """
+        A lookup of instance names to the sha256 of the image built or pulled
+        for them, to verify images against (see verify).
+        """
+        if self._digests is None:
+            self._digests = JsonLookup(self.get_state_path("digests.json"))
+        return self._digests
+
+    def save_state(self):
+        """
+        Save history, launch specs, builds and digests that were loaded and
+        changed.
+        """
+        for state in [
+            self._history,
+            self._specs,
+            self._cache,
+            self._builds,
+            self._digests,
+        ]:
+            if state is not None:
+                state.save()
+
+    def get_durations(self, graph):
+        """
+        Estimate how long each instance in a graph takes to start (and to be
+        healthy, if it has a healthcheck) from its history.
+        """
+        durations = {}
+        for section in graph:
+            name = self.config["instances"][section].get("name", section)
+            durations[section] = self.history.estimate(name, ["start", "ready"])
+        return durations
+
     def get_already_running(self):
         """
         Get already running instances.
@@ -159,27 +620,40 @@ class Project:
         derive a list of already running instances to include
         """
         # Get list of existing instances to skip addresses
-        instances = self.client.instances(quiet=True, return_json=True)
+        instances = self.state.list()
 
         # We can only get instances run by sudo if we have it
         if self.sudo:
-            instances += self.client.instances(quiet=True, return_json=True, sudo=True)
+            instances = instances + self.state.list(sudo=True)
 
         return {x["instance"]: x for x in instances}
 
     def load(self):
         """load a singularity-compose.yml recipe, and validate it."""
-        # merge/override yaml properties where applicable
-        self.config = merge_config(self.filenames)
+        # merge/override yaml properties where applicable, or use the config
+        # compiled by the last command if the files are the same
+        self.config = merge_config(
+            self.filenames,
+            cache_file=os.path.join(self.working_dir, ".scompose", "config.json"),
+            validate=True,
+        )
 
     def parse(self):
         """
         Parse a loaded config
+
+        Instances are not created here. We derive the ordered replica names
+        from the config, and each Instance is created the first time it is
+        accessed, so commands that target one instance only pay for that one.
         """
 
         # If a port is defined, we need root.
         self.sudo = False
 
+        # Lookup of replica name to (section name, replica number)
+        self.replicas = {}
+        self._templates = {}
+
         if self.config is not None:
             # If any of config has ports, and no fakeroot, must use sudo
             for name in self.config.get("instances", []):
@@ -194,50 +668,150 @@ class Project:
                 ):
                     self.sudo = True
 
-            # Create each instance object
+            # Derive the name of each replica
             for name in self.config.get("instances", []):
                 params = self.config["instances"][name]
                 replicas = params.get("deploy", {"replicas": 1})["replicas"]
 
                 # 1-indexed to mimic docker-compose behaviour
                 for idx in range(1, replicas + 1):
-                    tmp_inst = Instance(
-                        name=name,
-                        replica_number=idx,
-                        # deepcopy is required otherwise changes to one replica would reflect on
-                        # others since they point to the same memory reference
-                        params=deepcopy(params),
-                        sudo=self.sudo,
-                        working_dir=self.working_dir,
-                    )
-                    self.instances[tmp_inst.get_replica_name()] = tmp_inst
+                    replica_name = "%s%s" % (params.get("name", name), idx)
+                    self.replicas[replica_name] = (name, idx)
+
+        self.instances = LazyInstances(
+            self._sort_instances(list(self.replicas)), self._load_instance
+        )
+
+    def _load_instance(self, replica_name):
+        """
+        Create the Instance for a replica, called when it is first accessed.
+        """
+        return self._new_instance(*self.replicas[replica_name])
+
+    def _new_instance(self, name, idx):
+        """
+        Create the Instance for replica number idx of a section.
+        """
+        return Instance(
+            name=name,
+            replica_number=idx,
+            working_dir=self.working_dir,
+            template=self.get_template(name),
+        )
 
-            self.instances = self._sort_instances(self.instances)
+    def get_template(self, name):
+        """
+        Get the parsed config of a section, shared by its replicas (see
+        InstanceTemplate). It's parsed the first time a replica is created.
+        """
+        if name not in self._templates:
+            template = InstanceTemplate(
+                name,
+                self.working_dir,
+                sudo=self.sudo,
+                params=self.config["instances"][name],
+                state=self.state,
+                sandbox=self.sandbox,
+                client=self._client,
+            )
 
             # Update volumes with volumes from
-            for _, instance in self.instances.items():
-                instance.set_volumes_from(self.instances)
+            template.set_volumes_from(self.get_volumes_from(name))
+            self._templates[name] = template
+        return self._templates[name]
 
-    def _sort_instances(self, instances):
+    def get_section(self, name):
+        """
+        Get the config section for a section, instance or replica name.
         """
-        Eventually reorder instances based on depends_on constraints
+        sections = self.config.get("instances", {})
+        if name in sections:
+            return name
+        if name in self.replicas:
+            return self.replicas[name][0]
+        for section, params in sections.items():
+            if params.get("name") == name:
+                return section
+
+    def get_volumes_from(self, name, seen=None):
         """
-        sorted_instances = []
-        for instance in self.instances:
-            depends_on = self.instances[instance].params.get("depends_on", [])
+        Get the volumes that a section shares from others via volumes_from.
 
-            try:
-                index = sorted_instances.index(instance)
-            except ValueError:
-                sorted_instances.append(instance)
-                index = sorted_instances.index(instance)
+        Shared volumes of the other sections are followed too, and each
+        section is only visited once.
+
+        Parameters
+        ==========
+        name: the section name to derive volumes for
+        """
+        seen = seen or set([name])
+        volumes = []
+        params = self.config["instances"][name]
+        for other in params.get("volumes_from", []):
+            section = self.get_section(other)
+            if section is None:
+                bot.exit("%s not in config is specified to get volumes from." % other)
+            if section in seen:
+                continue
+            seen.add(section)
+            shared = self.config["instances"][section].get("volumes", [])
+            shared = shared + self.get_volumes_from(section, seen)
+            for volume in shared:
+                if volume not in volumes:
+                    volumes.append(volume)
+        return volumes
+
+    def _sort_instances(self, names):
+        """
+        Order replica names so each comes after the replicas it depends on.
 
-            for dep in depends_on:
-                for inst in instances.values():
-                    if dep == inst.name:
-                        sorted_instances.insert(index, inst.get_replica_name())
+        Dependencies on instances that are not defined, and cycles, are
+        reported later (e.g., when instances are created).
+        """
+        return self.get_graph(names, strict=False).order()
+
+    def get_graph(self, names, strict=True):
+        """
+        Get the dependency graph (depends_on) for a list of replicas.
 
-        return {k: self.instances[k] for k in sorted_instances}
+        A dependency on an instance is a dependency on all of its replicas
+        that are included in names. Replicas that aren't included must be
+        running already, otherwise we exit.
+
+        Parameters
+        ==========
+        names: the replica names to derive dependencies for
+        strict: if False, ignore dependencies that are not included in names,
+                or not defined at all.
+        """
+        graph = DependencyGraph()
+        for name in names:
+            graph.add(self.replicas[name][0], [name])
+
+        running = None
+        for section in list(graph):
+            params = self.config["instances"][section]
+            for dep, condition in get_depends_on(params).items():
+                other = self.get_section(dep)
+                if other in graph:
+                    graph.add(section, depends_on={other: condition})
+                    if condition["condition"] == "service_healthy" and not (
+                        self.config["instances"][other].get("healthcheck")
+                    ):
+                        bot.exit(
+                            "%s depends on %s being healthy, but %s has no healthcheck."
+                            % (section, dep, dep)
+                        )
+                    continue
+                if not strict:
+                    continue
+                if other is None:
+                    bot.exit("%s depends on %s, which is not defined." % (section, dep))
+                if running is None:
+                    running = set(self.get_section(x) for x in self.running)
+                if other not in running:
+                    bot.exit("%s depends on %s, which is not running." % (section, dep))
+        return graph
 
     # Networking
 
@@ -247,30 +821,45 @@ class Project:
 
         Based on a bridge address that can serve other addresses (akin to
         a router, metaphorically, generate a pre-determined address for
-        each container.
+        each container. Each replica gets a lease on its address (see
+        LeaseStore), so it gets the same address when started again, and
+        projects started at once on a node never get the same address.
 
         Parameters
         ==========
         names: a list of names of instances to generate addresses for.
         bridge: the bridge address to derive them for.
         """
-
-        host_iter = IPv4Network(bridge).hosts()
         lookup = {}
 
-        # Don't include the gateway
-        next(host_iter)
-
         # If an instance is already running, we want to include it
         all_names = set(self.get_instance_names())
-        skip_addresses = [x["ip"] for name, x in self.running.items() if x["ip"]]
 
-        # Only use addresses not currently in use
-        for name in names:
-            ip_address = str(next(host_iter))
-            while ip_address in skip_addresses:
-                ip_address = str(next(host_iter))
-            lookup[name] = ip_address
+        with self.leases.open(bridge, running=self.running) as subnet:
+            # Addresses in use are skipped, leased or not
+            for name, instance in self.running.items():
+                if instance["ip"]:
+                    subnet.reserve(instance["ip"])
+
+            # Replicas of ours that aren't running (e.g., were killed) let go
+            prefix = self.get_lease_key("")
+            for key in list(subnet.leases):
+                if key.startswith(prefix) and key[len(prefix) :] not in self.running:
+                    subnet.release(key)
+
+            # Running instances keep their address, others get a lease
+            for name in names:
+                key = self.get_lease_key(name)
+                if name in self.running and self.running[name]["ip"]:
+                    lookup[name] = self.running[name]["ip"]
+                    subnet.claim(key, lookup[name])
+                    continue
+                lookup[name] = subnet.allocate(key)
+                if lookup[name] is None:
+                    bot.exit(
+                        "There are no addresses left in %s for %s."
+                        % (subnet.network, name)
+                    )
 
         # Add instances that are already running
         for name in all_names:
@@ -279,6 +868,23 @@ class Project:
 
         return lookup
 
+    def get_lease_key(self, name):
+        """
+        Get the key of the address lease of a replica, unique to the project.
+        """
+        return "%s:%s" % (self.working_dir, name)
+
+    def release_ips(self, names):
+        """
+        Release the address leases of replicas that were stopped. They get
+        the same address back when started again, if it's still free.
+        Replicas that are still running (e.g., didn't stop) keep theirs.
+        """
+        self._running = None
+        self.leases.release(
+            [self.get_lease_key(x) for x in names if x not in self.running]
+        )
+
     def get_bridge_address(self, name="sbr0"):
         """
         Get the (named) bridge address on the host.
@@ -361,9 +967,11 @@ class Project:
             bot.exit("Cannot find %s, is it up?" % name)
 
         if instance.exists():
-            self.client.quiet = True
             result = self.client.run(
-                instance.instance.get_uri(), sudo=self.sudo, return_result=True
+                instance.instance.get_uri(),
+                sudo=self.sudo,
+                return_result=True,
+                quiet=True,
             )
 
             if result["return_code"] != 0:
@@ -431,7 +1039,7 @@ class Project:
 
     # Down
 
-    def down(self, names=None, timeout=None):
+    def down(self, names=None, timeout=None, parallel=1):
         """
         Stop one or more instances.
         If no names are provided, bring them all down.
@@ -440,24 +1048,106 @@ class Project:
         ==========
         names: a list of names of instances to bring down. If not specified, we
         bring down all instances.
+        timeout: kill instances that haven't stopped after this many seconds.
+                 When stopping in parallel, this is a deadline for all of them.
+        parallel: the number of instances to stop at once. If more than one,
+                  each instance stops as soon as instances that depend on it
+                  have stopped.
         """
         if not names:
             names = self.get_instance_names()
             # Ordered shutdown in case of depends_on
             names.reverse()
 
+        if parallel > 1:
+            self._down_parallel(names, timeout, parallel)
+        else:
+            for instance in self.iter_instances(names):
+                instance.stop(timeout=timeout)
+        self.release_ips(names)
+
+        # Running instances are looked up again when next needed
+        self._running = None
+
+    def _down_parallel(self, names, timeout, parallel):
+        """
+        Stop instances in parallel, in reverse dependency order.
+
+        The timeout is one deadline for the whole shutdown. Each stop is given
+        the time left until the deadline, and instances that are still
+        waiting to stop when it passes are killed right away.
+
+        Parameters
+        ==========
+        names: the replica names to stop
+        timeout: seconds until every instance is stopped (or killed)
+        parallel: the number of instances to stop at once
+        """
+        graph = self._get_stop_graph(names)
+
+        # Instances (and their state) are loaded here, since that isn't thread safe
+        instances = {}
         for instance in self.iter_instances(names):
-            instance.stop(timeout=timeout)
+            if instance.instance is not None:
+                instances[instance.get_replica_name()] = instance
+
+        deadline = time.time() + timeout if timeout else None
+
+        def stop(name):
+            if name not in instances:
+                return
+            if deadline is None:
+                return instances[name].stop()
+            remaining = int(deadline - time.time())
+            if remaining < 1:
+                instances[name].stop(force=True)
+            else:
+                instances[name].stop(timeout=remaining)
+
+        tasks, groups, _ = graph.schedule()
+        scheduler = Scheduler(workers=parallel, fail_fast=False)
+        scheduler.run(tasks, stop, groups=groups)
+        if scheduler.report(action="stop"):
+            bot.exit("Unable to stop all instances.")
+
+    def _get_stop_graph(self, names):
+        """
+        Get the graph to stop instances with: an instance stops after the
+        instances that depend on it.
+        """
+        graph = self.get_graph(names, strict=False)
+        if not graph.find_cycles():
+            return graph.reverse()
+
+        bot.warning("Circular dependencies, stopping without an order.")
+        graph = DependencyGraph()
+        for name in names:
+            graph.add(name, [name])
+        return graph
 
     # Create
 
     def create(
-        self, names=None, writable_tmpfs=True, bridge="10.22.0.0/16", no_resolv=False
+        self,
+        names=None,
+        writable_tmpfs=True,
+        bridge="10.22.0.0/16",
+        no_resolv=False,
+        parallel=1,
+        recreate=True,
+        verify=False,
     ):
         """
         Call the create function, which defaults to the command instance.create()
         """
-        return self._create(names, writable_tmpfs=writable_tmpfs, no_resolv=no_resolv)
+        return self._create(
+            names,
+            writable_tmpfs=writable_tmpfs,
+            no_resolv=no_resolv,
+            parallel=parallel,
+            recreate=recreate,
+            verify=verify,
+        )
 
     def up(
         self,
@@ -465,11 +1155,19 @@ class Project:
         writable_tmpfs=True,
         bridge="10.22.0.0/16",
         no_resolv=False,
+        parallel=1,
+        recreate=True,
+        rolling=False,
+        max_unavailable=1,
+        max_surge=0,
+        verify=False,
     ):
         """
         Call the up function, instance.up().
 
-        This will build before if a container binary does not exist.
+        This will build before if a container binary does not exist. With
+        rolling, instances to recreate are replaced a batch at a time (see
+        roll) instead of all at once.
         """
         return self._create(
             names,
@@ -477,6 +1175,12 @@ class Project:
             writable_tmpfs=writable_tmpfs,
             bridge=bridge,
             no_resolv=no_resolv,
+            parallel=parallel,
+            recreate=recreate,
+            rolling=rolling,
+            max_unavailable=max_unavailable,
+            max_surge=max_surge,
+            verify=verify,
         )
 
     def _create(
@@ -486,6 +1190,12 @@ class Project:
         writable_tmpfs=True,
         bridge="10.22.0.0/16",
         no_resolv=False,
+        parallel=1,
+        recreate=True,
+        rolling=False,
+        max_unavailable=1,
+        max_surge=0,
+        verify=False,
     ):
         """
         Create one or more instances.
@@ -504,60 +1214,1129 @@ class Project:
                 see /usr/local/etc/singularity/network/00_bridge.conflist
         no_resolv: if True, don't create and bind a resolv.conf with Google
                    nameservers.
+        parallel: the number of instances to start at once. If more than one,
+                  each instance starts as soon as its dependencies are up.
+        recreate: if True, stop running instances whose launch spec changed
+                  (and instances that depend on them) to create them again.
+        rolling: if True, recreate them a batch at a time after the others
+                 are created, see roll for max_unavailable and max_surge.
+        verify: if True, check each image against its recorded sha256 before
+                starting an instance from it (see verify).
+        """
+        changes = {}
+        if recreate:
+            if command == "up":
+                self._build_running(names, parallel)
+            changes = self.get_changes(names, writable_tmpfs, no_resolv)
+            if changes:
+                names = self._get_recreate_names(names, changes)
+                if not rolling:
+                    self.down(list(reversed(changes)), parallel=parallel)
+
+        graph, options = self._prepare_create(names, bridge, no_resolv)
+        options.update(
+            {"command": command, "writable_tmpfs": writable_tmpfs, "verify": verify}
+        )
+        if verify:
+            self._hash_images(graph.order())
+        try:
+            if parallel > 1:
+                self._create_parallel(graph, parallel, **options)
+            else:
+                healthy = {}
+                for instance in self.iter_instances(graph.order()):
+                    section = self.replicas[instance.get_replica_name()][0]
+                    self._wait_healthy(graph, section, healthy)
+                    self._create_instance(instance, **options)
+        finally:
+            self.save_state()
+
+        # Instances to recreate are still running, and replaced in batches
+        if rolling and changes:
+            self.roll(
+                list(changes),
+                max_unavailable=max_unavailable,
+                max_surge=max_surge,
+                writable_tmpfs=writable_tmpfs,
+                bridge=bridge,
+                no_resolv=no_resolv,
+                verify=verify,
+            )
+
+    def _build_running(self, names, jobs=1):
+        """
+        Build (or pull) the images of running instances that need it before
+        we look for changes, so they are recreated from the new image (e.g.,
+        an updated sandbox) on this up rather than the next one.
+        """
+        names = [x for x in names or self.get_instance_names() if x in self.running]
+        if jobs > 1:
+            return self._build_parallel(names, jobs)
+        for instance in self.iter_instances(names):
+            if self.needs_build(instance) and not self.build_instance(instance):
+                bot.exit("Unable to build the image for %s." % instance.name)
+
+    def _hash_images(self, names):
+        """
+        Hash the images of instances that changed since they were last
+        hashed, at the same time, so verifying each before it starts is quick.
+        """
+        images = [x.get_image() for x in self.iter_instances(names)]
+        self.cache.hashes.get_many([x for x in images if os.path.isfile(x)])
+
+    def roll(
+        self,
+        names=None,
+        max_unavailable=1,
+        max_surge=0,
+        writable_tmpfs=True,
+        bridge="10.22.0.0/16",
+        no_resolv=False,
+        verify=False,
+    ):
+        """
+        Restart running instances a batch at a time (a rolling restart), so
+        an instance with replicas keeps serving while it is restarted.
+
+        Instances are restarted in dependency order. Replicas of an instance
+        are replaced up to max_unavailable at a time, and each batch has to
+        be ready (healthy, if the instance has a healthcheck) before the next
+        is stopped. With max_surge, that many extra replicas (e.g., app4 for
+        an instance with three) are started and ready first, so as many more
+        can be replaced at once without losing capacity. They are stopped
+        when the instance is done.
+
+        If a replica isn't ready, we stop there and leave the rest running.
+
+        Parameters
+        ==========
+        names: the names of instances to restart (defaults to all running)
+        max_unavailable: replicas of an instance that can be down at once
+        max_surge: extra replicas of an instance to start during the restart
+        writable_tmpfs: if the instances should be given writable to tmp
+        bridge: the bridge address to derive addresses for extra replicas
+        no_resolv: if True, don't bind a resolv.conf and hosts file
+        verify: if True, check images before starting instances (see verify)
+        """
+        if min(max_unavailable, max_surge) < 0 or max_unavailable + max_surge < 1:
+            bot.exit("max_unavailable and max_surge can't be negative, or both 0.")
+
+        self._running = None
+        names = [x for x in names or self.get_instance_names() if x in self.running]
+        if not names:
+            bot.info("There are no running instances to restart.")
+            return
+
+        graph, options = self._prepare_create(names, bridge, no_resolv)
+        options.update(
+            {"command": "up", "writable_tmpfs": writable_tmpfs, "verify": verify}
+        )
+        try:
+            for section in graph.sort():
+                members = graph.members[section]
+                surge = min(max_surge, len(members))
+                self._roll_instance(
+                    section, members, options, max_unavailable, surge, bridge
+                )
+        finally:
+            self.save_state()
+
+    def _roll_instance(self, section, members, options, max_unavailable, surge, bridge):
+        """
+        Restart the running replicas of one instance in batches (see roll),
+        with a number of extra replicas (surge) started first.
+        """
+        instances = {x.get_replica_name(): x for x in self.iter_instances(members)}
+
+        def restart(name):
+            instances[name].stop()
+            self._create_instance(instances[name], **options)
+            if not self.is_ready(instances[name]):
+                raise RuntimeError("not ready")
+
+        started = []
+        try:
+            # Extra replicas keep capacity up while the others are replaced
+            extra = self._get_surge(section, surge)
+            lookup = self.get_ip_lookup([x.get_replica_name() for x in extra], bridge)
+            for instance in extra:
+                started.append(instance)
+                self._create_instance(instance, **dict(options, lookup=lookup))
+                if not self.is_ready(instance):
+                    bot.exit("%s is not ready, stopping the restart." % instance)
+
+            size = max_unavailable + surge
+            for start in range(0, len(members), size):
+                batch = members[start : start + size]
+                scheduler = Scheduler(workers=len(batch))
+                scheduler.run({x: [] for x in batch}, restart)
+                if scheduler.report(action="restart"):
+                    bot.exit("Stopping the restart of %s." % section)
+        finally:
+            for instance in started:
+                instance.stop()
+                self.specs.remove(instance.get_replica_name())
+            self.release_ips([x.get_replica_name() for x in started])
+
+    def _get_surge(self, section, count):
+        """
+        Get extra replicas of an instance, numbered after the last replica.
+        """
+        last = max(idx for name, idx in self.replicas.values() if name == section)
+        return [self._new_instance(section, last + x) for x in range(1, count + 1)]
+
+    def is_ready(self, instance):
+        """
+        An instance is ready when it passes its healthcheck, or if it doesn't
+        have one, when it is running.
+        """
+        if instance.get_healthcheck() is None:
+            return instance.exists()
+        return self.check_health(instance)
+
+    def get_changes(self, names=None, writable_tmpfs=True, no_resolv=False):
+        """
+        Find running instances that up would recreate: instances started with
+        a launch spec (see Instance.get_spec) that has since changed, and the
+        running instances that depend on them. Instances started before specs
+        were recorded are left alone.
+
+        Returns an ordered lookup of replica names to the reason.
+
+        Parameters
+        ==========
+        names: the names of instances to check (defaults to all)
+        writable_tmpfs: if instances would be given writable to tmp
+        no_resolv: if instances would be created without resolv.conf and hosts
+        """
+        names = names or self.get_instance_names()
+        binds = self.get_binds(no_resolv)
+        changes = {}
+        started = [x for x in names if x in self.running and self.specs.get(x)]
+        for instance in self.iter_instances(started):
+            name = instance.get_replica_name()
+            spec = instance.get_spec(binds, writable_tmpfs)
+            if self.specs.is_current(name, spec):
+                continue
+            old = self.specs.get(name)
+            fields = get_changed_fields(old, spec)
+
+            changes[name] = "changed %s" % ", ".join(fields)
+        if not changes:
+            return changes
+
+        # Running instances that depend on a changed one go too
+        included = [
+            x for x in self.get_instance_names() if x in self.running or x in names
+        ]
+        graph = self.get_graph(included, strict=False)
+        changed = set(self.replicas[x][0] for x in changes)
+        for section in graph.sort():
+            for dep in graph.get_edges(section):
+                if dep not in changed:
+                    continue
+                changed.add(section)
+                for member in graph.members[section]:
+                    if member in self.running and member not in changes:
+                        changes[member] = "depends on %s" % dep
+                break
+        return {x: changes[x] for x in graph.order() if x in changes}
+
+    def _get_recreate_names(self, names, changes):
+        """
+        Add instances to recreate to the names to create, and say why.
+        """
+        for name, reason in changes.items():
+            bot.info("Recreating %s, %s" % (name, reason))
+        if not names:
+            return names
+        return names + [x for x in changes if x not in names]
+
+    def diff(self, names=None, writable_tmpfs=True, no_resolv=False):
+        """
+        Show what up would do: which running instances it would recreate
+        (see get_changes), and which instances it would create.
+
+        Parameters
+        ==========
+        names: the names of instances to check (defaults to all)
+        writable_tmpfs: if instances would be given writable to tmp
+        no_resolv: if instances would be created without resolv.conf and hosts
+        """
+        names = list(names or self.get_instance_names())
+        changes = self.get_changes(names, writable_tmpfs, no_resolv)
+        for name in changes:
+            if name not in names:
+                names.append(name)
+
+        created = [x for x in names if x not in self.running]
+        if not changes and not created:
+            bot.info("Running instances are up to date.")
+            return changes
+
+        for name in self._sort_instances(names):
+            if name in changes:
+                message = "%s %s" % (name, changes[name])
+                bot.custom(prefix="RECREATE", message=message, color="YELLOW")
+            elif name in created:
+                bot.custom(prefix="CREATE", message=name, color="CYAN")
+        return changes
+
+    def _wait_healthy(self, graph, section, healthy):
+        """
+        Before creating an instance (one at a time), wait for the instances
+        it depends on with condition service_healthy to be healthy.
+
+        Parameters
+        ==========
+        graph: the dependency graph of the instances being created
+        section: the instance to be created
+        healthy: a lookup of replica names already checked to their health
+        """
+        for dep in graph.get_edges(section):
+            condition, replicas = graph.get_condition(section, dep)
+            if condition != "service_healthy":
+                continue
+
+            members = graph.members[dep]
+            needed = min(replicas or len(members), len(members))
+            count = 0
+            for member in members:
+                if member not in healthy:
+                    healthy[member] = self.check_health(self.get_instance(member))
+                count += healthy[member]
+                if count >= needed:
+                    break
+
+            if count < needed:
+                bot.exit(
+                    "%s needs %s of %s healthy, but %s are."
+                    % (section, needed, dep, count)
+                )
+
+    def check_health(self, instance):
+        """
+        Wait for an instance to pass its health check, returning True if it
+        does, or False when the retries run out.
+        """
+        check = instance.get_healthcheck()
+        bot.info("Waiting for %s to be healthy" % instance.get_replica_name())
+        start = time.time()
+        if check.wait(instance):
+            self.history.record(instance.name, "ready", time.time() - start)
+            return True
+        bot.warning(
+            "%s is not healthy after %s checks."
+            % (instance.get_replica_name(), check.retries)
+        )
+        return False
+
+    def _prepare_create(self, names, bridge="10.22.0.0/16", no_resolv=False):
+        """
+        Check dependencies of the instances to create, and generate their
+        addresses, hosts and resolv.conf. Returns the dependency graph, and
+        the lookup of addresses and binds to create each instance with.
         """
         # If no names provided, we create all
         names = names or self.get_instance_names()
 
-        # Keep track of created instances to determine if we have circular dependency structure
-        created = set()
-        circular_dep = False
+        # Check dependencies and cycles before anything is started
+        graph = self.get_graph(names)
+        cycles = graph.find_cycles()
+        if cycles:
+            for cycle in cycles:
+                bot.error("Circular dependency: %s" % " -> ".join(cycle))
+            bot.exit("Unable to create instances with circular dependencies.")
 
         # Generate ip addresses for each
         lookup = self.get_ip_lookup(names, bridge)
 
+        # Generate shared hosts file and a resolv.conf to bind to the containers
         if not no_resolv:
-            # Generate shared hosts file
-            hosts_file = self.create_hosts(lookup)
+            self.generate_resolv_conf()
+            self.create_hosts(lookup)
+        return graph, {"lookup": lookup, "binds": self.get_binds(no_resolv)}
 
-        for instance in self.iter_instances(names):
-            depends_on = instance.params.get("depends_on", [])
-            for dep in depends_on:
-                if dep not in created and dep not in self.running:
-                    circular_dep = True
-
-            # Generate a resolv.conf to bind to the container
-            if not no_resolv:
-                resolv = self.generate_resolv_conf()
-                instance.volumes.append("%s:/etc/resolv.conf" % resolv)
-
-                # Create a hosts file for the instance based, add as volume
-                instance.volumes.append("%s:/etc/hosts" % hosts_file)
-
-            # If we get here, execute command and add to list
-            create_func = getattr(instance, command)
-            create_func(
-                working_dir=self.working_dir,
-                writable_tmpfs=writable_tmpfs,
-                ip_address=lookup[instance.get_replica_name()],
+    def get_binds(self, no_resolv=False):
+        """
+        Get the volumes bound to every instance: the resolv.conf and hosts
+        file (see generate_resolv_conf and create_hosts), unless no_resolv.
+        """
+        if no_resolv:
+            return []
+        return [
+            "%s:/etc/resolv.conf" % os.path.join(self.working_dir, "resolv.conf"),
+            "%s:/etc/hosts" % os.path.join(self.working_dir, "etc.hosts"),
+        ]
+
+    def _create_instance(
+        self, instance, command, lookup, binds, writable_tmpfs, verify=False
+    ):
+        """
+        Create (or bring up) a single instance, and run its post commands.
+
+        Parameters
+        ==========
+        instance: the instance to create
+        command: one of "create" or "up"
+        lookup: the lookup of replica names to ip addresses
+        binds: extra volumes to bind (resolv.conf and hosts)
+        writable_tmpfs: if the instance should be given writable to tmp
+        verify: if True, check the image before starting (see verify_image)
+        """
+        instance.add_volumes(binds)
+
+        # Up builds (or pulls) the image first, if needed
+        if command == "up" and self.needs_build(instance):
+            self.build_instance(instance)
+
+        # Instances that already exist are left alone (and not timed)
+        existed = instance.exists()
+        start = time.time()
+        instance.create(
+            working_dir=self.working_dir,
+            writable_tmpfs=writable_tmpfs,
+            ip_address=lookup[instance.get_replica_name()],
+            verify=self.verify_image if verify else None,
+        )
+        if not existed:
+            self.history.record(instance.name, "start", time.time() - start)
+            self.specs.set(
+                instance.get_replica_name(), instance.get_spec(binds, writable_tmpfs)
+            )
+            touch(instance.get_image())
+
+        # Run post create commands
+        instance.run_post()
+
+    def build_instance(self, instance, log_file=None, cache=True, board=None):
+        """
+        Build (or pull) the image for an instance, recording how long it took.
+        Returns the image path, or None if it could not be built.
+
+        An image built from a recipe comes from the build cache if it has
+        the same build, and is added to it otherwise (see BuildCache). A
+        pulled image comes from the image store (see pull_image).
+
+        Parameters
+        ==========
+        instance: the instance to build the image for
+        log_file: a file for the output (see Instance.build)
+        cache: if False, build from the recipe even if nothing changed
+        board: a StatusBoard to show the progress of a pull on
+        """
+        if not self.needs_build(instance, cache):
+            return instance.get_image()
+
+        if instance.recipe is None:
+            return self.pull_image(instance, log_file, board)
+
+        image = self._restore_build(instance, log_file) if cache else None
+        if image is not None:
+            return image
+
+        start = time.time()
+        output = self.get_build_output(instance)
+        if not instance.build(
+            self.working_dir, log_file=log_file, output=output, update=cache
+        ):
+            return self._finish_build(instance, output, success=False)
+        self.history.record(instance.name, "build", time.time() - start)
+        return self._finish_build(instance, output)
+
+    def pull_image(self, instance, log_file=None, board=None):
+        """
+        Get the image of an instance from the image store, which pulls it
+        only if no instance or project (or the mirror) has it already, and
+        link it into place. Returns the image path, or None if the pull
+        failed.
+
+        A pull shows the bytes transferred, the throughput and the ETA (from
+        the bytes of the last pull) on a status board (see PullMonitor).
+        Without a board we show our own, and the output of the pull goes to
+        a log file under .scompose/logs.
+
+        Parameters
+        ==========
+        instance: the instance to pull the image for
+        log_file: a file for the output of the pull (see Instance.build)
+        board: a StatusBoard with a row for the instance
+        """
+        if board is None:
+            if log_file is None:
+                log_file = self.get_state_path("logs", "pull-%s.log" % instance.name)
+                write_file(log_file, "")
+            with StatusBoard([instance.name]) as board:
+                image = self.pull_image(instance, log_file, board)
+                if image is None:
+                    board.update(instance.name, "failed", log_file)
+                else:
+                    board.update(instance.name, "done")
+            return image
+
+        def progress(transferred):
+            board.progress(instance.name, transferred, expected)
+
+        def pull(output):
+            board.update(instance.name, "pulling")
+            start = time.time()
+            with PullMonitor(output, progress) as monitor:
+                pulled = instance.build(
+                    self.working_dir, log_file=log_file, output=output
+                )
+            if pulled is not None:
+                self.history.record(instance.name, "pull", time.time() - start)
+
+                # Other pulls grew the cache too, so this isn't our size
+                if not monitor.overlapped:
+                    self.history.record(
+                        instance.name, "pull-bytes", monitor.transferred
+                    )
+            return pulled
+
+        expected = self.history.estimate(instance.name, ["pull-bytes"]) or None
+
+        stored = self.store.get(instance.image, pull)
+        if stored is None:
+            return
+        image = instance.get_image()
+        link_file(stored, image)
+
+        # The store names images by their sha256, so we know it already
+        digest = os.path.splitext(os.path.basename(stored))[0]
+        self.cache.hashes.set(image, digest)
+        self.digests[instance.name] = digest
+        return image
+
+    def get_build_key(self, instance):
+        """
+        Get the build cache key for the image of an instance, or None if the
+        image is pulled (or given) rather than built from a recipe.
+        """
+        if instance.recipe is None:
+            return
+        if instance.name not in self._build_keys:
+            self._build_keys[instance.name] = self.cache.get_key(
+                instance.context, instance.recipe, instance.get_build_options()
             )
+        return self._build_keys[instance.name]
+
+    def get_build_name(self, instance):
+        """
+        Get the name we keep the build of an instance under. A sandbox and
+        a SIF image of the same instance are built (and changed) apart.
+        """
+        if instance.sandbox:
+            return "%s.sandbox" % instance.name
+        return instance.name
 
-            created.add(instance.name)
+    def needs_build(self, instance, cache=True):
+        """
+        Determine if the image of an instance needs to be built (or pulled):
+        if it doesn't exist, or if it was built from a recipe, its context
+        or options that have since changed.
+
+        Images that were built before we kept track are kept as they are.
 
-            # Run post create commands
-            instance.run_post()
+        Parameters
+        ==========
+        instance: the instance to check the image of
+        cache: if False, images built from a recipe always need a build
+        """
+        if not os.path.exists(instance.get_image()):
+            return True
+        key = self.get_build_key(instance)
+        if key is None:
+            return False
+        if not cache:
+            return True
+        name = self.get_build_name(instance)
+        if name not in self.builds:
+            self.builds[name] = key
+        return self.builds[name] != key
+
+    def get_build_output(self, instance):
+        """
+        Get the path to build (or pull) an image to. Images from a recipe are
+        built next to the image they replace, so an instance running from it
+        keeps it until the new image is done. A sandbox is updated in place.
+        """
+        image = instance.get_image()
+        if instance.recipe is None or instance.sandbox:
+            return image
+        return "%s.%s.tmp" % (image, os.getpid())
+
+    def _restore_build(self, instance, log_file=None):
+        """
+        Put the image of an instance in place from the build cache, returning
+        its path, or None if the cache doesn't have the build.
+        """
+        key = self.get_build_key(instance)
+        if key is None or instance.sandbox:
+            return
+        if not self.cache.restore(key, instance.get_image()):
+            return
+        if log_file is None:
+            bot.info("Using cached image for %s" % instance.name)
+        self.builds[instance.name] = key
+        self.digests[instance.name] = self.cache.hashes.get(instance.get_image())
+        return instance.get_image()
+
+    def _finish_build(self, instance, output, success=True):
+        """
+        Add an image built from a recipe to the build cache, and move it
+        into place. Returns the image path, or None if the build failed
+        (and we clean up what it left behind).
+        """
+        image = instance.get_image()
+        if not success:
+            if output != image and os.path.exists(output):
+                os.remove(output)
+            return
+
+        key = self.get_build_key(instance)
+        if key is None:
+            return image
+
+        # A sandbox is updated in place, and isn't cached
+        if instance.sandbox:
+            self.builds[self.get_build_name(instance)] = key
+            return image
+        try:
+            self.cache.add(key, output)
+        except OSError as error:
+            bot.warning("Cannot add %s to the build cache: %s" % (image, error))
+        os.replace(output, image)
+        self.builds[instance.name] = key
+        self.digests[instance.name] = self.cache.hashes.get(image)
+        return image
+
+    def _create_parallel(self, graph, parallel, **options):
+        """
+        Create instances in parallel, each as soon as its dependencies are up.
 
-        if circular_dep:
-            bot.exit("Unable to create all instances, possible circular dependency.")
+        If an instance fails, instances that haven't started yet are skipped.
+        On Control+C, instances started so far are stopped again.
+
+        Parameters
+        ==========
+        graph: the dependency graph of the replicas to create
+        parallel: the number of instances to start at once
+        """
+        names = graph.order()
+
+        # Instances are loaded here, since loading isn't thread safe
+        instances = {x.get_replica_name(): x for x in self.iter_instances(names)}
+        for instance in instances.values():
+            instance.prefix_output = True
+
+        # Images that are missing are built first, also in parallel
+        if options["command"] == "up":
+            self._build_parallel(names, parallel)
+
+        def create(name):
+            # Instances others need to be healthy have a task to wait for it
+            if name.endswith(":healthy"):
+                instance = instances[name.rsplit(":", 1)[0]]
+                if not self.check_health(instance):
+                    raise RuntimeError("not healthy")
+                return
+            self._create_instance(instances[name], **options)
+
+        # The longest chains of starts (from history) go first
+        tasks, groups, required = graph.schedule()
+        priority = graph.get_priority(self.get_durations(graph))
+        scheduler = Scheduler(workers=parallel, priority=priority)
+        try:
+            scheduler.run(tasks, create, groups=groups, required=required)
+        except KeyboardInterrupt:
+            bot.warning("Stopping instances started so far.")
+            for name in reversed(scheduler.started):
+                if name in instances:
+                    instances[name].stop()
+            raise
+
+        if scheduler.report(action="create"):
+            bot.exit("Unable to create all instances.")
 
     # Build
 
-    def build(self, names=None):
+    def build(self, names=None, jobs=1, cache=True):
         """
         Given a loaded project, build associated containers (or pull).
+
+        Images built from a recipe are rebuilt when the recipe, the files it
+        uses from the context, or the build options change, and come from
+        the build cache when it has the same build.
+
+        Parameters
+        ==========
+        names: the names of instances to build (defaults to all)
+        jobs: the number of images to build or pull at once. If more than one,
+              the output of each goes to a log file under .scompose/logs.
+        cache: if False, build images from recipes without the cache
         """
         names = names or self.get_instance_names()
+        try:
+            if jobs > 1:
+                self._build_parallel(names, jobs, cache)
+
+            for instance in self.iter_instances(names):
+                if jobs <= 1:
+                    self.build_instance(instance, cache=cache)
+
+                # Run post create commands
+                instance.run_post()
+        finally:
+            self.save_state()
+
+    def promote(self, names=None):
+        """
+        Build a SIF image from the sandbox of each instance built with
+        --sandbox (or build.sandbox), where a build without it would put the
+        image. If the recipe didn't change since the sandbox was built, the
+        image counts as built from it, so up without --sandbox starts from
+        it instead of building again.
+
+        Parameters
+        ==========
+        names: the names of instances to promote (defaults to all)
+        """
+        done = set()
+        try:
+            for instance in self.iter_instances(names or self.get_instance_names()):
+                if not instance.sandbox or instance.name in done:
+                    continue
+                if not os.path.isdir(instance.get_image()):
+                    bot.warning("%s has no sandbox, skipping." % instance.name)
+                    continue
+                done.add(instance.name)
+                image = instance.get_image(sandbox=False)
+                output = "%s.%s.tmp" % (image, os.getpid())
+                start = time.time()
+                if not instance.promote(output):
+                    if os.path.exists(output):
+                        os.remove(output)
+                    bot.exit("Unable to promote %s." % instance.name)
+                self.history.record(instance.name, "promote", time.time() - start)
+                os.replace(output, image)
+
+                key = self.get_build_key(instance)
+                if self.builds.get(self.get_build_name(instance)) == key:
+                    self.builds[instance.name] = key
+                else:
+                    self.builds.pop(instance.name, None)
+                self.digests[instance.name] = self.cache.hashes.get(image)
+                bot.info("Promoted %s to %s" % (instance.name, image))
+        finally:
+            self.save_state()
+
+        if not done:
+            bot.warning("No sandboxes found, nothing to promote.")
+
+    def _build_parallel(self, names, jobs, cache=True):
+        """
+        Build or pull the images for instances at the same time.
+
+        Replicas share an image, so each image is only built once. We show a
+        status line for each image and a summary at the end, and exit if any
+        image could not be built.
+
+        Parameters
+        ==========
+        names: the names of instances to build
+        jobs: the number of images to build or pull at once
+        cache: if False, build images from recipes without the cache
+        """
+        builds = {}
         for instance in self.iter_instances(names):
-            instance.build(working_dir=self.working_dir)
+            if instance.name not in builds and self.needs_build(instance, cache):
+                builds[instance.name] = instance
 
-            # Run post create commands
-            instance.run_post()
+        if not builds:
+            return
+
+        def build(name):
+            instance = builds[name]
+            log_file = self.get_state_path("logs", "build-%s.log" % name)
+            write_file(log_file, "")
+            if cache and self._restore_build(instance, log_file):
+                return board.update(name, "cached")
+
+            board.update(name, "pulling" if instance.image else "building")
+            try:
+                image = self.build_instance(
+                    instance, log_file=log_file, cache=cache, board=board
+                )
+            except SystemExit:
+                image = None
+            if image is None:
+                board.update(name, "failed", log_file)
+                raise RuntimeError("see %s" % log_file)
+            board.update(name, "done")
+
+        scheduler = Scheduler(
+            workers=jobs, fail_fast=False, priority=self.get_build_priority(builds)
+        )
+        with StatusBoard(builds) as board:
+            scheduler.run({name: [] for name in builds}, build)
+        board.summary()
+
+        if scheduler.report(action="build"):
+            bot.exit("Unable to build all images.")
+
+    def get_build_priority(self, builds):
+        """
+        Longer builds (or pulls) go first, from history, so the longest isn't
+        started last.
+
+        Parameters
+        ==========
+        builds: a lookup of instance name to the instance to build
+        """
+        return {
+            name: self.history.estimate(name, ["pull" if x.image else "build"])
+            for name, x in builds.items()
+        }
+
+    # Async
+
+    def get_runtime(self, limit=None):
+        """
+        Get an AsyncRuntime to run singularity commands on an event loop.
+
+        Parameters
+        ==========
+        limit: the maximum number of commands to run at once
+        """
+        from .runtime import AsyncRuntime
+
+        return AsyncRuntime(self.client, limit=limit)
+
+    async def async_create(
+        self,
+        names=None,
+        writable_tmpfs=True,
+        bridge="10.22.0.0/16",
+        no_resolv=False,
+        parallel=None,
+        timeout=None,
+        runtime=None,
+        recreate=True,
+        verify=False,
+    ):
+        """
+        Create instances on an event loop (see create). Each instance starts
+        as soon as its dependencies are up.
+
+        Parameters
+        ==========
+        parallel: the number of instances to start at once (default all)
+        timeout: seconds to wait for each command (start, exec and run)
+        runtime: an AsyncRuntime, if not provided we create one
+        recreate: if True, recreate running instances whose spec changed
+        verify: if True, check images before starting instances (see verify)
+        """
+        return await self._async_create(
+            names,
+            command="create",
+            writable_tmpfs=writable_tmpfs,
+            bridge=bridge,
+            no_resolv=no_resolv,
+            parallel=parallel,
+            timeout=timeout,
+            runtime=runtime,
+            recreate=recreate,
+            verify=verify,
+        )
+
+    async def async_up(
+        self,
+        names=None,
+        writable_tmpfs=True,
+        bridge="10.22.0.0/16",
+        no_resolv=False,
+        parallel=None,
+        timeout=None,
+        runtime=None,
+        recreate=True,
+        verify=False,
+    ):
+        """
+        Build missing images and create instances on an event loop (see up).
+        Images are built at once first, and then each instance starts as soon
+        as its dependencies are up.
+
+        Parameters
+        ==========
+        parallel: the number of instances to start at once (default all)
+        timeout: seconds to wait for each command (start, exec and run)
+        runtime: an AsyncRuntime, if not provided we create one
+        recreate: if True, recreate running instances whose spec changed
+        verify: if True, check images before starting instances (see verify)
+        """
+        return await self._async_create(
+            names,
+            command="up",
+            writable_tmpfs=writable_tmpfs,
+            bridge=bridge,
+            no_resolv=no_resolv,
+            parallel=parallel,
+            timeout=timeout,
+            runtime=runtime,
+            recreate=recreate,
+            verify=verify,
+        )
+
+    async def _async_create(
+        self,
+        names,
+        command,
+        writable_tmpfs,
+        bridge,
+        no_resolv,
+        parallel,
+        timeout,
+        runtime,
+        recreate,
+        verify,
+    ):
+        import asyncio
+
+        runtime = runtime or self.get_runtime()
+        if recreate:
+            if command == "up":
+                running = names or self.get_instance_names()
+                running = [x for x in running if x in self.running]
+                if running:
+                    await self.async_build(running, runtime=runtime)
+            changes = self.get_changes(names, writable_tmpfs, no_resolv)
+            if changes:
+                names = self._get_recreate_names(names, changes)
+                await self.async_down(
+                    list(reversed(changes)), parallel=parallel, runtime=runtime
+                )
+
+        graph, options = self._prepare_create(names, bridge, no_resolv)
+        names = graph.order()
+        lookup = options["lookup"]
+
+        instances = {x.get_replica_name(): x for x in self.iter_instances(names)}
+        for instance in instances.values():
+            instance.prefix_output = True
+            instance.add_volumes(options["binds"])
+
+        if command == "up":
+            await self.async_build(names, runtime=runtime)
+
+        async def create(name):
+            if name.endswith(":healthy"):
+                instance = instances[name.rsplit(":", 1)[0]]
+                if not await self.async_check_health(instance, runtime):
+                    raise RuntimeError("not healthy")
+                return
+
+            instance = instances[name]
+            existed = instance.exists()
+            start = time.time()
+            await instance.async_create(
+                runtime,
+                ip_address=lookup[name],
+                writable_tmpfs=writable_tmpfs,
+                timeout=timeout,
+                verify=self.verify_image if verify else None,
+            )
+            if not existed:
+                self.history.record(instance.name, "start", time.time() - start)
+                self.specs.set(
+                    name, instance.get_spec(options["binds"], writable_tmpfs)
+                )
+                touch(instance.get_image())
+            await asyncio.get_running_loop().run_in_executor(None, instance.run_post)
+
+        tasks, groups, required = graph.schedule()
+        priority = graph.get_priority(self.get_durations(graph))
+        scheduler = Scheduler(workers=parallel or len(tasks), priority=priority)
+        try:
+            await scheduler.run_async(tasks, create, groups=groups, required=required)
+        except asyncio.CancelledError:
+            bot.warning("Stopping instances started so far.")
+            for name in reversed(scheduler.started):
+                if name in instances:
+                    await instances[name].async_stop(runtime)
+            raise
+        finally:
+            self.save_state()
+
+        if scheduler.report(action="create"):
+            bot.exit("Unable to create all instances.")
+
+    async def async_check_health(self, instance, runtime):
+        """
+        Wait for an instance to pass its health check on an event loop.
+        """
+        check = instance.get_healthcheck()
+        bot.info("Waiting for %s to be healthy" % instance.get_replica_name())
+        start = time.time()
+        if await check.async_wait(runtime, instance):
+            self.history.record(instance.name, "ready", time.time() - start)
+            return True
+        bot.warning(
+            "%s is not healthy after %s checks."
+            % (instance.get_replica_name(), check.retries)
+        )
+        return False
+
+    async def async_down(self, names=None, timeout=None, parallel=None, runtime=None):
+        """
+        Stop instances on an event loop (see down), each after the instances
+        that depend on it. The timeout is a deadline for all of them.
+
+        Parameters
+        ==========
+        names: the names of instances to bring down (defaults to all)
+        timeout: seconds until every instance is stopped (or killed)
+        parallel: the number of instances to stop at once (default all)
+        runtime: an AsyncRuntime, if not provided we create one
+        """
+        runtime = runtime or self.get_runtime()
+        names = names or list(reversed(self.get_instance_names()))
+        graph = self._get_stop_graph(names)
+
+        instances = {}
+        for instance in self.iter_instances(names):
+            if instance.instance is not None:
+                instances[instance.get_replica_name()] = instance
+
+        deadline = time.time() + timeout if timeout else None
+
+        async def stop(name):
+            if name not in instances:
+                return
+            if deadline is None:
+                return await instances[name].async_stop(runtime)
+            remaining = int(deadline - time.time())
+            if remaining < 1:
+                await instances[name].async_stop(runtime, force=True)
+            else:
+                await instances[name].async_stop(runtime, timeout=remaining)
+
+        tasks, groups, _ = graph.schedule()
+        scheduler = Scheduler(workers=parallel or len(names), fail_fast=False)
+        await scheduler.run_async(tasks, stop, groups=groups)
+        self.release_ips(names)
+        self._running = None
+        if scheduler.report(action="stop"):
+            bot.exit("Unable to stop all instances.")
+
+    async def async_build(self, names=None, jobs=None, runtime=None):
+        """
+        Build or pull missing images on an event loop (see build). Each image
+        is built once, with output to a log file under .scompose/logs.
+
+        Parameters
+        ==========
+        names: the names of instances to build (defaults to all)
+        jobs: the number of images to build or pull at once (default all)
+        runtime: an AsyncRuntime, if not provided we create one
+        """
+        import asyncio
+
+        runtime = runtime or self.get_runtime()
+        names = names or self.get_instance_names()
+        builds = {}
+        for instance in self.iter_instances(names):
+            if instance.name not in builds and self.needs_build(instance):
+                builds[instance.name] = instance
+
+        if not builds:
+            return
+
+        async def build(name):
+            instance = builds[name]
+            log_file = self.get_state_path("logs", "build-%s.log" % name)
+            write_file(log_file, "")
+            if self._restore_build(instance, log_file):
+                return board.update(name, "cached")
+
+            # Pulls wait for each other in the image store, so they use threads
+            if instance.recipe is None:
+                board.update(name, "pulling")
+                loop = asyncio.get_running_loop()
+                try:
+                    image = await loop.run_in_executor(
+                        None, self.pull_image, instance, log_file, board
+                    )
+                except SystemExit:
+                    image = None
+                if image is None:
+                    board.update(name, "failed", log_file)
+                    raise RuntimeError("see %s" % log_file)
+                return board.update(name, "done")
+
+            board.update(name, "building")
+            start = time.time()
+            output = self.get_build_output(instance)
+            try:
+                image = await instance.async_build(
+                    runtime, log_file=log_file, output=output
+                )
+            except SystemExit:
+                image = None
+            if image is None:
+                self._finish_build(instance, output, success=False)
+                board.update(name, "failed", log_file)
+                raise RuntimeError("see %s" % log_file)
+            self.history.record(name, "build", time.time() - start)
+            self._finish_build(instance, output)
+            board.update(name, "done")
+
+        scheduler = Scheduler(
+            workers=jobs or len(builds),
+            fail_fast=False,
+            priority=self.get_build_priority(builds),
+        )
+        with StatusBoard(builds) as board:
+            try:
+                await scheduler.run_async({name: [] for name in builds}, build)
+            finally:
+                self.save_state()
+        board.summary()
+
+        if scheduler.report(action="build"):
+            bot.exit("Unable to build all images.")
+
+    async def async_logs(self, names=None, tail=0, runtime=None):
+        """
+        Show logs for instances (see logs), reading them all at once.
+
+        Parameters
+        ==========
+        names: the names of instances to show logs for (defaults to all)
+        tail: only show the last tail lines of each log
+        runtime: an AsyncRuntime, if not provided we create one
+        """
+        import asyncio
+
+        runtime = runtime or self.get_runtime()
+        names = names or self.get_instance_names()
+        instances = list(self.iter_instances(names))
+
+        # Read logs at once, but print them in order so they don't interleave
+        results = await asyncio.gather(*[x.async_read_logs(runtime) for x in instances])
+        for instance, logs in zip(instances, results):
+            for ext, content in logs:
+                instance._print_log(ext, content, tail)
+
+    def get_state_path(self, *parts):
+        """
+        Get a path under the project state folder (.scompose in the working
+        directory), creating folders as needed.
+
+        Parameters
+        ==========
+        parts: the path under the state folder, e.g., ("logs", "build-app.log")
+        """
+        path = os.path.join(self.working_dir, ".scompose", *parts)
+        mkdir_p(os.path.dirname(path))
+        return path
@@ -0,0 +1,189 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import glob
+import json
+import os
+import re
+
+from scompose.logger import bot
+
+from .state import is_running
+
+
+def get_tmp_pid(path):
+    """
+    Get the process id in the name of a temporary file we write, e.g.,
+    app.sif.<pid>.tmp or tmp/<hash>.<pid>.sif in the image store, or None.
+    """
+    match = re.search(r"\.(\d+)(\.\d+)?\.(tmp|sif)$", os.path.basename(path))
+    if match:
+        return int(match.group(1))
+
+
+def find_files(pattern):
+    return [x for x in glob.glob(pattern) if os.path.isfile(x)]
+
+
+class PruneEntry:
+    """
+    A file that prune can remove, with its hard links: a stored image and
+    the instance images linked to it are one entry, since the space is only
+    reclaimed when all of them are removed.
+
+    Parameters
+    ==========
+    kind: what the file is (e.g., cache, store, image, log)
+    path: the path to the file
+    """
+
+    def __init__(self, kind, path):
+        stat = os.stat(path)
+        self.kinds = [kind]
+        self.paths = [path]
+        self.inode = (stat.st_dev, stat.st_ino)
+        self.size = stat.st_size
+        self.links = stat.st_nlink
+        self.used = stat.st_atime
+        self.protected = None
+
+    def __str__(self):
+        return "(prune-entry:%s)" % self.paths[0]
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def kind(self):
+        return "+".join(sorted(set(self.kinds)))
+
+    @property
+    def reclaimable(self):
+        """
+        Bytes freed by removing the entry: none if another project still
+        links to the file.
+        """
+        return self.size if self.links <= len(self.paths) else 0
+
+    def add(self, kind, path):
+        if path not in self.paths:
+            self.kinds.append(kind)
+            self.paths.append(path)
+
+    def remove(self):
+        """
+        Remove all paths of the entry, returning True if all are gone.
+        """
+        removed = True
+        for path in self.paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as error:
+                bot.warning("Cannot remove %s: %s" % (path, error))
+                removed = False
+        return removed
+
+
+class PruneSet:
+    """
+    The files that prune can remove, grouped by inode, and the images of
+    running instances it must leave alone.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.protected = set()
+
+    def __str__(self):
+        return "(prune-set:%s entries)" % len(self.entries)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    def add(self, kind, path, protected=None):
+        """
+        Add a file, optionally with the reason it can't be removed (e.g.,
+        a running instance uses it).
+        """
+        try:
+            entry = PruneEntry(kind, path)
+        except OSError:
+            return
+        if entry.inode in self.entries:
+            entry = self.entries[entry.inode]
+            entry.add(kind, path)
+        self.entries[entry.inode] = entry
+        if protected and not entry.protected:
+            entry.protected = protected
+        return entry
+
+    def add_tmp(self, kind, pattern):
+        """
+        Add temporary files left by builds and pulls, unless the process
+        that writes them is still running.
+        """
+        for path in find_files(pattern):
+            pid = get_tmp_pid(path)
+            in_use = pid is not None and is_running(pid)
+            self.add(kind, path, "in progress" if in_use else None)
+
+    def protect(self, path, reason):
+        """
+        Protect the file at a path (and its links) from being removed.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        inode = (stat.st_dev, stat.st_ino)
+        self.protected.add(inode)
+        if inode in self.entries and not self.entries[inode].protected:
+            self.entries[inode].protected = reason
+
+    def get_size(self):
+        return sum(x.size for x in self)
+
+    def select(self, max_size=0):
+        """
+        Select entries to remove, least recently used first, until the
+        entries left are at most max_size bytes. Protected entries and
+        entries linked from elsewhere are never selected.
+        """
+        size = self.get_size()
+        selected = []
+        for entry in sorted(self, key=lambda x: x.used):
+            if size <= max_size:
+                break
+            if entry.protected or entry.inode in self.protected:
+                continue
+            if not entry.reclaimable:
+                continue
+            selected.append(entry)
+            size -= entry.size
+        return selected
+
+
+def remove_refs(store_root, digests):
+    """
+    Remove image store references to blobs that were removed.
+    """
+    for path in find_files(os.path.join(store_root, "refs", "*.json")):
+        try:
+            with open(path, "r") as filey:
+                digest = json.load(filey).get("digest")
+        except (OSError, ValueError):
+            continue
+        if digest in digests:
+            os.remove(path)
@@ -0,0 +1,295 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import asyncio
+import json
+import subprocess
+
+from scompose.logger import bot
+from scompose.utils import get_client
+
+# Seconds to wait for a process to exit after terminating it, before a kill
+TERMINATE_SECONDS = 5
+
+# The longest line of output we read at once (bytes)
+LINE_LIMIT = 1024 * 1024
+
+
+class CommandError(RuntimeError):
+    """
+    A command that exited with a non-zero return code.
+    """
+
+    def __init__(self, command, result):
+        self.command = command
+        self.result = result
+        message = result["error"].strip() or result["message"].strip()
+        super().__init__(
+            "%s returned %s%s"
+            % (command[0], result["return_code"], ": %s" % message if message else "")
+        )
+
+
+class AsyncRuntime:
+    """
+    Run singularity commands as asyncio subprocesses, so many instances can
+    be started, stopped or built at once from one event loop, without a
+    thread for each.
+
+    Output is read line by line as it is produced, and can be streamed to a
+    callback or a log file. Every command can be given a timeout, and a
+    command that times out (or whose task is cancelled) is terminated, and
+    killed if it doesn't exit.
+
+    Parameters
+    ==========
+    client: the spython client, used to assemble commands
+    limit: the maximum number of commands to run at once (default no limit)
+    """
+
+    def __init__(self, client=None, limit=None):
+        self.client = client or get_client()
+        self.limit = limit
+        self._slots = None
+
+    def __str__(self):
+        return "(runtime:%s)" % ("%s at once" % self.limit if self.limit else "async")
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def slots(self):
+        """
+        A semaphore to limit commands, created on first use so it belongs
+        to the running event loop.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.limit or 2**31)
+        return self._slots
+
+    # Commands
+
+    async def run_command(
+        self,
+        command,
+        sudo=False,
+        cwd=None,
+        timeout=None,
+        on_output=None,
+        log_file=None,
+        check=False,
+    ):
+        """
+        Run a command, and return a dictionary with the return_code, and
+        the output (message) and error output (error) as strings.
+
+        Parameters
+        ==========
+        command: the command to run, a list
+        sudo: if True, run the command with sudo
+        cwd: the folder to run the command from
+        timeout: seconds to wait for the command before terminating it
+        on_output: a function to call with each line of output (and error)
+        log_file: a file to append the output (and error) to
+        check: if True, raise a CommandError for a non-zero return code
+        """
+        if sudo:
+            command = ["sudo"] + command
+        command = [str(x) for x in command if x]
+        bot.debug(" ".join(command))
+
+        async with self.slots:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *command,
+                    cwd=cwd,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    limit=LINE_LIMIT,
+                )
+            except OSError as error:
+                result = {"return_code": 127, "message": "", "error": str(error)}
+                if check:
+                    raise CommandError(command, result)
+                return result
+
+            log = None
+            if log_file is not None:
+                log = open(log_file, "a")
+                log.write("%s\n" % " ".join(command))
+                log.flush()
+
+            try:
+                output, error = await asyncio.wait_for(
+                    self._communicate(process, on_output, log), timeout
+                )
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                await self.terminate(process)
+                raise
+            finally:
+                if log is not None:
+                    log.close()
+
+        result = {
+            "return_code": process.returncode,
+            "message": "".join(output),
+            "error": "".join(error),
+        }
+        if check and result["return_code"] != 0:
+            raise CommandError(command, result)
+        return result
+
+    async def _communicate(self, process, on_output=None, log=None):
+        """
+        Read output and error at the same time, until the process exits.
+        """
+        output = []
+        error = []
+        await asyncio.gather(
+            self._read(process.stdout, output, on_output, log),
+            self._read(process.stderr, error, on_output, log),
+        )
+        await process.wait()
+        return output, error
+
+    async def _read(self, stream, lines, on_output=None, log=None):
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                # A line over the limit, take what we have
+                line = await stream.read(LINE_LIMIT)
+            if not line:
+                break
+            line = line.decode("utf-8", errors="replace")
+            lines.append(line)
+            if log is not None:
+                log.write(line)
+                log.flush()
+            if on_output is not None:
+                on_output(line.rstrip("\n"))
+
+    async def terminate(self, process):
+        """
+        Terminate a process, and kill it if it doesn't exit in time.
+        """
+        if process.returncode is not None:
+            return
+        try:
+            process.terminate()
+            await asyncio.wait_for(process.wait(), TERMINATE_SECONDS)
+        except (ProcessLookupError, PermissionError):
+            return
+        except asyncio.TimeoutError:
+            bot.warning("Killing %s, it did not exit." % process.pid)
+            try:
+                process.kill()
+            except (ProcessLookupError, PermissionError):
+                return
+            await process.wait()
+
+    # Instances
+
+    async def list(self, sudo=False):
+        """
+        List running instances, as dictionaries (instance, pid, img, ip...)
+        """
+        command = self.client._init_command(["instance", "list"]) + ["--json"]
+        result = await self.run_command(command, sudo=sudo)
+        if result["return_code"] != 0:
+            return []
+        try:
+            return json.loads(result["message"]).get("instances", [])
+        except ValueError:
+            return []
+
+    async def start(self, name, image, options=None, args=None, sudo=False, **kwargs):
+        """
+        Start an instance (singularity instance start).
+
+        Parameters
+        ==========
+        name: the name of the instance
+        image: the image to start it from
+        options: options for instance start (see Instance.get_start_options)
+        args: arguments for the startscript, as one string
+        """
+        command = self.client._init_command(["instance", "start"])
+        command += (options or []) + [image, name]
+        if args:
+            command.append(args)
+        return await self.run_command(command, sudo=sudo, check=True, **kwargs)
+
+    async def stop(self, name, sudo=False, timeout=None, force=False, **kwargs):
+        """
+        Stop an instance (singularity instance stop).
+
+        Parameters
+        ==========
+        name: the name of the instance
+        timeout: kill the instance if it hasn't stopped after this many seconds
+        force: kill the instance right away
+        """
+        subgroup = ["instance", "stop"]
+        if force:
+            subgroup.append("--force")
+        elif timeout:
+            subgroup += ["-t", str(timeout)]
+        command = self.client._init_command(subgroup) + [name]
+        return await self.run_command(command, sudo=sudo, **kwargs)
+
+    async def execute(self, uri, command, options=None, sudo=False, **kwargs):
+        """
+        Execute a command in an instance (singularity exec).
+
+        Parameters
+        ==========
+        uri: the instance uri, e.g., instance://app1
+        command: the command, a list or string
+        options: options for exec
+        """
+        if not isinstance(command, list):
+            command = command.split(" ")
+        cmd = self.client._init_command("exec") + (options or []) + [uri] + command
+        return await self.run_command(cmd, sudo=sudo, **kwargs)
+
+    async def run(
+        self, uri, args=None, options=None, sudo=False, background=False, **kwargs
+    ):
+        """
+        Run the runscript of an instance (singularity run).
+
+        Parameters
+        ==========
+        uri: the instance uri, e.g., instance://app1
+        args: arguments for the runscript, a list or string
+        options: options for run
+        background: if True, don't wait for the runscript (returns None)
+        """
+        if args and not isinstance(args, list):
+            args = args.split(" ")
+        command = self.client._init_command("run") + (options or []) + [uri]
+        command += args or []
+
+        if background:
+            if sudo:
+                command = ["sudo"] + command
+            bot.debug(" ".join(command))
+            subprocess.Popen(command)
+            return
+        return await self.run_command(command, sudo=sudo, **kwargs)
+
+    async def build(self, command, cwd=None, sudo=False, **kwargs):
+        """
+        Build or pull an image, given the command from Instance.get_build_command.
+        """
+        return await self.run_command(command, cwd=cwd, sudo=sudo, **kwargs)
@@ -0,0 +1,301 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import heapq
+
+from scompose.logger import bot
+
+
+class Scheduler:
+    """
+    Run named tasks with a bounded pool of workers, starting each task as soon
+    as the tasks it depends on have finished.
+
+    Tasks are run in threads (run) or on an asyncio event loop (run_async).
+    If a task fails, nothing new is started (fail fast): tasks that are
+    running are allowed to finish, and everything else is skipped. Without
+    fail fast, only the tasks that depend on a failed task are skipped. On
+    Control+C we also stop starting tasks, wait for running ones, and then
+    raise KeyboardInterrupt so the caller can clean up.
+
+    When more tasks are ready than there are workers, tasks with a higher
+    priority go first (e.g., the start of the longest chain of work), and
+    otherwise tasks go in the order they were given.
+
+    Parameters
+    ==========
+    workers: the maximum number of tasks to run at once.
+    fail_fast: stop starting tasks as soon as one fails.
+    priority: an optional lookup of task name to a priority (default 0).
+    """
+
+    def __init__(self, workers=1, fail_fast=True, priority=None):
+        self.workers = max(int(workers or 1), 1)
+        self.fail_fast = fail_fast
+        self.priority = priority or {}
+        self.reset()
+
+    def __str__(self):
+        return "(scheduler:%s workers)" % self.workers
+
+    def __repr__(self):
+        return self.__str__()
+
+    def reset(self):
+        """
+        Clear the results of a previous run.
+        """
+        self.done = set()
+        self.failed = {}
+        self.skipped = []
+        self.started = []
+
+    @property
+    def success(self):
+        return not self.failed and not self.skipped
+
+    def run(self, tasks, func, groups=None, required=None):
+        """
+        Run func(name) for each task, respecting dependencies.
+
+        Dependencies that are not themselves tasks are assumed to be met.
+        Tasks that can never start (a dependency cycle) are failed.
+
+        Parameters
+        ==========
+        tasks: an ordered lookup of task name to the names it depends on.
+        func: the function to call with each task name.
+        groups: an optional lookup of group name to task names. If given,
+                tasks depend on groups instead of tasks, and a group is met
+                when all of its tasks are done. A dependency on an instance
+                with many replicas is then one dependency, not one per replica.
+        required: an optional lookup of group name to the number of its tasks
+                  that need to be done for the group to be met (default all).
+        """
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+        self.prepare(tasks, groups, required)
+        running = {}
+
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            while self.ready or running:
+                # Launch as many ready tasks as we have workers for
+                while self.ready and not self.stopping and len(running) < self.workers:
+                    name = self.pop_ready()
+                    running[executor.submit(func, name)] = name
+
+                if not running:
+                    break
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    self.finish(running.pop(future), future.exception())
+
+        except KeyboardInterrupt:
+            self.stopping = True
+            bot.warning("Interrupted, waiting for running tasks to finish.")
+            wait(list(running))
+            for future, name in running.items():
+                self.finish(name, future.exception())
+            raise
+
+        finally:
+            executor.shutdown(wait=True)
+            self.close(tasks)
+
+        return self.success
+
+    async def run_async(self, tasks, func, groups=None, required=None):
+        """
+        Run await func(name) for each task on the event loop, respecting
+        dependencies. This is the same as run, but func is a coroutine
+        function and nothing runs in threads.
+
+        If we are cancelled, running tasks are cancelled too (and awaited)
+        before the cancellation is raised.
+
+        Parameters
+        ==========
+        tasks: an ordered lookup of task name to the names it depends on.
+        func: the coroutine function to call with each task name.
+        groups: an optional lookup of group name to task names (see run)
+        required: an optional lookup of group name to a number of tasks (see run)
+        """
+        import asyncio
+
+        self.prepare(tasks, groups, required)
+        running = {}
+
+        try:
+            while self.ready or running:
+                while self.ready and not self.stopping and len(running) < self.workers:
+                    name = self.pop_ready()
+                    running[asyncio.ensure_future(func(name))] = name
+
+                if not running:
+                    break
+
+                finished, _ = await asyncio.wait(
+                    list(running), return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in finished:
+                    self.finish(running.pop(future), self._get_error(future))
+
+        except asyncio.CancelledError:
+            self.stopping = True
+            for future in running:
+                future.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            for future, name in running.items():
+                self.finish(name, self._get_error(future))
+            raise
+
+        finally:
+            self.close(tasks)
+
+        return self.success
+
+    def _get_error(self, future):
+        if future.cancelled():
+            import asyncio
+
+            return asyncio.CancelledError()
+        return future.exception()
+
+    # Bookkeeping shared by run and run_async
+
+    def prepare(self, tasks, groups=None, required=None):
+        """
+        Derive what each task is waiting for, and which tasks are ready.
+        """
+        self.reset()
+        required = required or {}
+        if groups is None:
+            groups = {name: [name] for name in tasks}
+
+        # Only tasks we run count towards a group, and empty groups are met
+        self.members = {}
+        self.member_of = {name: [] for name in tasks}
+        for group, names in groups.items():
+            self.members[group] = [x for x in names if x in tasks]
+            for name in self.members[group]:
+                self.member_of[name].append(group)
+
+        # How many more tasks a group needs, and how many it can still lose
+        self.remaining = {}
+        self.spare = {}
+        for group, names in self.members.items():
+            self.remaining[group] = min(required.get(group) or len(names), len(names))
+            self.spare[group] = len(names) - self.remaining[group]
+
+        self.waiting = {
+            name: set(
+                x for x in deps if self.members.get(x) and self.members[x] != [name]
+            )
+            for name, deps in tasks.items()
+        }
+        self.dependents = {group: [] for group in self.members}
+        for name, deps in self.waiting.items():
+            for dep in deps:
+                self.dependents[dep].append(name)
+
+        # Ready tasks are started by priority (highest first), then in order.
+        # They are a heap of (rank, name), and a set to look them up.
+        self.ranks = {
+            name: (-self.priority.get(name, 0), idx) for idx, name in enumerate(tasks)
+        }
+        self.ready = []
+        self.queued = set()
+        for name, deps in self.waiting.items():
+            if not deps:
+                self.push_ready(name)
+        self.stopping = False
+        self.blocked = set()
+
+    def push_ready(self, name):
+        """
+        Add a task that isn't waiting for anything to the ready tasks.
+        """
+        if name not in self.queued:
+            self.queued.add(name)
+            heapq.heappush(self.ready, (self.ranks[name], name))
+
+    def pop_ready(self):
+        """
+        Take the next ready task, and mark it as started.
+        """
+        _, name = heapq.heappop(self.ready)
+        self.queued.discard(name)
+        del self.waiting[name]
+        self.started.append(name)
+        return name
+
+    def finish(self, name, error=None):
+        """
+        Record a task as done (or failed), and release tasks waiting for it.
+        """
+        if error is not None:
+            self.failed[name] = error
+            self.stopping = self.stopping or self.fail_fast
+            self.block(name)
+            return
+
+        self.done.add(name)
+        for group in self.member_of[name]:
+            self.remaining[group] -= 1
+            if self.remaining[group] != 0:
+                continue
+            for dependent in self.dependents[group]:
+                self.waiting[dependent].discard(group)
+                if not self.waiting[dependent]:
+                    self.push_ready(dependent)
+
+    def close(self, tasks):
+        """
+        Anything left waiting was skipped, or blocked by a cycle.
+        """
+        for name in tasks:
+            if name in self.done or name in self.failed:
+                continue
+            if self.stopping or name in self.blocked:
+                self.skipped.append(name)
+            else:
+                self.failed[name] = RuntimeError("blocked by a circular dependency")
+
+    def block(self, name):
+        """
+        A task failed (or can't run): block tasks that depend on a group that
+        can no longer be met, and so on for what depends on those.
+        """
+        queue = [name]
+        while queue:
+            task = queue.pop()
+            for group in self.member_of[task]:
+                self.spare[group] -= 1
+                if self.spare[group] != -1 or self.remaining[group] <= 0:
+                    continue
+                for dependent in self.dependents[group]:
+                    if dependent not in self.blocked:
+                        self.blocked.add(dependent)
+                        queue.append(dependent)
+
+    def report(self, action="run"):
+        """
+        Report failed and skipped tasks, returning True if there were any.
+        """
+        for name, error in self.failed.items():
+            if isinstance(error, SystemExit):
+                bot.error("Failed to %s %s." % (action, name))
+            else:
+                bot.error("Failed to %s %s: %s" % (action, name, error))
+        if self.skipped:
+            bot.warning("Skipped %s: %s" % (action, ", ".join(self.skipped)))
+        return not self.success
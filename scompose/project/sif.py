@@ -0,0 +1,300 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import uuid
+
+# The global header: launch script, magic, version, architecture, image id,
+# created and modified times, descriptors (free, total, offset and size),
+# and data (offset and size). Little endian, with no padding.
+HEADER = struct.Struct("<32s10s3s3s16s8q")
+
+# A descriptor: data type, used, id, group id, linked id, offset, size, size
+# with padding, created and modified times, uid, gid, name and extra
+DESCRIPTOR = struct.Struct("<i?III7q128s384s")
+
+# The extra of a partition descriptor: filesystem, partition type and arch
+PARTITION = struct.Struct("<ii3s")
+
+SIF_MAGIC = b"SIF_MAGIC\0"
+
+# Group ids have this bit set, and the group is the rest
+GROUP_MASK = 0xF0000000
+
+DATA_TYPES = {
+    0x4001: "deffile",
+    0x4002: "envvar",
+    0x4003: "labels",
+    0x4004: "partition",
+    0x4005: "signature",
+    0x4006: "json",
+    0x4007: "generic",
+    0x4008: "crypto",
+    0x4009: "sbom",
+    0x400A: "oci-index",
+    0x400B: "oci-blob",
+}
+
+FS_TYPES = {1: "squashfs", 2: "ext3", 3: "immutable", 4: "raw", 5: "encrypted"}
+
+PART_TYPES = {1: "system", 2: "primary", 3: "data", 4: "overlay"}
+
+ARCHES = {
+    "00": "unknown",
+    "01": "386",
+    "02": "amd64",
+    "03": "arm",
+    "04": "arm64",
+    "05": "ppc64",
+    "06": "ppc64le",
+    "07": "mips",
+    "08": "mipsle",
+    "09": "mips64",
+    "10": "mips64le",
+    "11": "s390x",
+    "12": "riscv64",
+}
+
+# Bytes to hash at once from a partition
+CHUNK_SIZE = 1024 * 1024
+
+
+class SIFError(ValueError):
+    pass
+
+
+def get_arch(raw):
+    return ARCHES.get(raw.rstrip(b"\0").decode("ascii", "replace"), "unknown")
+
+
+def get_image_id(path):
+    """
+    Get the identity of an image, which changes when the image does: the
+    SIF id and modified time (from the header, so copying or linking the
+    image keeps it), or the size and modification time of other files.
+    A sandbox changes when a build (or update) writes its definition file.
+    """
+    if os.path.isdir(path):
+        deffile = os.path.join(path, ".singularity.d", "Singularity")
+        return get_stat_id(deffile) or get_stat_id(path)
+    try:
+        with SIFImage(path) as image:
+            return image.identity
+    except (OSError, SIFError):
+        return get_stat_id(path)
+
+
+def get_stat_id(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return
+    return "%s:%s" % (stat.st_size, stat.st_mtime_ns)
+
+
+class Descriptor:
+    """
+    An object in a SIF image: a partition (the filesystem), the definition
+    file, labels, a signature, and so on.
+    """
+
+    def __init__(self, raw):
+        (
+            data_type,
+            _,
+            self.id,
+            group,
+            self.linked,
+            self.offset,
+            self.size,
+            _,
+            self.created,
+            self.modified,
+            _,
+            _,
+            name,
+            self.extra,
+        ) = raw
+        self.data_type = data_type
+        self.type = DATA_TYPES.get(data_type, hex(data_type))
+        self.group = group & ~GROUP_MASK if group & GROUP_MASK else None
+        self.name = name.rstrip(b"\0").decode("utf-8", "replace")
+        self.fs_type = self.part_type = self.arch = None
+        if self.type == "partition":
+            fs_type, part_type, arch = PARTITION.unpack_from(self.extra)
+            self.fs_type = FS_TYPES.get(fs_type, str(fs_type))
+            self.part_type = PART_TYPES.get(part_type, str(part_type))
+            self.arch = get_arch(arch)
+
+    def __str__(self):
+        return "(sif-descriptor:%s:%s)" % (self.id, self.type)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class SIFImage:
+    """
+    Read a Singularity Image Format (SIF) file without running singularity:
+    the global header and the descriptor table, and the (small) data of
+    descriptors like labels and the definition file. The file is memory
+    mapped, so only what we read is loaded, whatever the size of the image.
+
+    Parameters
+    ==========
+    path: the path to the image
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def __init__(self, path):
+        self.path = path
+        self.map = None
+        with open(path, "rb") as filey:
+            if os.fstat(filey.fileno()).st_size < HEADER.size:
+                raise SIFError("%s is not a SIF image" % path)
+            self.map = mmap.mmap(filey.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.read_header()
+            self.read_descriptors()
+        except (SIFError, struct.error) as error:
+            self.close()
+            raise SIFError("%s is not a valid SIF image: %s" % (path, error))
+
+    def __str__(self):
+        return "(sif:%s)" % self.path
+
+    def __repr__(self):
+        return self.__str__()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def read_header(self):
+        (
+            _,
+            magic,
+            version,
+            arch,
+            image_id,
+            self.created,
+            self.modified,
+            _,
+            total,
+            offset,
+            _,
+            self.data_offset,
+            self.data_size,
+        ) = HEADER.unpack_from(self.map)
+        if magic != SIF_MAGIC:
+            raise SIFError("bad magic")
+        if offset + total * DESCRIPTOR.size > len(self.map):
+            raise SIFError("descriptors past the end of the file")
+        self.version = version.rstrip(b"\0").decode("ascii", "replace")
+        self.arch = get_arch(arch)
+        self.id = str(uuid.UUID(bytes=image_id))
+        self.descriptors_total = total
+        self.descriptors_offset = offset
+
+    def read_descriptors(self):
+        self.descriptors = []
+        for idx in range(self.descriptors_total):
+            offset = self.descriptors_offset + idx * DESCRIPTOR.size
+            raw = DESCRIPTOR.unpack_from(self.map, offset)
+            if raw[1]:
+                self.descriptors.append(Descriptor(raw))
+
+    @property
+    def identity(self):
+        """
+        The id of the image and when it was last modified (e.g., signed).
+        """
+        return "sif:%s:%s" % (self.id, self.modified)
+
+    def get_descriptors(self, data_type):
+        return [x for x in self.descriptors if x.type == data_type]
+
+    def get_partitions(self):
+        return self.get_descriptors("partition")
+
+    def get_primary(self):
+        """
+        Get the partition with the root filesystem of the image, if any.
+        """
+        for partition in self.get_partitions():
+            if partition.part_type == "primary":
+                return partition
+
+    def read(self, descriptor):
+        """
+        Read the data of a descriptor (meant for small ones, not partitions).
+        """
+        return self.map[descriptor.offset : descriptor.offset + descriptor.size]
+
+    def get_digest(self, descriptor):
+        """
+        Get the sha256 of the data of a descriptor (e.g., a partition),
+        read a chunk at a time.
+        """
+        digest = hashlib.sha256()
+        end = descriptor.offset + descriptor.size
+        for start in range(descriptor.offset, end, CHUNK_SIZE):
+            digest.update(self.map[start : min(start + CHUNK_SIZE, end)])
+        return digest.hexdigest()
+
+    def get_deffile(self):
+        """
+        Get the definition file the image was built from, if it has one.
+        """
+        for descriptor in self.get_descriptors("deffile"):
+            return self.read(descriptor).decode("utf-8", "replace")
+
+    def get_metadata(self):
+        """
+        Get the json metadata of the image (e.g., what singularity inspect
+        shows), merged from its json descriptors.
+        """
+        metadata = {}
+        for descriptor in self.get_descriptors("json"):
+            try:
+                content = json.loads(self.read(descriptor).decode("utf-8"))
+            except ValueError:
+                continue
+            if isinstance(content, dict):
+                metadata.update(content)
+        return metadata
+
+    def get_labels(self):
+        """
+        Get the labels of the image, from a labels descriptor or the labels
+        in its metadata.
+        """
+        for descriptor in self.get_descriptors("labels"):
+            try:
+                return json.loads(self.read(descriptor).decode("utf-8"))
+            except ValueError:
+                pass
+        attributes = self.get_metadata().get("attributes") or {}
+        return attributes.get("labels") or {}
+
+    def get_runscript(self):
+        attributes = self.get_metadata().get("attributes") or {}
+        return attributes.get("runscript")
@@ -0,0 +1,87 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import hashlib
+import json
+
+from .jsonfile import JsonFile
+
+
+def get_spec_hash(spec):
+    """
+    Get a hash of a launch spec (see Instance.get_spec), the same for the
+    same spec no matter the order of its keys.
+    """
+    content = json.dumps(spec, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_changed_fields(old, new):
+    """
+    Get the fields (e.g., volumes, start) that differ between two specs.
+    """
+    return sorted(x for x in set(old) | set(new) if old.get(x) != new.get(x))
+
+
+class Specs(JsonFile):
+    """
+    The launch spec that each running instance was started with, kept in a
+    json file (.scompose/specs.json) so a later up can tell which instances
+    were started from a config that has since changed.
+
+    The file is a lookup of replica name to the hash of the spec, and the
+    spec itself, so we can say what changed.
+
+    Parameters
+    ==========
+    filename: the json file to load from and save to
+    """
+
+    def __str__(self):
+        return "(specs:%s instances)" % len(self.data)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def get(self, name):
+        """
+        Get the spec an instance was started with, or None if not recorded.
+        """
+        record = self.data.get(name)
+        if isinstance(record, dict) and "spec" in record:
+            return record["spec"]
+
+    def set(self, name, spec):
+        """
+        Record the spec an instance was started with.
+
+        Parameters
+        ==========
+        name: the replica name
+        spec: the launch spec (see Instance.get_spec)
+        """
+        with self.lock:
+            self.data[name] = {"hash": get_spec_hash(spec), "spec": spec}
+            self.changed = True
+
+    def remove(self, name):
+        """
+        Forget the spec of an instance.
+        """
+        with self.lock:
+            if self.data.pop(name, None) is not None:
+                self.changed = True
+
+    def is_current(self, name, spec):
+        """
+        Determine if an instance was started with this spec.
+        """
+        record = self.data.get(name) or {}
+        return record.get("hash") == get_spec_hash(spec)
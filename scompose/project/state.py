@@ -0,0 +1,252 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import json
+import os
+import platform
+import pwd
+
+from scompose.logger import bot
+from scompose.utils import get_client
+
+# Where Singularity (sing) and Apptainer (app) keep instance files under $HOME
+INSTANCE_FOLDERS = [
+    os.path.join(".singularity", "instances", "sing"),
+    os.path.join(".apptainer", "instances", "app"),
+]
+
+# Boot time of the host, read once from /proc/stat to derive process uptimes
+_boot_time = None
+
+
+def get_instance_owner(sudo=False):
+    """
+    Return the (home, user) that owns instances for a privilege level.
+    """
+    entry = pwd.getpwuid(0 if sudo else os.getuid())
+    return entry.pw_dir, entry.pw_name
+
+
+def get_instance_folders(home, user, hostname=None):
+    """
+    Return the folders that hold one subfolder per running instance.
+
+    Parameters
+    ==========
+    home: the home directory of the instance owner
+    user: the username of the instance owner
+    hostname: the hostname instances were started on (defaults to this one)
+    """
+    hostname = hostname or platform.node()
+    return [os.path.join(home, folder, hostname, user) for folder in INSTANCE_FOLDERS]
+
+
+def get_process_start(pid):
+    """
+    Return the time (seconds since the epoch) that a process started, or None
+    if it can't be derived from /proc.
+    """
+    global _boot_time
+    try:
+        if _boot_time is None:
+            with open("/proc/stat", "r") as filey:
+                for line in filey:
+                    if line.startswith("btime"):
+                        _boot_time = int(line.split()[1])
+                        break
+
+        # The command name can have spaces, so fields are counted after it
+        with open("/proc/%s/stat" % pid, "r") as filey:
+            fields = filey.read().rsplit(")", 1)[1].split()
+        return _boot_time + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, TypeError):
+        return
+
+
+def is_running(pid):
+    """
+    Determine if a process is alive without signalling it.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_instance_files(home, user, hostname=None):
+    """
+    Read instance state files that Singularity writes for each instance.
+
+    Every instance has a folder <home>/.singularity/instances/sing/<host>/<user>/<name>
+    with a <name>.json inside. We return records shaped like the output of
+    "singularity instance list --json", skipping instances whose process is
+    gone. If a folder exists but cannot be read, we return None so that the
+    caller can fall back to asking singularity.
+
+    Parameters
+    ==========
+    home: the home directory of the instance owner
+    user: the username of the instance owner
+    hostname: the hostname instances were started on (defaults to this one)
+    """
+    records = []
+
+    for user_dir in get_instance_folders(home, user, hostname):
+        try:
+            entries = list(os.scandir(user_dir))
+        except FileNotFoundError:
+            continue
+        except OSError:
+            return
+
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            filename = os.path.join(entry.path, "%s.json" % entry.name)
+            try:
+                with open(filename, "r") as filey:
+                    data = json.load(filey)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError):
+                return
+
+            pid = data.get("pid")
+            if not pid or not is_running(pid):
+                continue
+
+            records.append(
+                {
+                    "instance": data.get("name") or entry.name,
+                    "pid": pid,
+                    "img": data.get("image"),
+                    "ip": data.get("ip") or "",
+                    "logErrPath": data.get("logErrPath"),
+                    "logOutPath": data.get("logOutPath"),
+                }
+            )
+    return records
+
+
+class InstanceState:
+    """
+    A snapshot of running instances, shared by a project and its instances.
+
+    We read the state files that Singularity keeps for each instance, and only
+    call "singularity instance list" if they can't be read (e.g., listing
+    instances owned by root as a regular user). Either way, listing happens
+    at most once per privilege level (user or sudo) and the result is reused.
+    Anything that changes the state of an instance (create, stop) must call
+    invalidate so the next lookup sees the change.
+
+    Parameters
+    ==========
+    client: the spython client to list instances with.
+    native: read instance state files directly when possible. Exporting
+            SCOMPOSE_STATE=client always uses the client instead.
+    """
+
+    def __init__(self, client=None, native=True):
+        self._client = client
+        self.native = native and os.environ.get("SCOMPOSE_STATE") != "client"
+        self._records = {}
+
+    def __str__(self):
+        return "(state:%s)" % ",".join(
+            "sudo" if sudo else "user" for sudo in self._records
+        )
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def client(self):
+        """
+        The spython client, created on first use (see utils.get_client).
+        """
+        if self._client is None:
+            self._client = get_client()
+        return self._client
+
+    def list(self, sudo=False):
+        """
+        Return the list of instance records (json) for a privilege level.
+
+        Parameters
+        ==========
+        sudo: list instances owned by root instead of the calling user
+        """
+        if sudo not in self._records:
+            records = None
+            if self.native:
+                records = read_instance_files(*get_instance_owner(sudo))
+            if records is None:
+                bot.debug("Listing instances with singularity (sudo=%s)" % sudo)
+                records = (
+                    self.client.instances(quiet=True, return_json=True, sudo=sudo) or []
+                )
+            self._records[sudo] = records
+        return self._records[sudo]
+
+    def get(self, name, sudo=False):
+        """
+        Get the record for a named instance, or None if it isn't running.
+
+        Parameters
+        ==========
+        name: the replica name of the instance
+        sudo: look up the instance at the sudo privilege level
+        """
+        for record in self.list(sudo=sudo):
+            if record.get("instance") == name:
+                return record
+
+    def exists(self, name, sudo=False):
+        """
+        Return boolean if a named instance is running.
+        """
+        return self.get(name, sudo=sudo) is not None
+
+    def get_instance(self, name, sudo=False):
+        """
+        Return an spython instance object for a running instance, or None.
+
+        This mirrors how spython itself derives objects from the listing,
+        without starting anything.
+        """
+        record = self.get(name, sudo=sudo)
+        if record is None:
+            return
+
+        return self.client.instance(
+            pid=record.get("pid"),
+            ip_address=record.get("ip"),
+            name=record.get("instance") or record.get("daemon_name"),
+            log_err_path=record.get("logErrPath"),
+            log_out_path=record.get("logOutPath"),
+            image=record.get("img") or record.get("container_image"),
+            start=False,
+        )
+
+    def invalidate(self, sudo=None):
+        """
+        Forget a snapshot so that it is listed again on next use.
+
+        Parameters
+        ==========
+        sudo: the privilege level to invalidate. If None, invalidate all.
+        """
+        if sudo is None:
+            self._records = {}
+        else:
+            self._records.pop(sudo, None)
@@ -0,0 +1,196 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from scompose.logger import bot
+from scompose.utils import write_json
+
+from .cache import get_cache_dir, hash_file, link_file, touch
+
+
+def get_store_dir():
+    """
+    Get the image store folder: SCOMPOSE_STORE if set (e.g., a folder shared
+    by everyone on a node), otherwise store under the cache folder.
+    """
+    return os.environ.get("SCOMPOSE_STORE") or os.path.join(get_cache_dir(), "store")
+
+
+def get_uri_hash(uri):
+    return hashlib.sha256(uri.strip().encode("utf-8")).hexdigest()
+
+
+class ImageStore:
+    """
+    Pulled images, shared by all instances and projects that use them.
+
+    Each image is stored once by the sha256 of its content (blobs), and a
+    reference (refs) maps an image uri to the digest it was pulled as. An
+    instance gets a link to the stored image (see link_file), so ten
+    instances of one docker:// image pull and convert it once.
+
+    Pulls of the same uri, from threads or other processes, wait for each
+    other, so only one of them pulls. A mirror is a folder laid out like a
+    store (e.g., a copy of one), and images in it are used before pulling,
+    for nodes without network access.
+
+    Parameters
+    ==========
+    root: the store folder (defaults to get_store_dir())
+    mirror: a store folder to use images from (defaults to SCOMPOSE_MIRROR)
+    """
+
+    def __init__(self, root=None, mirror=None):
+        self.root = root or get_store_dir()
+        self.mirror = mirror or os.environ.get("SCOMPOSE_MIRROR")
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return "(image-store:%s)" % self.root
+
+    def __repr__(self):
+        return self.__str__()
+
+    def get_ref_path(self, uri, root=None):
+        return os.path.join(root or self.root, "refs", "%s.json" % get_uri_hash(uri))
+
+    def get_blob_path(self, digest, root=None):
+        return os.path.join(root or self.root, "blobs", "sha256", "%s.sif" % digest)
+
+    def get_ref(self, uri, root=None):
+        """
+        Get the reference for a uri ({uri, digest, size, pulled}) if the
+        image is stored, or None.
+        """
+        path = self.get_ref_path(uri, root)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "r") as filey:
+                ref = json.load(filey)
+        except (OSError, ValueError):
+            return
+        if os.path.exists(self.get_blob_path(ref.get("digest"), root)):
+            return ref
+
+    def lookup(self, uri):
+        """
+        Get the stored image for a uri, or None.
+        """
+        ref = self.get_ref(uri)
+        if ref is not None:
+            return self.get_blob_path(ref["digest"])
+
+    def get(self, uri, pull):
+        """
+        Get the stored image for a uri, from the store, the mirror, or by
+        pulling it. Returns the path of the image, or None if it could not
+        be pulled.
+
+        Parameters
+        ==========
+        uri: the image uri, e.g., docker://busybox
+        pull: a function to pull the image to a path, returning the path
+              (or None if the pull failed)
+        """
+        found = self.lookup(uri)
+        if found is not None:
+            touch(found)
+            return found
+
+        with self.lock_uri(uri):
+            found = self.lookup(uri) or self.get_mirrored(uri)
+            if found is not None:
+                return found
+
+            tmpdir = os.path.join(self.root, "tmp")
+            os.makedirs(tmpdir, exist_ok=True)
+            tmpfile = os.path.join(
+                tmpdir, "%s.%s.sif" % (get_uri_hash(uri)[:16], os.getpid())
+            )
+            try:
+                if not pull(tmpfile) or not os.path.exists(tmpfile):
+                    return
+                return self.add(uri, tmpfile)
+            finally:
+                if os.path.exists(tmpfile):
+                    os.remove(tmpfile)
+
+    def get_mirrored(self, uri):
+        """
+        Add the image for a uri from the mirror, if it has it.
+        """
+        if not self.mirror:
+            return
+        ref = self.get_ref(uri, self.mirror)
+        if ref is None:
+            return
+        bot.info("Using %s from %s" % (uri, self.mirror))
+        blob = self.get_blob_path(ref["digest"])
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        link_file(self.get_blob_path(ref["digest"], self.mirror), blob)
+        self.write_ref(uri, ref["digest"])
+        return blob
+
+    def add(self, uri, image):
+        """
+        Add an image file for a uri to the store, moving it in. If an image
+        with the same content is stored already (e.g., pulled by tag and by
+        digest), it's stored once.
+        """
+        digest = hash_file(image)
+        blob = self.get_blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        if os.path.exists(blob):
+            os.remove(image)
+        else:
+            os.replace(image, blob)
+        self.write_ref(uri, digest)
+        return blob
+
+    def write_ref(self, uri, digest):
+        """
+        Write the reference from a uri to the digest of its image.
+        """
+        path = self.get_ref_path(uri)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        ref = {
+            "uri": uri,
+            "digest": digest,
+            "size": os.path.getsize(self.get_blob_path(digest)),
+            "pulled": time.time(),
+        }
+        write_json(ref, path)
+
+    @contextmanager
+    def lock_uri(self, uri):
+        """
+        Hold a lock for a uri, against threads (a lock for each uri) and
+        other processes (flock on a file in the store).
+        """
+        with self.lock:
+            lock = self.locks.setdefault(uri, threading.Lock())
+
+        lockfile = os.path.join(self.root, "locks", "%s.lock" % get_uri_hash(uri))
+        os.makedirs(os.path.dirname(lockfile), exist_ok=True)
+        with lock, open(lockfile, "a") as filey:
+            fcntl.flock(filey.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(filey.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,147 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import glob
+import os
+import threading
+
+# How often to check how far a pull is (seconds)
+SAMPLE_INTERVAL = 1
+
+# Folders of the Singularity (or Apptainer) cache that pulls download to
+CACHE_FOLDERS = ["blob", "library", "net", "oci-tmp", "oras", "shub"]
+
+
+def get_singularity_cache_dirs():
+    """
+    Get the cache folders that Singularity and Apptainer pull to, from
+    SINGULARITY_CACHEDIR and APPTAINER_CACHEDIR or their defaults.
+    """
+    home = os.path.expanduser("~")
+    return [
+        os.environ.get("SINGULARITY_CACHEDIR")
+        or os.path.join(home, ".singularity", "cache"),
+        os.environ.get("APPTAINER_CACHEDIR")
+        or os.path.join(home, ".apptainer", "cache"),
+    ]
+
+
+class PullMonitor:
+    """
+    Follow a pull from a thread, calling back with the bytes transferred so
+    far: how much the Singularity cache grew since the pull started (the
+    layers it downloads), or the size of the image written by the conversion
+    to SIF, whichever is more. The layers and the image hold the same
+    content, so they aren't added up.
+
+    Singularity doesn't tell us how much it has done, so we look at the
+    files it writes, once every SAMPLE_INTERVAL. The cache is the one the
+    user set (we never move it), so pulls running at once grow it for each
+    other: a monitor that ran alongside another is marked overlapped, and
+    its bytes shouldn't be taken as the size of the pull.
+
+    Parameters
+    ==========
+    output: the path of the image the pull writes
+    callback: a function called with the bytes transferred so far
+    cache_dirs: the Singularity cache folders (see get_singularity_cache_dirs)
+    """
+
+    # Monitors following a pull right now
+    active = set()
+    active_lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        return False
+
+    def __init__(self, output, callback, cache_dirs=None):
+        self.output = output
+        self.callback = callback
+        self.cache_dirs = cache_dirs or get_singularity_cache_dirs()
+        self.baseline = 0
+        self.overlapped = False
+        self.transferred = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __str__(self):
+        return "(pull-monitor:%s)" % self.output
+
+    def __repr__(self):
+        return self.__str__()
+
+    def start(self):
+        self.baseline = self.get_cache_size()
+        with self.active_lock:
+            if self.active:
+                self.overlapped = True
+                for monitor in self.active:
+                    monitor.overlapped = True
+            self.active.add(self)
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.sample()
+        with self.active_lock:
+            self.active.discard(self)
+
+    def _sample(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self.sample()
+
+    def sample(self):
+        """
+        Count the bytes transferred so far, and call back with them.
+        """
+        transferred = max(self.get_output_size(), self.get_cache_size() - self.baseline)
+
+        # Files can be moved away between samples, so we never go back
+        self.transferred = max(self.transferred, transferred)
+        self.callback(self.transferred)
+        return self.transferred
+
+    def get_output_size(self):
+        """
+        Get the size of the image written so far, and of temporary files
+        next to it that a conversion writes first.
+        """
+        size = 0
+        for path in [self.output] + glob.glob("%s.*" % glob.escape(self.output)):
+            try:
+                size += os.stat(path).st_size
+            except OSError:
+                pass
+        return size
+
+    def get_cache_size(self):
+        """
+        Get the size of the files in the folders of the cache that pulls
+        download to.
+        """
+        size = 0
+        for cache_dir in self.cache_dirs:
+            for folder in CACHE_FOLDERS:
+                for root, _, filenames in os.walk(os.path.join(cache_dir, folder)):
+                    for filename in filenames:
+                        try:
+                            size += os.lstat(os.path.join(root, filename)).st_size
+                        except OSError:
+                            continue
+        return size
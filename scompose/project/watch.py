@@ -0,0 +1,185 @@
+"""
+
+Copyright (C) 2019-2024 Vanessa Sochat.
+
+This Source Code Form is subject to the terms of the
+Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from scompose.logger import bot
+
+# inotify event masks (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_ONLYDIR = 0x01000000
+
+# What we watch on folders of instances, and on folders that don't exist yet
+INSTANCES_MASK = (
+    IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_ONLYDIR
+)
+INSTANCE_MASK = IN_CLOSE_WRITE | IN_MODIFY | IN_MOVED_TO | IN_DELETE | IN_ONLYDIR
+ANCESTOR_MASK = IN_CREATE | IN_MOVED_TO | IN_ONLYDIR
+
+# Event header: int wd, uint32 mask, uint32 cookie, uint32 len
+EVENT_HEADER = struct.Struct("iIII")
+
+# Seconds to wait for more events after the first, so a burst is one change
+SETTLE_SECONDS = 0.1
+
+# Seconds between redraws when nothing changes (uptime, crashed instances)
+REFRESH_SECONDS = 30
+
+# Seconds between listings when we can't be notified of changes
+POLL_SECONDS = 2
+
+
+class Inotify:
+    """
+    A minimal inotify binding over libc, so we don't need a dependency.
+    """
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add(self, path, mask):
+        """
+        Watch a path, returning the watch descriptor (or -1 if it failed).
+        """
+        return self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+
+    def read(self, timeout=None):
+        """
+        Wait up to timeout seconds for events, and return a list of masks.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        masks = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            _, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            masks.append(mask)
+            offset += EVENT_HEADER.size + length
+        return masks
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_inotify():
+    """
+    Return an Inotify, or None if the platform doesn't support it.
+    """
+    try:
+        return Inotify()
+    except (OSError, AttributeError):
+        return
+
+
+class InstanceWatcher:
+    """
+    Wait for instances to appear, disappear or change.
+
+    Singularity keeps one folder per running instance, so we watch the
+    folders of instances with inotify and sleep until the kernel tells us
+    something changed. Folders that don't exist yet are watched from their
+    nearest existing parent. If inotify isn't available, or the folders
+    can't be read (e.g., instances owned by root) we fall back to polling.
+
+    Parameters
+    ==========
+    folders: the instance folders to watch (see state.get_instance_folders)
+    native: False if instance state is not read from these folders
+    """
+
+    def __init__(self, folders, native=True):
+        self.folders = folders
+        self.inotify = None
+        if native and all(self._readable(folder) for folder in folders):
+            self.inotify = get_inotify()
+
+        if self.inotify is None:
+            bot.debug("Watching instances by polling every %ss" % POLL_SECONDS)
+        else:
+            self.arm()
+
+    @property
+    def polling(self):
+        return self.inotify is None
+
+    def _readable(self, folder):
+        """
+        Determine if a folder, or its nearest existing parent, can be listed.
+        """
+        while not os.path.exists(folder):
+            folder = os.path.dirname(folder)
+        return os.access(folder, os.R_OK | os.X_OK)
+
+    def arm(self):
+        """
+        Add watches for every folder of instances, and each instance in it.
+
+        Adding a watch for a path that is already watched just updates it,
+        so we call this again after every change to pick up new folders.
+        """
+        for folder in self.folders:
+            if not os.path.exists(folder):
+                parent = os.path.dirname(folder)
+                while not os.path.exists(parent):
+                    parent = os.path.dirname(parent)
+                self.inotify.add(parent, ANCESTOR_MASK)
+                continue
+
+            self.inotify.add(folder, INSTANCES_MASK)
+            try:
+                for entry in os.scandir(folder):
+                    if entry.is_dir():
+                        self.inotify.add(entry.path, INSTANCE_MASK)
+            except FileNotFoundError:
+                continue
+
+    def wait(self, timeout=REFRESH_SECONDS):
+        """
+        Block until instances change (True) or the timeout passes (False).
+        """
+        if self.polling:
+            time.sleep(POLL_SECONDS)
+            return True
+
+        if not self.inotify.read(timeout):
+            return False
+
+        # Drain the rest of a burst (an instance writes its file more than once)
+        while self.inotify.read(SETTLE_SECONDS):
+            pass
+        self.arm()
+        return True
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
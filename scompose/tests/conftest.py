@@ -0,0 +1,25 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dirs(tmp_path, monkeypatch):
+    """
+    Keep the build cache, image store and address leases of each test in its
+    tmp_path, instead of the cache of the user running the tests.
+    """
+    for name, folder in [
+        ("SCOMPOSE_CACHE", "cache"),
+        ("SCOMPOSE_STORE", "store"),
+        ("SCOMPOSE_LEASES", "leases"),
+    ]:
+        monkeypatch.setenv(name, os.path.join(tmp_path, ".scompose-%s" % folder))
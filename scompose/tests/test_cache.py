@@ -0,0 +1,114 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+
+import scompose.project.cache as cache
+from scompose.project.cache import BuildCache, get_identity, read_recipe
+
+recipe = """Bootstrap: docker
+From: busybox
+
+%files
+    files /opt/files
+    "run me.sh" /run.sh
+
+%files from build
+    /opt/app /opt/app
+
+%post
+    echo hello
+"""
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fd:
+        fd.write(content)
+
+
+def test_read_recipe(tmp_path):
+    print("Testing project.cache.read_recipe")
+    path = os.path.join(tmp_path, "Singularity")
+    write(path, recipe)
+    parsed = read_recipe(path)
+    assert parsed["header"] == {"bootstrap": "docker", "from": "busybox"}
+    assert parsed["sources"] == ["files", "run me.sh"]
+    assert not parsed["setup"]
+
+
+def test_build_key(tmp_path, monkeypatch):
+    print("Testing project.cache.BuildCache keys")
+    context = os.path.join(tmp_path, "app")
+    write(os.path.join(context, "Singularity"), recipe)
+    write(os.path.join(context, "files", "a.txt"), "one")
+    write(os.path.join(context, "run me.sh"), "echo run")
+    write(os.path.join(context, "notes.txt"), "not copied")
+
+    hashed = []
+    hash_file = cache.hash_file
+    monkeypatch.setattr(cache, "hash_file", lambda x: hashed.append(x) or hash_file(x))
+
+    build_cache = BuildCache(os.path.join(tmp_path, "cache"))
+    key = build_cache.get_key(context, "Singularity", ["--fakeroot"])
+    assert len(hashed) == 3
+
+    # Unchanged files aren't read again, and unrelated files don't matter
+    write(os.path.join(context, "notes.txt"), "changed")
+    assert build_cache.get_key(context, "Singularity", ["--fakeroot"]) == key
+    assert len(hashed) == 3
+
+    # Options and files that are copied in do
+    assert build_cache.get_key(context, "Singularity") != key
+    write(os.path.join(context, "files", "a.txt"), "two")
+    assert build_cache.get_key(context, "Singularity", ["--fakeroot"]) != key
+
+    # With %setup, the whole context (but images) is part of the key
+    write(os.path.join(context, "Singularity"), recipe + "\n%setup\n    touch x\n")
+    key = build_cache.get_key(context, "Singularity")
+    write(os.path.join(context, "app.sif"), "image")
+    assert build_cache.get_key(context, "Singularity") == key
+    write(os.path.join(context, "notes.txt"), "changed again")
+    assert build_cache.get_key(context, "Singularity") != key
+
+    # The index of hashes can be loaded again
+    build_cache.save()
+    assert BuildCache(build_cache.root).hashes.data == build_cache.hashes.data
+
+    # Files that are gone are dropped from the index when it's saved
+    os.remove(os.path.join(context, "notes.txt"))
+    build_cache.hashes.changed = True
+    build_cache.save()
+    paths = BuildCache(build_cache.root).hashes.data
+    assert os.path.join(context, "notes.txt") not in paths
+    assert os.path.join(context, "Singularity") in paths
+
+    # A file with the same inode on another device isn't taken for another
+    hashes = build_cache.hashes
+    path = os.path.join(context, "Singularity")
+    digest = hashes.get(path)
+    identity = get_identity(path)
+    other = identity[:3] + [identity[3] + 1]
+    hashes.data[path] = other + ["0" * 64]
+    hashes.inodes = {tuple(other): "0" * 64}
+    assert hashes.get(path) == digest
+
+
+def test_build_cache(tmp_path):
+    print("Testing project.cache.BuildCache add and restore")
+    build_cache = BuildCache(os.path.join(tmp_path, "cache"))
+    image = os.path.join(tmp_path, "app.sif")
+    assert build_cache.get_image("abc") is None
+    assert not build_cache.restore("abc", image)
+
+    write(image, "built")
+    build_cache.add("abc", image)
+    os.remove(image)
+    assert build_cache.restore("abc", image)
+    with open(image) as fd:
+        assert fd.read() == "built"
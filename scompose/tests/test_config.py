@@ -116,3 +116,86 @@ def test_merge_config():
             "start": {"args": "how are you?"},
         },
     }
+
+
+def test_compiled_config(tmp_path, monkeypatch):
+    print("Testing config.load_compiled")
+    import shutil
+
+    import scompose.config as config
+
+    config_override = os.path.join(here, "configs", "config_merge")
+    file_list = []
+    for name in ["singularity-compose-1.yml", "singularity-compose-2.yml"]:
+        file_list.append(shutil.copy(os.path.join(config_override, name), tmp_path))
+    cache_file = os.path.join(tmp_path, ".scompose", "config.json")
+
+    parsed = []
+    read_yaml_nodes = config.read_yaml_nodes
+    monkeypatch.setattr(
+        config, "read_yaml_nodes", lambda x: parsed.append(x) or read_yaml_nodes(x)
+    )
+    merged = config.merge_config(file_list, cache_file=cache_file)
+    assert merged == config.merge_config(file_list, cache_file=cache_file)
+    assert len(parsed) == 2
+
+    # A file that was only touched is the same
+    os.utime(file_list[1], ns=(0, 0))
+    assert config.merge_config(file_list, cache_file=cache_file) == merged
+    assert len(parsed) == 2
+
+    # A changed file, or other files, are parsed again
+    with open(file_list[1], "a") as fd:
+        fd.write("\n# a comment\n")
+    config.merge_config(file_list, cache_file=cache_file)
+    assert len(parsed) == 4
+    assert config.merge_config(file_list[:1], cache_file=cache_file) != merged
+    assert len(parsed) == 5
+
+    # Anything but json is compiled again, and a config json can't keep isn't saved
+    with open(cache_file, "wb") as fd:
+        fd.write(b"\x80\x04K\x01.")
+    assert config.load_compiled(cache_file, file_list[:1]) is None
+    os.remove(cache_file)
+    config.save_compiled(cache_file, file_list[:1], {1: "one"})
+    assert not os.path.exists(cache_file)
+
+
+def test_compile_config(tmp_path):
+    print("Testing config.compile_config")
+    from scompose.config import compile_config
+
+    base = os.path.join(tmp_path, "singularity-compose.yml")
+    override = os.path.join(tmp_path, "override.yml")
+    with open(base, "w") as fd:
+        fd.write(
+            "instances:\n"
+            "  app:\n"
+            "    image: app.sif\n"
+            "    ports: 80\n"
+            "    deploy:\n"
+            "      replicas: 0\n"
+        )
+    with open(override, "w") as fd:
+        fd.write("instances:\n  app:\n    network:\n      enable: nope\n")
+
+    # Each error is found at once, where it is
+    config, errors = compile_config([base, override])
+    assert config["instances"]["app"]["network"] == {"enable": "nope"}
+    assert [str(x) for x in errors] == [
+        "%s:4: instances.app.ports: 80 is not of type 'array'" % base,
+        "%s:6: instances.app.deploy.replicas: 0 is less than the minimum of 1" % base,
+        "%s:4: instances.app.network.enable: 'nope' is not of type 'boolean'"
+        % override,
+        "%s:1: 'version' is a required property" % override,
+    ]
+
+    # An override only has to be right in what it has
+    with open(base, "w") as fd:
+        fd.write('version: "2.0"\ninstances:\n  app:\n    image: app.sif\n')
+    with open(override, "w") as fd:
+        fd.write("instances:\n  app:\n    exec:\n      options: [env]\n")
+    config, errors = compile_config([base, override])
+    assert [str(x) for x in errors] == [
+        "%s:3: instances.app.exec: 'command' is a required property" % override
+    ]
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+
+from scompose.project.graph import DependencyGraph
+
+
+def get_graph(edges, replicas=1):
+    graph = DependencyGraph()
+    for name, deps in edges.items():
+        members = ["%s%s" % (name, idx) for idx in range(1, replicas + 1)]
+        graph.add(name, members, deps)
+    return graph
+
+
+def test_graph_order():
+    print("Testing project.graph.DependencyGraph ordering")
+
+    # Transitive dependencies come first, whatever order they are listed in
+    graph = get_graph(
+        {"nginx": ["app"], "app": ["db", "cache"], "cache": [], "db": []}, replicas=2
+    )
+    assert graph.sort() == ["cache", "db", "app", "nginx"]
+    assert graph.order() == [
+        "cache1",
+        "cache2",
+        "db1",
+        "db2",
+        "app1",
+        "app2",
+        "nginx1",
+        "nginx2",
+    ]
+    assert graph.find_cycles() == []
+
+    # Reversed, for stopping
+    assert graph.reverse().sort() == ["nginx", "app", "cache", "db"]
+
+    # Replicas depend on the instance, not each replica of it
+    tasks, groups, required = graph.schedule()
+    assert tasks["app1"] == ["db:started", "cache:started"]
+    assert groups["db:started"] == ["db1", "db2"]
+    assert required == {}
+
+    # Dependencies outside of the graph are ignored
+    graph = get_graph({"app": ["db"]})
+    assert graph.order() == ["app1"]
+
+
+def test_graph_conditions():
+    print("Testing project.graph.DependencyGraph depends_on conditions")
+    graph = get_graph({"db": [], "app": []}, replicas=3)
+    graph.add("app", depends_on={"db": {"condition": "service_healthy", "replicas": 2}})
+
+    # Each db replica gets a task to wait for health, and app needs 2 of 3
+    tasks, groups, required = graph.schedule()
+    assert tasks["app1"] == ["db:healthy:2"]
+    assert tasks["db1:healthy"] == ["db1:start"]
+    assert groups["db:healthy:2"] == ["db1:healthy", "db2:healthy", "db3:healthy"]
+    assert required == {"db:healthy:2": 2}
+    assert list(tasks)[:2] == ["db1", "db1:healthy"]
+
+
+def test_graph_critical_paths():
+    print("Testing project.graph.DependencyGraph critical paths")
+
+    # A slow chain (db, app, nginx) and a quick instance on its own
+    graph = get_graph({"db": [], "cache": [], "app": ["db"], "nginx": ["app"]})
+    durations = {"db": 10, "cache": 1, "app": 5, "nginx": 2}
+    assert graph.get_critical_paths(durations) == {
+        "nginx": 2,
+        "app": 7,
+        "cache": 1,
+        "db": 17,
+    }
+    assert graph.get_priority(durations)["db1"] == 17
+
+
+def test_graph_cycles():
+    print("Testing project.graph.DependencyGraph cycles")
+    graph = get_graph(
+        {
+            "first": ["second"],
+            "second": ["second"],
+            "third": ["fourth"],
+            "fourth": ["fifth"],
+            "fifth": ["third", "fourth"],
+            "sixth": [],
+        }
+    )
+    assert graph.find_cycles() == [
+        ["second", "second"],
+        ["third", "fourth", "fifth", "third"],
+    ]
+
+    # Everything is still ordered, with what is blocked by a cycle at the end
+    assert graph.sort() == ["sixth", "first", "second", "third", "fourth", "fifth"]
+
+
+def test_graph_large():
+    print("Testing project.graph.DependencyGraph with many replicas")
+
+    # A long chain of instances, listed backwards, each with many replicas
+    edges = {"tier%s" % idx: ["tier%s" % (idx - 1)] for idx in range(1000, 0, -1)}
+    edges["tier0"] = []
+    start = time.time()
+    graph = get_graph(edges, replicas=20)
+    order = graph.order()
+    assert graph.find_cycles() == []
+    assert time.time() - start < 5
+    assert len(order) == 20020
+    assert order[0] == "tier01" and order[-1] == "tier100020"
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+import http.server
+import os
+import socket
+import threading
+
+from scompose.project.health import HealthCheck, get_depends_on
+
+
+def test_depends_on():
+    print("Testing project.health.get_depends_on")
+    assert get_depends_on({"depends_on": ["db"]}) == {
+        "db": {"condition": "service_started", "replicas": None}
+    }
+    params = {"depends_on": {"db": {"condition": "service_healthy", "replicas": 2}}}
+    assert get_depends_on(params)["db"]["replicas"] == 2
+
+
+def test_healthcheck_probes(tmp_path):
+    print("Testing project.health.HealthCheck probes")
+
+    # file
+    check = HealthCheck(
+        {"file": "ready", "retries": 2, "interval": 0}, working_dir=tmp_path
+    )
+    assert not check.wait()
+    open(os.path.join(tmp_path, "ready"), "w").close()
+    assert check.probe()
+
+    # tcp, to a listening socket and then a closed one
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    port = server.getsockname()[1]
+    check = HealthCheck({"tcp": port, "timeout": 1})
+    assert check.probe()
+    assert asyncio.run(check.async_probe(None))
+    server.close()
+    assert not check.probe()
+
+    # http
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200 if self.path == "/health" else 503)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    httpd = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        port = httpd.server_address[1]
+        assert HealthCheck({"http": "/health", "port": port}).probe()
+        check = HealthCheck({"http": "http://127.0.0.1:%s/other" % port})
+        assert not check.probe()
+        assert not asyncio.run(check.async_probe(None))
+    finally:
+        httpd.shutdown()
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+
+from scompose.project.history import MAX_SAMPLES, History, get_percentile
+from scompose.project.jsonfile import JsonLookup
+
+
+def test_percentile():
+    print("Testing project.history.get_percentile")
+    assert get_percentile([], 50) is None
+    assert get_percentile([3, 1, 2], 50) == 2
+    assert get_percentile([1, 2, 3, 4], 50) == 2.5
+    assert get_percentile(list(range(1, 101)), 95) == 95.05
+
+
+def test_history(tmp_path):
+    print("Testing project.history.History")
+    filename = os.path.join(tmp_path, "history.json")
+    history = History(filename)
+    for seconds in range(1, MAX_SAMPLES + 11):
+        history.record("app", "start", seconds)
+    history.record("db", "pull", 120)
+    history.save()
+
+    # Only the newest samples are kept, and they survive a reload
+    history = History(filename)
+    assert len(history.get("app", "start")) == MAX_SAMPLES
+    assert history.get("app", "start")[-1] == MAX_SAMPLES + 10
+    assert history.estimate("app", ["start", "ready"]) == 35.5
+    assert history.estimate("nginx", ["start"], default=3) == 3
+
+    rows = history.summary()
+    assert [x[:3] for x in rows] == [["app", "start", MAX_SAMPLES], ["db", "pull", 1]]
+    assert history.summary(["db"])[0][3:] == [120, 120, 120]
+
+    # A broken file is started over
+    with open(filename, "w") as fd:
+        fd.write("{")
+    assert History(filename).data == {}
+
+
+def test_json_lookup(tmp_path):
+    print("Testing project.jsonfile.JsonLookup")
+    filename = os.path.join(tmp_path, ".scompose", "builds.json")
+    builds = JsonLookup(filename)
+    builds["app"] = "key"
+    assert "app" in builds and builds.get("db") is None
+    builds.save()
+    assert JsonLookup(filename)["app"] == "key"
+
+    # Nothing changed is nothing written, and a corrupt file starts over
+    builds["app"] = "key"
+    assert not builds.changed
+    with open(filename, "w") as fd:
+        fd.write("{")
+    assert JsonLookup(filename).data == {}
+    assert builds.pop("app") == "key" and builds.changed
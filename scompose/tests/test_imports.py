@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Modules that are slow to import, and only imported by the commands using them
+HEAVY_MODULES = [
+    "asyncio",
+    "concurrent.futures",
+    "jsonschema",
+    "spython",
+    "urllib.request",
+    "yaml",
+]
+
+# The folder with the scompose package we are testing
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run_python(code):
+    """
+    Run code in a new interpreter (so nothing is imported yet) from the
+    repository, writing bytecode so the import times don't include compiling.
+    """
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [root] + [x for x in [env.get("PYTHONPATH")] if x]
+    )
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=root,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def get_import_time(module):
+    """
+    Get the time (microseconds) importing a module takes, with its parent
+    packages and everything they import, from the output of -X importtime.
+    Nested imports are indented under the module importing them.
+    """
+    elapsed = 0
+    for line in run_python("import %s" % module).stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].startswith(" scompose"):
+            elapsed += int(fields[1])
+    return elapsed
+
+
+@pytest.mark.parametrize(
+    "modules",
+    [
+        ["scompose.client", "scompose.logger"],
+        ["scompose.client.ps"],
+        ["scompose.client.exec"],
+    ],
+)
+def test_lazy_imports(modules):
+    print("Testing lazy imports of %s" % ", ".join(modules))
+    code = "import sys\n%s\nprint(json.dumps(sorted(sys.modules)))" % "\n".join(
+        "import %s" % x for x in ["json"] + modules
+    )
+    imported = json.loads(run_python(code).stdout)
+    assert not [x for x in HEAVY_MODULES if x in imported]
+
+
+def test_import_time():
+    print("Testing import time of scompose.client.ps")
+
+    # The best of a few runs, the first may write bytecode. The time depends
+    # on the machine (and how busy it is), so it's reported, not checked.
+    elapsed = min(get_import_time("scompose.client.ps") for _ in range(3))
+    print("Importing scompose.client.ps took %sus" % elapsed)
+    assert elapsed > 0
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import multiprocessing
+import os
+
+from scompose.project.leases import LeaseStore, Subnet
+
+
+def test_subnet():
+    print("Testing project.leases.Subnet")
+    subnet = Subnet("10.22.0.0/29")
+
+    # The gateway (.1) and broadcast (.7) are skipped
+    assert [subnet.allocate("app%s" % x) for x in range(1, 6)] == [
+        "10.22.0.2",
+        "10.22.0.3",
+        "10.22.0.4",
+        "10.22.0.5",
+        "10.22.0.6",
+    ]
+    assert subnet.allocate("app6") is None
+    assert subnet.allocate("app1") == "10.22.0.2"
+
+    # A released address goes back to its replica, and others after that
+    subnet.release("app2")
+    subnet.release("app4")
+    assert subnet.get("app2") is None
+    assert subnet.allocate("app4") == "10.22.0.5"
+    assert subnet.allocate("app6") == "10.22.0.3"
+    assert subnet.allocate("app2") is None
+
+    # A running instance keeps its address, taking it from a lease
+    subnet = Subnet("10.22.0.0/29", {"app1": "10.22.0.2", "app9": "10.99.0.2"})
+    assert list(subnet.leases) == ["app1"]
+    subnet.release("app1")
+    subnet.allocate("app2")
+    assert subnet.get("app2") == "10.22.0.3"
+    assert subnet.claim("app3", "10.22.0.3")
+    assert subnet.get("app2") is None
+    subnet.reserve("10.22.0.4")
+    assert subnet.allocate("app4") == "10.22.0.5"
+
+    # Released leases are kept (and read back) until their address is taken
+    content = subnet.to_dict()
+    assert content["released"] == {"app1": "10.22.0.2"}
+    assert (
+        Subnet(content["network"], content["leases"], content["released"]).to_dict()
+        == content
+    )
+
+
+def allocate(root, keys, queue):
+    store = LeaseStore(root)
+    for key in keys:
+        with store.open("10.22.0.0/16") as subnet:
+            queue.put(subnet.allocate(key))
+
+
+def test_lease_store(tmp_path):
+    print("Testing project.leases.LeaseStore")
+    root = os.path.join(tmp_path, "leases")
+    store = LeaseStore(root)
+    with store.open("10.22.0.0/16") as subnet:
+        assert subnet.allocate("app1") == "10.22.0.2"
+    assert store.get_networks() == ["10.22.0.0/16"]
+
+    # Processes allocating at once never get the same address
+    queue = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target=allocate,
+            args=(root, ["%s-%s" % (x, y) for y in range(25)], queue),
+        )
+        for x in range(4)
+    ]
+    [worker.start() for worker in workers]
+    [worker.join() for worker in workers]
+    found = [queue.get() for _ in range(100)]
+    assert len(set(found)) == 100 and "10.22.0.2" not in found
+    assert len(store.read("10.22.0.0/16").leases) == 101
+
+    # Releasing finds leases in any subnet
+    store.release(["app1", "missing"])
+    subnet = store.read("10.22.0.0/16")
+    assert subnet.get("app1") is None and subnet.released == {"app1": 2}
+    with store.open("10.22.0.0/16") as subnet:
+        assert subnet.allocate("app1") == "10.22.0.2"
+
+
+def test_reconcile(tmp_path, monkeypatch):
+    print("Testing project.leases.LeaseStore.reconcile")
+    store = LeaseStore(os.path.join(tmp_path, "leases"))
+    gone = os.path.join(tmp_path, "gone")
+    hidden = os.path.join(tmp_path, "hidden")
+    here = str(tmp_path)
+    with store.open("10.22.0.0/16") as subnet:
+        for key in ["app1", "app2", "app3"]:
+            subnet.allocate("%s:%s" % (gone, key))
+        subnet.allocate("%s:app4" % here)
+        subnet.allocate("%s:app5" % hidden)
+        subnet.release("%s:app3" % gone)
+
+    # A folder we can't look at (e.g., of another user) might still be there
+    stat = os.stat
+
+    def hide(path, *args, **kwargs):
+        if path == hidden:
+            raise PermissionError(path)
+        return stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "stat", hide)
+
+    # Leases of a project that was deleted go, unless the replica is running
+    with store.open("10.22.0.0/16", running={"app2": {}}) as subnet:
+        assert set(subnet.leases) == {
+            "%s:app2" % gone,
+            "%s:app4" % here,
+            "%s:app5" % hidden,
+        }
+        assert subnet.released == {}
+        assert subnet.allocate("new") == "10.22.0.2"
@@ -0,0 +1,278 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+
+import pytest
+
+from scompose.project import Project
+from scompose.project.sif import get_image_id
+from scompose.utils import write_yaml
+
+
+def write_config(tmp_path, instances):
+    """
+    Write a singularity-compose.yml to tmp_path, and change to it.
+    """
+    os.chdir(tmp_path)
+    write_yaml({"version": "2.0", "instances": instances}, "singularity-compose.yml")
+
+
+def test_lazy_instances(tmp_path):
+    print("Testing lazy creation of instances")
+    os.makedirs(os.path.join(tmp_path, "app"))
+    with open(os.path.join(tmp_path, "app", "Singularity"), "w") as fd:
+        fd.write("Bootstrap: docker\nFrom: busybox\n")
+
+    # The workers have a missing build context, which is only checked on use
+    write_config(
+        tmp_path,
+        {
+            "app": {"build": {"context": "app"}, "volumes": ["./data:/data"]},
+            "worker": {
+                "build": {"context": "missing"},
+                "deploy": {"replicas": 500},
+                "volumes_from": ["app"],
+            },
+        },
+    )
+    project = Project()
+    assert len(project.get_instance_names()) == 501
+    assert "worker500" in project.instances
+    assert project.instances.loaded() == []
+
+    instance = project.get_instance("app1")
+    assert instance.get_replica_name() == "app1"
+    assert project.instances.loaded() == [instance]
+
+    # Volumes from are derived from the config, without loading app1
+    assert project.get_volumes_from("worker") == ["./data:/data"]
+
+
+def test_dependency_order(tmp_path):
+    print("Testing depends_on order and cycles")
+    write_config(
+        tmp_path,
+        {
+            "nginx": {"image": "nginx.sif", "depends_on": ["app"]},
+            "app": {
+                "image": "app.sif",
+                "depends_on": ["db"],
+                "deploy": {"replicas": 2},
+            },
+            "db": {"image": "db.sif"},
+        },
+    )
+    project = Project()
+    assert project.get_instance_names() == ["db1", "app1", "app2", "nginx1"]
+
+    # A cycle is reported before any instance is created
+    write_config(
+        tmp_path,
+        {
+            "first": {"image": "first.sif", "depends_on": ["second"]},
+            "second": {"image": "second.sif", "depends_on": ["first"]},
+        },
+    )
+    project = Project()
+    assert project.get_instance_names() == ["first1", "second1"]
+    with pytest.raises(SystemExit):
+        project.create()
+    assert project.instances.loaded() == []
+
+
+def test_changes(tmp_path):
+    print("Testing launch specs and changes to recreate")
+    for name in ["db", "app", "nginx"]:
+        os.makedirs(os.path.join(tmp_path, name))
+        with open(os.path.join(tmp_path, name, "%s.sif" % name), "w") as fd:
+            fd.write(name)
+
+    instances = {
+        "db": {"image": "db/db.sif"},
+        "app": {"image": "app/app.sif", "depends_on": ["db"]},
+        "nginx": {"image": "nginx/nginx.sif"},
+    }
+    write_config(tmp_path, instances)
+    project = Project()
+
+    # Record specs as if all instances were started
+    binds = project.get_binds()
+    for instance in project.iter_instances(project.get_instance_names()):
+        name = instance.get_replica_name()
+        project.specs.set(name, instance.get_spec(binds, writable_tmpfs=True))
+    project.specs.save()
+    running = {x: {"ip": None} for x in project.get_instance_names()}
+    project._running = running
+    assert project.get_changes() == {}
+
+    # A new volume for db recreates it, and app that depends on it
+    instances["db"]["volumes"] = ["./db:/data"]
+    write_config(tmp_path, instances)
+    project = Project()
+    project._running = running
+    assert project.get_changes() == {
+        "db1": "changed volumes",
+        "app1": "depends on db",
+    }
+    assert project.get_changes(no_resolv=True)["db1"] == "changed volumes"
+    assert list(project.get_changes(["nginx1"])) == []
+
+    # Instances without a recorded spec are left alone
+    project.specs.data.pop("db1")
+    assert project.get_changes() == {}
+
+
+def test_rolling(tmp_path, monkeypatch):
+    print("Testing rolling restart helpers")
+    write_config(
+        tmp_path,
+        {
+            "app": {"image": "app.sif", "deploy": {"replicas": 3}},
+            "db": {"image": "db.sif"},
+        },
+    )
+    project = Project()
+    running = {"app2": {"ip": "10.22.0.2"}}
+    monkeypatch.setattr(project, "get_already_running", lambda: dict(running))
+
+    # Running instances keep their address, others skip it
+    assert project.get_ip_lookup(["app1", "app2", "app3"]) == {
+        "app1": "10.22.0.3",
+        "app2": "10.22.0.2",
+        "app3": "10.22.0.4",
+    }
+
+    # Replicas that didn't stop (app3) keep their lease
+    running["app3"] = {"ip": "10.22.0.4"}
+    project.release_ips(["app1", "app3"])
+    subnet = project.leases.read("10.22.0.0/16")
+    assert subnet.get(project.get_lease_key("app1")) is None
+    assert subnet.get(project.get_lease_key("app3")) == "10.22.0.4"
+
+    # Replicas keep their address when started again, until the subnet runs out
+    running.clear()
+    project._running = None
+    assert project.get_ip_lookup(["app3", "app1"]) == {
+        "app3": "10.22.0.4",
+        "app1": "10.22.0.3",
+    }
+
+    # Replicas that are gone (e.g., killed) let go of their lease
+    subnet = project.leases.read("10.22.0.0/16")
+    assert subnet.get(project.get_lease_key("app2")) is None
+    assert project.get_lease_key("app2") in subnet.released
+    with pytest.raises(SystemExit):
+        project.get_ip_lookup(["app1", "app2"], bridge="10.22.0.0/30")
+
+    # Extra replicas are numbered after the last one
+    surge = project._get_surge("app", 2)
+    assert [x.get_replica_name() for x in surge] == ["app4", "app5"]
+    assert project._get_surge("db", 0) == []
+
+    with pytest.raises(SystemExit):
+        project.roll(max_unavailable=0, max_surge=0)
+
+
+def test_sandbox(tmp_path):
+    print("Testing building instances as a sandbox")
+    os.makedirs(os.path.join(tmp_path, "app"))
+    with open(os.path.join(tmp_path, "app", "Singularity"), "w") as fd:
+        fd.write("Bootstrap: docker\nFrom: busybox\n")
+    write_config(
+        tmp_path,
+        {
+            "app": {"build": {"context": "app", "options": ["fakeroot"]}},
+            "db": {"image": "docker://postgres"},
+        },
+    )
+
+    # Only images built from a recipe can be a sandbox
+    project = Project(sandbox=True)
+    app = project.get_instance("app1")
+    db = project.get_instance("db1")
+    assert app.sandbox and not db.sandbox
+    assert app.get_image() == os.path.join(tmp_path, "app", "app.sandbox")
+    assert app.get_image(sandbox=False) == os.path.join(tmp_path, "app", "app.sif")
+    assert project.get_build_name(app) == "app.sandbox"
+    assert project.get_build_output(app) == app.get_image()
+
+    # A sandbox that exists is updated, unless we build without the cache
+    command, _, sudo = app.get_build_command(app.get_image())
+    assert command[-4:] == ["--fakeroot", "--sandbox", app.get_image(), "Singularity"]
+    assert not sudo
+    deffile = os.path.join(app.get_image(), ".singularity.d", "Singularity")
+    os.makedirs(os.path.dirname(deffile))
+    with open(deffile, "w") as fd:
+        fd.write("Bootstrap: docker\n")
+    assert "--update" in app.get_build_command(app.get_image())[0]
+    assert "--force" in app.get_build_command(app.get_image(), update=False)[0]
+
+    # An update changes the image id, so instances are recreated
+    image_id = get_image_id(app.get_image())
+    with open(deffile, "a") as fd:
+        fd.write("From: busybox\n")
+    assert get_image_id(app.get_image()) != image_id
+
+    # Without --sandbox, build.sandbox asks for one
+    assert not Project().get_instance("app1").sandbox
+    write_config(tmp_path, {"app": {"build": {"context": "app", "sandbox": True}}})
+    assert Project().get_instance("app1").sandbox
+
+
+def test_replica_templates(tmp_path):
+    print("Testing replicas sharing a template")
+    write_config(
+        tmp_path,
+        {
+            "worker": {
+                "image": "worker.sif",
+                "volumes": ["./data:/data"],
+                "deploy": {"replicas": 3},
+            },
+        },
+    )
+    project = Project()
+    first, second = project.get_instance("worker1"), project.get_instance("worker2")
+    assert first.template is second.template
+    assert first.client is project.client
+    with pytest.raises(AttributeError):
+        first.image = "other.sif"
+
+    # What a replica changes is its own
+    first.add_volumes(["./resolv.conf:/etc/resolv.conf"])
+    assert len(first.volumes) == 2
+    assert second.volumes == ("./data:/data",)
+    assert second.network == {"enable": True, "allocate_ip": True}
+    assert "network" not in project.config["instances"]["worker"]
+
+
+def test_pull_cache(tmp_path, monkeypatch):
+    print("Testing pulls use the Singularity cache as set")
+    from scompose.project.instance import Instance
+
+    cache = os.path.join(tmp_path, "singularity-cache")
+    os.makedirs(os.path.join(cache, "blob"))
+    monkeypatch.setenv("SINGULARITY_CACHEDIR", cache)
+    write_config(tmp_path, {"app": {"image": "docker://busybox"}})
+    project = Project()
+
+    seen = []
+
+    def build(self, working_dir, log_file=None, output=None, update=True):
+        seen.append(os.environ["SINGULARITY_CACHEDIR"])
+        with open(output, "wb") as fd:
+            fd.write(b"0" * 10)
+        return output
+
+    monkeypatch.setattr(Instance, "build", build)
+    instance = project.get_instance("app1")
+    assert project.pull_image(instance) == instance.get_image()
+    assert seen == [cache]
+    assert os.environ["SINGULARITY_CACHEDIR"] == cache
+    assert os.listdir(cache) == ["blob"]
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import time
+
+from scompose.project.cache import touch
+from scompose.project.prune import PruneSet, get_tmp_pid
+
+
+def write(path, size, used):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fd:
+        fd.write(b"0" * size)
+    os.utime(path, (used, used))
+    return path
+
+
+def test_get_tmp_pid():
+    print("Testing project.prune.get_tmp_pid")
+    assert get_tmp_pid("/app/app.sif.123.tmp") == 123
+    assert get_tmp_pid("/cache/images/key.sif.123.140234.tmp") == 123
+    assert get_tmp_pid("/store/tmp/0123abcd.123.sif") == 123
+    assert get_tmp_pid("/app/app.sif") is None
+
+
+def test_prune_select(tmp_path):
+    print("Testing project.prune.PruneSet.select")
+    now = time.time()
+    prune = PruneSet()
+    old = write(os.path.join(tmp_path, "old.sif"), 100, now - 300)
+    new = write(os.path.join(tmp_path, "new.sif"), 100, now - 100)
+    running = write(os.path.join(tmp_path, "running.sif"), 100, now - 400)
+    for path in [old, new, running]:
+        prune.add("cache", path)
+    prune.protect(running, "running")
+    assert prune.get_size() == 300
+
+    # Least recently used first, never the running image
+    assert [x.paths for x in prune.select(250)] == [[old]]
+    assert [x.paths for x in prune.select(0)] == [[old], [new]]
+    assert prune.select(300) == []
+
+    # Using a file makes it the most recently used, without changing mtime
+    mtime = os.stat(old).st_mtime_ns
+    touch(old)
+    assert os.stat(old).st_mtime_ns == mtime
+    prune = PruneSet()
+    for path in [old, new]:
+        prune.add("cache", path)
+    assert [x.paths for x in prune.select(150)] == [[new]]
+
+
+def test_prune_links(tmp_path):
+    print("Testing project.prune.PruneSet links")
+    now = time.time()
+    blob = write(os.path.join(tmp_path, "store", "blob.sif"), 100, now - 100)
+    image = os.path.join(tmp_path, "app", "app.sif")
+    other = os.path.join(tmp_path, "other", "other.sif")
+    for path in [image, other]:
+        os.makedirs(os.path.dirname(path))
+        os.link(blob, path)
+
+    # Another project links to the blob, so removing ours frees nothing
+    prune = PruneSet()
+    prune.add("store", blob)
+    prune.add("image", image)
+    assert len(list(prune)) == 1
+    assert prune.get_size() == 100
+    entry = list(prune)[0]
+    assert entry.kind == "image+store"
+    assert entry.reclaimable == 0
+    assert prune.select(0) == []
+
+    # Once it's gone, the blob and our image go together
+    os.remove(other)
+    prune = PruneSet()
+    prune.add("store", blob)
+    prune.add("image", image, "running")
+    assert prune.select(0) == []
+    prune = PruneSet()
+    prune.add("store", blob)
+    prune.add("image", image)
+    selected = prune.select(0)
+    assert selected[0].remove()
+    assert not os.path.exists(blob) and not os.path.exists(image)
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+import sys
+import time
+
+import pytest
+
+from scompose.project.runtime import AsyncRuntime, CommandError
+from scompose.project.scheduler import Scheduler
+
+
+class EchoClient:
+    """
+    Assemble commands that echo the singularity command instead.
+    """
+
+    def _init_command(self, action):
+        if not isinstance(action, list):
+            action = [action]
+        return ["echo", "singularity"] + action
+
+
+def test_runtime_commands():
+    print("Testing project.runtime.AsyncRuntime commands")
+    runtime = AsyncRuntime(EchoClient())
+    lines = []
+
+    async def main():
+        # Output and error are streamed, and returned
+        code = "import sys; print('one'); print('two', file=sys.stderr)"
+        result = await runtime.run_command(
+            [sys.executable, "-c", code], on_output=lines.append
+        )
+        assert result == {"return_code": 0, "message": "one\n", "error": "two\n"}
+        assert sorted(lines) == ["one", "two"]
+
+        # A failed command, optionally raised
+        result = await runtime.run_command([sys.executable, "-c", "exit(3)"])
+        assert result["return_code"] == 3
+        with pytest.raises(CommandError):
+            await runtime.run_command([sys.executable, "-c", "exit(3)"], check=True)
+
+        result = await runtime.start("app1", "app.sif", ["--hostname", "app1"], "x y")
+        assert result["message"] == (
+            "singularity instance start --hostname app1 app.sif app1 x y\n"
+        )
+        result = await runtime.stop("app1", timeout=5)
+        assert result["message"] == "singularity instance stop -t 5 app1\n"
+        result = await runtime.execute("instance://app1", "ls -l")
+        assert result["message"] == "singularity exec instance://app1 ls -l\n"
+
+    asyncio.run(main())
+
+
+def test_runtime_timeout():
+    print("Testing project.runtime.AsyncRuntime timeouts and cancellation")
+    runtime = AsyncRuntime(EchoClient(), limit=50)
+    sleep = [sys.executable, "-c", "import time; time.sleep(30)"]
+
+    async def main():
+        start = time.time()
+        with pytest.raises(asyncio.TimeoutError):
+            await runtime.run_command(sleep, timeout=0.5)
+
+        # Many commands on one loop, cancelled together
+        tasks = [asyncio.ensure_future(runtime.run_command(sleep)) for _ in range(20)]
+        await asyncio.sleep(0.5)
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert all(isinstance(x, asyncio.CancelledError) for x in results)
+        assert time.time() - start < 10
+
+    asyncio.run(main())
+
+
+def test_scheduler_async():
+    print("Testing project.scheduler.Scheduler on an event loop")
+    tasks = {"db1": [], "db2": [], "app1": ["db"], "nginx1": ["app"]}
+    groups = {"db": ["db1", "db2"], "app": ["app1"], "nginx": ["nginx1"]}
+    finished = []
+
+    async def run(name):
+        await asyncio.sleep(0.05)
+        if name == "nginx1":
+            raise RuntimeError("no config")
+        finished.append(name)
+
+    scheduler = Scheduler(workers=10)
+    assert not asyncio.run(scheduler.run_async(tasks, run, groups=groups))
+    assert sorted(finished[:2]) == ["db1", "db2"]
+    assert finished[2] == "app1"
+    assert list(scheduler.failed) == ["nginx1"]
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+import time
+
+from scompose.project.scheduler import Scheduler
+
+
+def test_scheduler_order():
+    print("Testing project.scheduler.Scheduler ordering")
+
+    # db and cache have no dependencies, app needs both, nginx needs app
+    tasks = {"nginx1": ["app1"], "app1": ["db1", "cache1"], "db1": [], "cache1": []}
+    finished = []
+    active = []
+    lock = threading.Lock()
+
+    def run(name):
+        with lock:
+            active.append(name)
+        time.sleep(0.05)
+        with lock:
+            finished.append((name, list(active)))
+            active.remove(name)
+
+    scheduler = Scheduler(workers=4)
+    assert scheduler.run(tasks, run)
+    order = [x[0] for x in finished]
+    assert order.index("app1") > order.index("db1")
+    assert order.index("app1") > order.index("cache1")
+    assert order[-1] == "nginx1"
+
+    # db and cache ran at the same time
+    assert any(set(x[1]) == {"db1", "cache1"} for x in finished)
+
+
+def test_scheduler_fail_fast():
+    print("Testing project.scheduler.Scheduler failures")
+    tasks = {"db1": [], "app1": ["db1"], "worker1": ["app1"]}
+
+    def run(name):
+        if name == "db1":
+            raise RuntimeError("no database")
+
+    scheduler = Scheduler(workers=2)
+    assert not scheduler.run(tasks, run)
+    assert list(scheduler.failed) == ["db1"]
+    assert scheduler.skipped == ["app1", "worker1"]
+
+
+def test_scheduler_cycle():
+    print("Testing project.scheduler.Scheduler cycles")
+    tasks = {"first1": ["second1"], "second1": ["first1"], "third1": []}
+    scheduler = Scheduler(workers=2)
+    assert not scheduler.run(tasks, lambda name: None)
+    assert scheduler.done == {"third1"}
+    assert sorted(scheduler.failed) == ["first1", "second1"]
+
+
+def test_scheduler_groups():
+    print("Testing project.scheduler.Scheduler with groups")
+    tasks = {"db1": [], "db2": [], "app1": ["db"], "app2": ["db"]}
+    groups = {"db": ["db1", "db2"], "app": ["app1", "app2"]}
+    started = []
+
+    def run(name):
+        started.append(name)
+        if name == "db2":
+            raise RuntimeError("no database")
+
+    # Apps need every replica of db
+    scheduler = Scheduler(workers=4, fail_fast=False)
+    assert not scheduler.run(tasks, run, groups=groups)
+    assert sorted(started) == ["db1", "db2"]
+    assert scheduler.skipped == ["app1", "app2"]
+
+
+def test_scheduler_required():
+    print("Testing project.scheduler.Scheduler with required counts")
+    tasks = {"db1": [], "db2": [], "db3": [], "app1": ["db"]}
+    groups = {"db": ["db1", "db2", "db3"]}
+    finished = []
+
+    def run(name):
+        if name == "db3":
+            raise RuntimeError("no database")
+        time.sleep(0.2 if name == "db2" else 0.01)
+        finished.append(name)
+
+    # app1 starts once one db is done, without waiting for the slow one
+    scheduler = Scheduler(workers=4, fail_fast=False)
+    assert not scheduler.run(tasks, run, groups=groups, required={"db": 1})
+    assert finished == ["db1", "app1", "db2"]
+
+    # Needing all three, app1 can't start
+    finished.clear()
+    scheduler.run(tasks, run, groups=groups, required={"db": 3})
+    assert scheduler.skipped == ["app1"]
+
+
+def test_scheduler_priority():
+    print("Testing project.scheduler.Scheduler priority")
+    tasks = {"quick1": [], "quick2": [], "slow1": []}
+    started = []
+
+    # With one worker, the slow task goes first
+    scheduler = Scheduler(workers=1, priority={"slow1": 20, "quick2": 1})
+    scheduler.run(tasks, started.append)
+    assert started == ["slow1", "quick2", "quick1"]
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import pytest
+
+from scompose.project.sif import (
+    DESCRIPTOR,
+    HEADER,
+    PARTITION,
+    SIF_MAGIC,
+    SIFError,
+    SIFImage,
+    get_image_id,
+)
+
+image_id = uuid.UUID("6ba7b810-9dad-11d1-80b4-00c04fd430c8")
+
+
+def make_sif(path, objects, modified=1700000100, free=2):
+    """
+    Write a SIF image with objects, each (data type, data, extra), and
+    free descriptors after them, the way the sif library lays it out.
+    """
+    total = len(objects) + free
+    offset = HEADER.size + total * DESCRIPTOR.size
+    table = b""
+    data = b""
+    for idx, (data_type, content, extra) in enumerate(objects):
+        table += DESCRIPTOR.pack(
+            data_type,
+            True,
+            idx + 1,
+            0xF0000001,
+            0,
+            offset + len(data),
+            len(content),
+            len(content),
+            1700000000,
+            1700000000,
+            0,
+            0,
+            b"object-%d" % idx,
+            extra,
+        )
+        data += content
+    table += b"\0" * DESCRIPTOR.size * free
+    header = HEADER.pack(
+        b"#!/usr/bin/env run-singularity\n",
+        SIF_MAGIC,
+        b"01\0",
+        b"02\0",
+        image_id.bytes,
+        1700000000,
+        modified,
+        free,
+        total,
+        HEADER.size,
+        len(table),
+        offset,
+        len(data),
+    )
+    with open(path, "wb") as fd:
+        fd.write(header + table + data)
+    return path
+
+
+def test_sif_image(tmp_path):
+    print("Testing project.sif.SIFImage")
+    rootfs = b"hsqs" + b"\0" * 4096
+    labels = {"maintainer": "vsoch"}
+    metadata = {"attributes": {"runscript": "#!/bin/sh\nexec app", "labels": {}}}
+    path = make_sif(
+        os.path.join(tmp_path, "app.sif"),
+        [
+            (0x4001, b"Bootstrap: docker\nFrom: busybox\n", b""),
+            (0x4003, json.dumps(labels).encode("utf-8"), b""),
+            (0x4006, json.dumps(metadata).encode("utf-8"), b""),
+            (0x4004, rootfs, PARTITION.pack(1, 2, b"02\0")),
+        ],
+    )
+
+    with SIFImage(path) as image:
+        assert image.id == str(image_id)
+        assert image.arch == "amd64"
+        assert image.created == 1700000000
+        assert image.identity == "sif:%s:1700000100" % image_id
+        assert [x.type for x in image.descriptors] == [
+            "deffile",
+            "labels",
+            "json",
+            "partition",
+        ]
+        primary = image.get_primary()
+        assert (primary.fs_type, primary.part_type, primary.arch) == (
+            "squashfs",
+            "primary",
+            "amd64",
+        )
+        assert primary.group == 1
+        assert image.get_digest(primary) == hashlib.sha256(rootfs).hexdigest()
+        assert image.get_deffile().startswith("Bootstrap: docker")
+        assert image.get_labels() == labels
+        assert image.get_runscript() == "#!/bin/sh\nexec app"
+
+
+def test_image_id(tmp_path):
+    print("Testing project.sif.get_image_id")
+    path = make_sif(os.path.join(tmp_path, "app.sif"), [])
+
+    # A copy is the same image, a modified image (e.g., signed) is not
+    copy = shutil.copy(path, os.path.join(tmp_path, "copy.sif"))
+    assert get_image_id(path) == get_image_id(copy)
+    make_sif(path, [], modified=1700000200)
+    assert get_image_id(path) != get_image_id(copy)
+
+    # Other files fall back to size and modification time
+    other = os.path.join(tmp_path, "other.sif")
+    with open(other, "w") as fd:
+        fd.write("not a sif")
+    stat = os.stat(other)
+    assert get_image_id(other) == "%s:%s" % (stat.st_size, stat.st_mtime_ns)
+    with pytest.raises(SIFError):
+        SIFImage(other)
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+
+
+class FakeClient:
+    """
+    A stand-in for the spython client that counts instance listings.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.calls = []
+
+    def instances(self, quiet=False, return_json=False, sudo=False):
+        self.calls.append(sudo)
+        return list(self.records.get(sudo, []))
+
+
+def test_instance_state_snapshot():
+    print("Testing project.state.InstanceState")
+    from scompose.project.state import InstanceState
+
+    client = FakeClient(
+        {
+            False: [{"instance": "app1", "pid": 1, "img": "app.sif", "ip": ""}],
+            True: [{"instance": "nginx1", "pid": 2, "img": "nginx.sif", "ip": ""}],
+        }
+    )
+    state = InstanceState(client, native=False)
+
+    # Each privilege level is listed once, no matter how often we look
+    for _ in range(10):
+        assert state.exists("app1")
+        assert not state.exists("nginx1")
+        assert state.exists("nginx1", sudo=True)
+    assert client.calls == [False, True]
+
+    assert state.get("app1")["pid"] == 1
+    assert state.get("db1") is None
+
+    # Invalidating one level only lists that level again
+    state.invalidate(sudo=True)
+    assert state.exists("nginx1", sudo=True)
+    assert state.exists("app1")
+    assert client.calls == [False, True, True]
+
+    state.invalidate()
+    state.list()
+    state.list(sudo=True)
+    assert client.calls == [False, True, True, False, True]
+
+
+def test_read_instance_files(tmp_path):
+    print("Testing project.state.read_instance_files")
+    from scompose.project.state import read_instance_files
+
+    user_dir = os.path.join(
+        tmp_path, ".singularity", "instances", "sing", "node1", "dinosaur"
+    )
+    instances = {"app1": os.getpid(), "gone1": 2**22 + 1}
+    for name, pid in instances.items():
+        os.makedirs(os.path.join(user_dir, name))
+        with open(os.path.join(user_dir, name, "%s.json" % name), "w") as fd:
+            json.dump({"pid": pid, "name": name, "image": "/tmp/app.sif"}, fd)
+
+    # Only instances with a live process are reported
+    records = read_instance_files(str(tmp_path), "dinosaur", hostname="node1")
+    assert [x["instance"] for x in records] == ["app1"]
+    assert records[0]["img"] == "/tmp/app.sif"
+    assert records[0]["ip"] == ""
+
+    # No instance folder means no instances
+    assert read_instance_files(str(tmp_path), "other", hostname="node1") == []
+
+    # An unreadable state file means we can't answer natively
+    with open(os.path.join(user_dir, "app1", "app1.json"), "w") as fd:
+        fd.write("{")
+    assert read_instance_files(str(tmp_path), "dinosaur", hostname="node1") is None
+
+
+def test_instance_watcher(tmp_path):
+    print("Testing project.watch.InstanceWatcher")
+    from scompose.project.watch import InstanceWatcher
+
+    folder = os.path.join(tmp_path, "sing", "node1", "dinosaur")
+    watcher = InstanceWatcher([folder])
+    if watcher.polling:
+        return
+
+    # Nothing happens, so we time out
+    assert not watcher.wait(timeout=0.1)
+
+    # A new instance folder (and its parents) is a change
+    os.makedirs(os.path.join(folder, "app1"))
+    assert watcher.wait(timeout=1)
+    assert not watcher.wait(timeout=0.1)
+
+    # So is a state file written inside of it
+    with open(os.path.join(folder, "app1", "app1.json"), "w") as fd:
+        fd.write("{}")
+    assert watcher.wait(timeout=1)
+    watcher.close()
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import threading
+import time
+
+from scompose.project.cache import link_file
+from scompose.project.store import ImageStore
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fd:
+        fd.write(content)
+
+
+def puller(content, pulls):
+    def pull(path):
+        pulls.append(path)
+        time.sleep(0.1)
+        write(path, content)
+        return path
+
+    return pull
+
+
+def test_store_add(tmp_path):
+    print("Testing project.store.ImageStore add and lookup")
+    store = ImageStore(os.path.join(tmp_path, "store"))
+    assert store.lookup("docker://busybox") is None
+
+    write(os.path.join(tmp_path, "busybox.sif"), "busybox")
+    write(os.path.join(tmp_path, "tagged.sif"), "busybox")
+    blob = store.add("docker://busybox", os.path.join(tmp_path, "busybox.sif"))
+    assert store.lookup("docker://busybox") == blob
+    assert not os.path.exists(os.path.join(tmp_path, "busybox.sif"))
+
+    # The same content under another uri is stored once
+    assert (
+        store.add("docker://busybox:1.36", os.path.join(tmp_path, "tagged.sif")) == blob
+    )
+    assert len(os.listdir(os.path.dirname(blob))) == 1
+    assert store.get_ref("docker://busybox:1.36")["size"] == 7
+
+
+def test_store_get(tmp_path):
+    print("Testing project.store.ImageStore pulls once")
+    store = ImageStore(os.path.join(tmp_path, "store"))
+    pulls = []
+    pull = puller("busybox", pulls)
+
+    found = []
+    threads = [
+        threading.Thread(
+            target=lambda: found.append(store.get("docker://busybox", pull))
+        )
+        for _ in range(4)
+    ]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+    assert len(pulls) == 1
+    assert len(set(found)) == 1 and os.path.exists(found[0])
+    assert os.listdir(os.path.join(tmp_path, "store", "tmp")) == []
+
+    # A failed pull isn't stored
+    assert store.get("docker://alpine", lambda path: None) is None
+    assert store.lookup("docker://alpine") is None
+
+
+def test_store_mirror(tmp_path):
+    print("Testing project.store.ImageStore mirror")
+    mirror = ImageStore(os.path.join(tmp_path, "mirror"))
+    mirror.get("docker://busybox", puller("busybox", []))
+    mirror.get("docker://busybox:1.36", puller("busybox", []))
+
+    pulls = []
+    store = ImageStore(os.path.join(tmp_path, "store"), mirror=mirror.root)
+    first = store.get("docker://busybox", puller("busybox", pulls))
+    second = store.get("docker://busybox:1.36", puller("busybox", pulls))
+    assert not pulls
+    assert first == second
+    assert os.listdir(os.path.dirname(first)) == [os.path.basename(first)]
+
+
+def test_link_file(tmp_path):
+    print("Testing project.cache.link_file")
+    src = os.path.join(tmp_path, "src.sif")
+    dest = os.path.join(tmp_path, "dest.sif")
+    write(src, "image")
+    link_file(src, dest)
+    assert os.path.samefile(src, dest)
+
+    # Linking again leaves nothing behind
+    link_file(src, dest)
+    assert sorted(os.listdir(tmp_path)) == ["dest.sif", "src.sif"]
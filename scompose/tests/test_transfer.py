@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import time
+
+import scompose.logger.progress as progress
+from scompose.logger.progress import ProgressBar
+from scompose.project.transfer import PullMonitor
+
+
+class Clock:
+    """A clock we move by hand, in place of the time module"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def strftime(self, *args):
+        return time.strftime(*args)
+
+    def gmtime(self, *args):
+        return time.gmtime(*args)
+
+
+def write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as fd:
+        fd.write(b"0" * size)
+
+
+def test_progress_bytes(monkeypatch):
+    print("Testing logger.progress.ProgressBar with bytes")
+    clock = Clock()
+    monkeypatch.setattr(progress, "time", clock)
+    bar = ProgressBar(width=10, hide=True, unit="B")
+    assert bar.format() == "0B 0B/s"
+
+    # 1M a second for four seconds, then 2M a second for ten
+    done = 0
+    for rate in [1024**2] * 4 + [2 * 1024**2] * 10:
+        clock.now += 1.01
+        done += rate
+        bar.update(done, 40 * 1024**2)
+    assert 1.9 * 1024**2 < bar.rate < 2.1 * 1024**2
+    assert 7.5 < bar.eta < 8.5
+    assert bar.format().startswith("[------    ] 24.0M/40.0M 2.0M/s 00:00:08")
+
+    record = bar.get_record()
+    assert record["progress"] == done
+    assert record["expected"] == 40 * 1024**2
+
+
+def test_pull_monitor(tmp_path):
+    print("Testing project.transfer.PullMonitor")
+    cache = os.path.join(tmp_path, "cache")
+    output = os.path.join(tmp_path, "app", "app.sif")
+    write(os.path.join(cache, "blob", "blobs", "sha256", "old"), 100)
+
+    seen = []
+    monitor = PullMonitor(output, seen.append, cache_dirs=[cache])
+    monitor.baseline = monitor.get_cache_size()
+    assert monitor.sample() == 0
+
+    # New layers in the cache, then the image made from them
+    write(os.path.join(cache, "blob", "blobs", "sha256", "layer"), 300)
+    write("%s.part" % output, 200)
+    assert monitor.sample() == 300
+    os.rename("%s.part" % output, output)
+    write(output, 250)
+    assert monitor.sample() == 450
+    assert seen == [0, 300, 450]
+
+    # Temporary files going away don't take progress back
+    os.remove(os.path.join(cache, "blob", "blobs", "sha256", "layer"))
+    assert monitor.sample() == 450
+
+    # Pulls running at once are both marked, one on its own isn't
+    with PullMonitor(output, seen.append, cache_dirs=[cache]) as first:
+        with PullMonitor(output, seen.append, cache_dirs=[cache]) as second:
+            pass
+    with PullMonitor(output, seen.append, cache_dirs=[cache]) as alone:
+        pass
+    assert first.overlapped and second.overlapped and not alone.overlapped
@@ -38,6 +38,7 @@ def test_write_bad_json(tmp_path):
     assert not os.path.exists(tmpfile)
     with pytest.raises(TypeError):
         write_json(bad_json, tmpfile)
+    assert os.listdir(tmp_path) == []
 
 
 def test_write_json(tmp_path):
@@ -92,3 +93,18 @@ def test_print_json():
 
     result = print_json({1: 1})
     assert result == '{\n    "1": 1\n}'
+
+
+def test_sizes():
+    print("Testing utils.format_size and parse_size")
+    from scompose.utils import format_size, parse_size
+
+    assert format_size(512) == "512B"
+    assert format_size(1536) == "1.5K"
+    assert format_size(10 * 1024**3) == "10.0G"
+    assert parse_size("1024") == 1024
+    assert parse_size("10G") == 10 * 1024**3
+    assert parse_size("1.5MiB") == int(1.5 * 1024**2)
+    assert parse_size(0) == 0
+    with pytest.raises(ValueError):
+        parse_size("ten")
@@ -0,0 +1,54 @@
+#!/usr/bin/python
+
+# Copyright (C) 2019-2024 Vanessa Sochat.
+
+# This Source Code Form is subject to the terms of the
+# Mozilla Public License, v. 2.0. If a copy of the MPL was not distributed
+# with this file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import os
+
+import scompose.project.cache as cache
+from scompose.project.cache import FileHashes
+
+
+def write(path, content):
+    with open(path, "wb") as fd:
+        fd.write(content)
+    return path
+
+
+def test_file_hashes(tmp_path, monkeypatch):
+    print("Testing project.cache.FileHashes.get_many")
+    hashed = []
+    hash_file = cache.hash_file
+    monkeypatch.setattr(cache, "hash_file", lambda x: hashed.append(x) or hash_file(x))
+
+    paths = [
+        write(os.path.join(tmp_path, "%s.sif" % idx), b"%d" % idx * 1000)
+        for idx in range(4)
+    ]
+    index = os.path.join(tmp_path, "hashes.json")
+    hashes = FileHashes(index)
+    digests = hashes.get_many(paths, jobs=2)
+    assert digests == {
+        x: hashlib.sha256(open(x, "rb").read()).hexdigest() for x in paths
+    }
+    assert sorted(hashed) == sorted(paths)
+    hashes.save()
+
+    # Unchanged files aren't read again, and neither are hard links to them
+    hashed.clear()
+    hashes = FileHashes(index)
+    link = os.path.join(tmp_path, "link.sif")
+    os.link(paths[0], link)
+    assert hashes.get_many(paths + [link])[link] == digests[paths[0]]
+    assert hashed == []
+
+    # A changed file is, and a digest we know already can be recorded
+    write(paths[1], b"changed")
+    hashes.get(paths[1])
+    assert hashed == [paths[1]]
+    hashes.set(paths[2], "abc")
+    assert hashes.get(paths[2]) == "abc"
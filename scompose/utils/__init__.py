@@ -13,9 +13,11 @@ import json
 import os
 import pwd
 import sys
+import threading
 from subprocess import PIPE, STDOUT, Popen
 
-import yaml
+# yaml and spython are imported where they are used: they are slow to import,
+# and commands like version or ps don't need them
 
 
 def get_installdir():
@@ -28,6 +30,23 @@ def get_userhome():
     return pwd.getpwuid(os.getuid())[5]
 
 
+_client = None
+
+
+def get_client():
+    """
+    Get the spython client, shared by a project and its instances. spython
+    is imported on first use, so commands that never run singularity (e.g.,
+    ps reads instance state files) don't pay for it.
+    """
+    global _client
+    if _client is None:
+        from spython.main import get_client
+
+        _client = get_client()
+    return _client
+
+
 def run_command(cmd, sudo=False):
     """run_command uses subprocess to send a command to the terminal.
 
@@ -57,6 +76,44 @@ def run_command(cmd, sudo=False):
     return output
 
 
+def format_uptime(seconds):
+    """format a number of seconds as a short uptime, e.g., 2d 03:04:05"""
+    seconds = max(int(seconds), 0)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    uptime = "%02d:%02d:%02d" % (hours, minutes, seconds)
+    if days:
+        uptime = "%dd %s" % (days, uptime)
+    return uptime
+
+
+# Units of sizes, e.g., 10G (powers of 1024, like du -h)
+SIZE_UNITS = ["B", "K", "M", "G", "T"]
+
+
+def format_size(size):
+    """format a number of bytes as a short size, e.g., 1.5G"""
+    for unit in SIZE_UNITS:
+        if size < 1024 or unit == SIZE_UNITS[-1]:
+            break
+        size /= 1024
+    if unit == "B":
+        return "%dB" % size
+    return "%.1f%s" % (size, unit)
+
+
+def parse_size(size):
+    """parse a size like 10G, 500M or 1024 (bytes) to a number of bytes"""
+    value = str(size).strip().upper().rstrip("IB") or "0"
+    unit = value[-1] if value[-1] in SIZE_UNITS else "B"
+    value = value.rstrip("".join(SIZE_UNITS)).strip()
+    try:
+        return int(float(value) * 1024 ** SIZE_UNITS.index(unit))
+    except ValueError:
+        raise ValueError("%s is not a valid size, e.g., 10G" % size)
+
+
 ################################################################################
 ## FOLDER OPERATIONS ###########################################################
 ################################################################################
@@ -120,6 +177,8 @@ def write_yaml(yaml_dict, filename, mode="w"):
     filename: the output file to write to
     pretty_print: if True, will use nicer formatting
     """
+    import yaml
+
     with open(filename, mode) as filey:
         filey.writelines(yaml.dump(yaml_dict))
     return filename
@@ -133,11 +192,14 @@ def _read_yaml(section, quiet=False):
     ==========
     section: a string of unparsed yaml content.
     """
+    import yaml
+
     metadata = {}
 
     # PyYaml vs pyaml have subtle differences
-    if hasattr(yaml, "FullLoader"):
-        docs = yaml.load_all(section, Loader=yaml.FullLoader)
+    loader = get_yaml_loader()
+    if loader is not None:
+        docs = yaml.load_all(section, Loader=loader)
     else:
         docs = yaml.load_all(section)
 
@@ -150,11 +212,47 @@ def _read_yaml(section, quiet=False):
     return metadata
 
 
+def get_yaml_loader():
+    """
+    Get the loader of libyaml (if PyYaml was built with it, it's many times
+    faster), or the one in Python.
+    """
+    import yaml
+
+    return getattr(yaml, "CFullLoader", None) or getattr(yaml, "FullLoader", None)
+
+
+def read_yaml_nodes(filename):
+    """
+    Read a yaml file like read_yaml, and also get the node of each document,
+    which knows the line each value is on. The file is only parsed once.
+    Returns the metadata and the list of nodes.
+    """
+    import yaml
+
+    stream = read_file(filename, readlines=False)
+    loader = (get_yaml_loader() or yaml.Loader)(stream)
+    metadata = {}
+    nodes = []
+    try:
+        while loader.check_node():
+            node = loader.get_node()
+            doc = loader.construct_document(node)
+            if isinstance(doc, dict):
+                metadata.update(doc)
+                nodes.append(node)
+    finally:
+        loader.dispose()
+    return metadata, nodes
+
+
 # Json
 
 
 def write_json(json_obj, filename, mode="w", print_pretty=True):
-    """write_json will (optionally,pretty print) a json object to file
+    """write_json will (optionally,pretty print) a json object to file. We
+    write to a temporary file and move it into place, so a reader (another
+    thread or process) never sees half a file.
 
     Parameters
     ==========
@@ -162,11 +260,18 @@ def write_json(json_obj, filename, mode="w", print_pretty=True):
     filename: the output file to write to
     pretty_print: if True, will use nicer formatting
     """
-    with open(filename, mode) as filey:
-        if print_pretty:
-            filey.writelines(print_json(json_obj))
-        else:
-            filey.writelines(json.dumps(json_obj))
+    if print_pretty:
+        content = print_json(json_obj)
+    else:
+        content = json.dumps(json_obj)
+    tmpfile = "%s.%s.%s.tmp" % (filename, os.getpid(), threading.get_ident())
+    try:
+        with open(tmpfile, mode) as filey:
+            filey.writelines(content)
+        os.replace(tmpfile, filename)
+    finally:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
     return filename
 
 